@@ -0,0 +1,222 @@
+import os
+import json
+import uuid
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+# Client for the Anthropic Message Batches API. The base URL follows the SDK's
+# ANTHROPIC_BASE_URL, so pointing it at mocks/anthropic_batches.py tests the whole flow offline.
+ANTHROPIC_BASE_URL = os.getenv('ANTHROPIC_BASE_URL', 'https://api.anthropic.com').rstrip('/')
+ANTHROPIC_VERSION = '2023-06-01'
+ANTHROPIC_BETA = 'message-batches-2024-09-24,prompt-caching-2024-07-31'
+
+# Per-batch limits of the API are 100,000 requests and 256 MB
+MAX_BATCH_REQUESTS = 100000
+MAX_BATCH_BYTES = 256 * 1024 * 1024
+# Allowed difference between the local clock and the API's when matching unrecorded batches
+CLOCK_SKEW = timedelta(minutes=5)
+
+
+class BatchClient:
+    def __init__(self, api_key, base_url=ANTHROPIC_BASE_URL):
+        self.base_url = base_url
+        self.headers = {
+            'x-api-key': api_key or '',
+            'anthropic-version': ANTHROPIC_VERSION,
+            'anthropic-beta': ANTHROPIC_BETA,
+            'content-type': 'application/json',
+        }
+
+    async def _request(self, session, method, url, payload=None):
+        async with session.request(method, url, headers=self.headers, json=payload) as response:
+            if response.status >= 400:
+                raise RuntimeError(f'Batch API returned {response.status}: {await response.text()}')
+            return await response.json()
+
+    async def create(self, session, requests):
+        return await self._request(session, 'POST', f'{self.base_url}/v1/messages/batches', {'requests': requests})
+
+    async def retrieve(self, session, batch_id):
+        return await self._request(session, 'GET', f'{self.base_url}/v1/messages/batches/{batch_id}')
+
+    # One page of batches, newest first
+    async def list(self, session, after_id=None, limit=100):
+        url = f'{self.base_url}/v1/messages/batches?limit={limit}' + (f'&after_id={after_id}' if after_id else '')
+        return await self._request(session, 'GET', url)
+
+    # Yields one result per request of an ended batch, read line by line from results_url
+    async def results(self, session, batch):
+        async with session.get(batch['results_url'], headers=self.headers) as response:
+            if response.status >= 400:
+                raise RuntimeError(f'Batch results returned {response.status}: {await response.text()}')
+            async for line in response.content:
+                if line.strip():
+                    yield json.loads(line)
+
+
+# custom_id allows at most 64 characters, a transaction hash without 0x is exactly that
+def custom_id_for(tx_hash):
+    return tx_hash[2:] if tx_hash.startswith('0x') else tx_hash
+
+def result_stats(result, model):
+    message = result['result']['message']
+    usage = message.get('usage', {})
+    return {
+        'provider': 'anthropic',
+        'batch': True,
+        'model': message.get('model') or model,
+        'input_tokens': usage.get('input_tokens'),
+        'output_tokens': usage.get('output_tokens'),
+        'cache_creation_input_tokens': usage.get('cache_creation_input_tokens') or 0,
+        'cache_read_input_tokens': usage.get('cache_read_input_tokens') or 0,
+    }
+
+def result_text(result):
+    if result.get('result', {}).get('type') != 'succeeded':
+        return None
+    content = result['result']['message'].get('content', [])
+    return ''.join(block.get('text', '') for block in content if block.get('type') == 'text')
+
+
+# Submitted batches are recorded in the bucket until their results have been written,
+# so a restarted run picks them up instead of resubmitting their transactions
+def state_prefix(network):
+    return f'{network}/transactions/batches/'
+
+def save_batch_state(bucket, network, state):
+    bucket.blob(f'{state_prefix(network)}{state["id"]}.json').upload_from_string(json.dumps(state))
+
+def delete_batch_state(bucket, network, batch_id):
+    bucket.blob(f'{state_prefix(network)}{batch_id}.json').delete()
+
+def load_batch_states(bucket, network):
+    return [json.loads(blob.download_as_string()) for blob in bucket.list_blobs(prefix=state_prefix(network)) if blob.name.endswith('.json')]
+
+def parse_time(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+# The state is first recorded as pending, before the batch is created, so a run that dies
+# between creating the batch and recording its id leaves a trace for resolve_pending_batches
+async def submit_batch(client, session, bucket, network, model, requests):
+    pending = {
+        'id': f'pending_{uuid.uuid4().hex}',
+        'pending': True,
+        'model': model,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'requests': {request['custom_id']: tx_hash for tx_hash, request in requests},
+    }
+    await asyncio.to_thread(save_batch_state, bucket, network, pending)
+    try:
+        batch = await client.create(session, [request for _, request in requests])
+    except RuntimeError:
+        # The API rejected the batch, so none was created
+        await asyncio.to_thread(delete_batch_state, bucket, network, pending['id'])
+        raise
+    state = {key: value for key, value in pending.items() if key != 'pending'}
+    state['id'] = batch['id']
+    await asyncio.to_thread(save_batch_state, bucket, network, state)
+    await asyncio.to_thread(delete_batch_state, bucket, network, pending['id'])
+    print(f'Submitted batch {batch["id"]} with {len(requests)} requests')
+    return state
+
+# Ids of the batches recorded by every network, since all of them share the batch list
+def load_recorded_batch_ids(bucket):
+    return {blob.name.rsplit('/', 1)[1][:-len('.json')] for blob in bucket.list_blobs(match_glob=f'{state_prefix("*")}*.json')}
+
+async def result_custom_ids(client, session, batch):
+    return {result.get('custom_id') async for result in client.results(session, batch)}
+
+# Pending states belong to runs that died while creating a batch. Each one adopts the oldest
+# unrecorded batch created after it whose results carry exactly its custom ids. Batches of the
+# same size that have not ended cannot be checked yet, so while one exists the state stays
+# pending for a later run. A pending state without any such batch is dropped, since its batch
+# was never created, and discovery finds its transactions again. Returns the resolved states
+# followed by the ones still pending.
+async def resolve_pending_batches(client, session, bucket, network, states):
+    pending = sorted((state for state in states if state.get('pending')), key=lambda state: parse_time(state['created_at']))
+    resolved = [state for state in states if not state.get('pending')]
+    if not pending:
+        return resolved
+
+    recorded = await asyncio.to_thread(load_recorded_batch_ids, bucket)
+    oldest = parse_time(pending[0]['created_at']) - CLOCK_SKEW
+    candidates = []
+    after_id = None
+    while True:
+        page = await client.list(session, after_id)
+        batches = page.get('data') or []
+        candidates.extend(batch for batch in batches if batch['id'] not in recorded and parse_time(batch['created_at']) >= oldest)
+        if not page.get('has_more') or not batches or parse_time(batches[-1]['created_at']) < oldest:
+            break
+        after_id = page.get('last_id') or batches[-1]['id']
+    candidates.sort(key=lambda batch: parse_time(batch['created_at']))
+
+    unresolved = []
+    for state in pending:
+        created_at = parse_time(state['created_at']) - CLOCK_SKEW
+        custom_ids = set(state['requests'])
+        adopted = None
+        unchecked = False
+        for batch in candidates:
+            if parse_time(batch['created_at']) < created_at or sum(batch['request_counts'].values()) != len(custom_ids):
+                continue
+            if batch['processing_status'] != 'ended':
+                unchecked = True
+            elif await result_custom_ids(client, session, batch) == custom_ids:
+                adopted = batch
+                break
+
+        if adopted:
+            candidates.remove(adopted)
+            recovered = {key: value for key, value in state.items() if key != 'pending'}
+            recovered['id'] = adopted['id']
+            await asyncio.to_thread(save_batch_state, bucket, network, recovered)
+            resolved.append(recovered)
+            print(f'Recovered unrecorded batch {adopted["id"]} with {len(custom_ids)} requests')
+        elif unchecked:
+            unresolved.append(state)
+            print(f'Keeping {state["id"]} pending until the batches that may be its own have ended')
+            continue
+        else:
+            print(f'No batch was created for {state["id"]}, its transactions will be submitted again')
+        await asyncio.to_thread(delete_batch_state, bucket, network, state['id'])
+    return resolved + unresolved
+
+# Polls a batch until it has ended and passes every succeeded explanation with its usage to
+# on_result, and the transaction of every other result to on_failure
+async def collect_batch(client, session, bucket, network, state, on_result, poll_interval, on_failure=None):
+    try:
+        written = await collect_results(client, session, state, on_result, poll_interval, on_failure)
+    except Exception as e:
+        # The state is kept, so the next run resumes collecting this batch
+        print(f'Error collecting batch {state["id"]}, it will be resumed on the next run: {str(e)}')
+        return
+    await asyncio.to_thread(delete_batch_state, bucket, network, state['id'])
+    print(f'Batch {state["id"]} ended: {written}/{len(state["requests"])} explanations written')
+
+async def collect_results(client, session, state, on_result, poll_interval, on_failure):
+    while True:
+        batch = await client.retrieve(session, state['id'])
+        if batch['processing_status'] == 'ended':
+            break
+        await asyncio.sleep(poll_interval)
+
+    written = 0
+    async for result in client.results(session, batch):
+        tx_hash = state['requests'].get(result.get('custom_id'))
+        text = result_text(result)
+        if not tx_hash:
+            continue
+        if not text:
+            print(f'Batch {state["id"]}: no explanation for {tx_hash} ({result.get("result", {}).get("type")})')
+            if on_failure:
+                on_failure(tx_hash)
+            continue
+        try:
+            await on_result(tx_hash, text, state['model'], result_stats(result, state['model']))
+            written += 1
+        except Exception as e:
+            print(f'Error writing batch result for {tx_hash}: {str(e)}')
+            if on_failure:
+                on_failure(tx_hash)
+    return written
@@ -0,0 +1,89 @@
+import os
+import sys
+import json
+import time
+import argparse
+import contextlib
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from run import percentile
+
+RPC_ENDPOINT = 'http://127.0.0.1:8545'
+SUMMARY = 'The sender swapped 1.5 WETH for 4,210 USDC on Uniswap V3. ' * 20
+
+
+# Per-request setup that classify_tx and categorize did before CategorizationService:
+# read and parse every config file, render the whole prompt and build new clients
+def legacy_setup(categorize):
+    with open(categorize.LABELS_FILE_PATH, 'r') as json_file:
+        label_list = json.load(json_file)
+    with open(categorize.PROBABILITY_CONFIG_PATH, 'r') as json_file:
+        probability_config = json.load(json_file)
+    with open(categorize.OUTPUT_FORMAT_PATH, 'r') as json_file:
+        res_format = json.load(json_file)
+    categorize.storage.Client().bucket(os.getenv('GCS_BUCKET_NAME'))
+    categorize.Flipside(os.getenv('FLIPSIDE_API_KEY'), os.getenv('FLIPSIDE_ENDPOINT_URL'))
+    categorize.AsyncWeb3(categorize.AsyncWeb3.AsyncHTTPProvider(RPC_ENDPOINT))
+    return categorize.prompt_structured_3(label_list, probability_config, SUMMARY, res_format)
+
+def service_setup(service):
+    service.reload_if_changed()
+    service.web3(RPC_ENDPOINT)
+    return service.build_prompt(SUMMARY)
+
+def measure(name, fn, requests):
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return {
+        'path': name,
+        'requests': requests,
+        'latency_ms': {
+            'p50': percentile(latencies, 50),
+            'p90': percentile(latencies, 90),
+            'p99': percentile(latencies, 99),
+            'max': max(latencies),
+        },
+    }
+
+def run(requests, reload_interval):
+    os.environ.setdefault('GCS_BUCKET_NAME', 'benchmark')
+    os.environ.setdefault('ANTHROPIC_API_KEY', 'benchmark')
+    # GCP clients need credentials, so their construction is stubbed out in both paths
+    with mock.patch('google.cloud.storage.Client'), mock.patch('google.cloud.bigquery.Client'):
+        cwd = os.getcwd()
+        os.chdir(ROOT)
+        try:
+            import categorize
+            service = categorize.CategorizationService(reload_interval=reload_interval)
+            if legacy_setup(categorize) != service_setup(service):
+                sys.exit('The pre-rendered prompt differs from the one rendered per request')
+            return [
+                measure('per_request_setup', lambda: legacy_setup(categorize), requests),
+                measure('categorization_service', lambda: service_setup(service), requests),
+            ]
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Per-request overhead of categorization before and after CategorizationService')
+    parser.add_argument('-n', '--requests', type=int, default=1000,
+                        help='Number of simulated requests per path (default: 1000)')
+    parser.add_argument('--reload-interval', type=float, default=5,
+                        help='Seconds between config change checks of the service (default: 5)')
+    args = parser.parse_args()
+
+    with contextlib.redirect_stdout(sys.stderr):
+        results = run(args.requests, args.reload_interval)
+    before, after = results
+    report = {
+        'results': results,
+        'p50_speedup': round(before['latency_ms']['p50'] / after['latency_ms']['p50'], 1) if after['latency_ms']['p50'] else None,
+    }
+    print(json.dumps(report, indent=4))
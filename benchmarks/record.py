@@ -0,0 +1,48 @@
+import os
+import argparse
+from dotenv import load_dotenv
+from google.cloud import storage
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES_DIR = os.path.join(ROOT, 'benchmarks', 'fixtures')
+
+# Full simulations above these sizes are filed as medium / pathological
+MEDIUM_SIZE = 100 * 1024
+PATHOLOGICAL_SIZE = 2 * 1024 * 1024
+
+load_dotenv()
+
+
+def tier_for_size(size):
+    if size >= PATHOLOGICAL_SIZE:
+        return 'pathological'
+    if size >= MEDIUM_SIZE:
+        return 'medium'
+    return 'small'
+
+# Copy stored full Tenderly responses from the bucket into the benchmark corpus
+def record(network, tx_hashes, tier=None):
+    bucket = storage.Client().bucket(os.getenv('GCS_BUCKET_NAME'))
+    for tx_hash in tx_hashes:
+        blob = bucket.blob(f'{network}/transactions/simulations/full/{tx_hash}.json')
+        if not blob.exists():
+            print(f'No full simulation stored for {tx_hash}')
+            continue
+        raw = blob.download_as_string()
+        fixture_tier = tier or tier_for_size(len(raw))
+        os.makedirs(os.path.join(FIXTURES_DIR, fixture_tier), exist_ok=True)
+        with open(os.path.join(FIXTURES_DIR, fixture_tier, f'{network}_{tx_hash}.json'), 'wb') as file:
+            file.write(raw)
+        print(f'Recorded {tx_hash} as {fixture_tier} ({len(raw)} bytes)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Record Tenderly simulations as benchmark fixtures')
+    parser.add_argument('tx_hashes', type=str, nargs='+', help='Transaction hashes with a stored full simulation')
+    parser.add_argument('-n', '--network', type=str, default='ethereum',
+                        help='Network the transactions belong to (default: ethereum)')
+    parser.add_argument('-t', '--tier', type=str, default=None, choices=['small', 'medium', 'pathological'],
+                        help='Force a tier instead of choosing one by size')
+    args = parser.parse_args()
+
+    record(args.network, args.tx_hashes, args.tier)
@@ -0,0 +1,214 @@
+import os
+import sys
+import json
+import time
+import copy
+import asyncio
+import argparse
+import tracemalloc
+import contextlib
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES_DIR = os.path.join(ROOT, 'benchmarks', 'fixtures')
+TIERS = ['small', 'medium', 'pathological']
+sys.path.insert(0, ROOT)
+
+
+# Import the pipeline modules with GCP, Anthropic and web3 clients stubbed out,
+# so the benchmark runs offline and measures only our own processing
+def import_pipeline():
+    os.environ.setdefault('ANTHROPIC_API_KEY', 'benchmark')
+    os.environ.setdefault('GCS_BUCKET_NAME', 'benchmark')
+    patches = [
+        mock.patch('google.cloud.bigquery.Client'),
+        mock.patch('google.cloud.storage.Client'),
+        mock.patch('google.auth.default', return_value=(None, None)),
+    ]
+    for patch in patches:
+        patch.start()
+    cwd = os.getcwd()
+    os.chdir(ROOT)
+    try:
+        import simulate
+        import label
+        import webserver
+    finally:
+        os.chdir(cwd)
+        for patch in patches:
+            patch.stop()
+    simulate.w3 = StubWeb3()
+    return simulate, label, webserver
+
+
+class StubCall:
+    async def call(self):
+        return 18
+
+class StubFunctions:
+    def decimals(self):
+        return StubCall()
+
+class StubContract:
+    functions = StubFunctions()
+
+class StubEth:
+    def contract(self, address, abi):
+        return StubContract()
+
+class StubWeb3:
+    eth = StubEth()
+
+    def to_checksum_address(self, address):
+        return address
+
+
+# Returns a result set shaped like Flipside's, labelling every queried address
+class StubFlipside:
+    def query(self, sql):
+        addresses = sql[sql.index('in (') + 4:sql.rindex(')')].replace("'", '').split(', ')
+        rows = [[address, 'name', 'label', 'type', 'subtype'] for address in addresses if address]
+        return [('query_id', 'benchmark'), ('status', 'finished'), ('columns', []), ('column_types', []), ('rows', rows)]
+
+
+def load_fixtures(tiers):
+    fixtures = []
+    for tier in tiers:
+        tier_dir = os.path.join(FIXTURES_DIR, tier)
+        if not os.path.isdir(tier_dir):
+            continue
+        for file_name in sorted(os.listdir(tier_dir)):
+            if file_name.endswith('.json'):
+                with open(os.path.join(tier_dir, file_name), 'r') as file:
+                    raw = file.read()
+                fixtures.append({'tier': tier, 'name': file_name, 'size': len(raw), 'data': json.loads(raw)})
+    return fixtures
+
+def percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return None
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+async def call(fn, arg):
+    result = fn(arg)
+    if asyncio.iscoroutine(result):
+        await result
+
+# Latencies are timed without tracemalloc, whose per-allocation overhead would skew them.
+# Peak memory is measured in a separate, traced pass over the inputs.
+async def measure(name, fn, inputs, repeat):
+    latencies = []
+    total_bytes = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for fixture, prepare in inputs:
+            arg = prepare()
+            call_start = time.perf_counter()
+            await call(fn, arg)
+            latencies.append((time.perf_counter() - call_start) * 1000)
+            total_bytes += fixture['size']
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    for fixture, prepare in inputs:
+        arg = prepare()
+        await call(fn, arg)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    calls = len(latencies)
+    return {
+        'function': name,
+        'calls': calls,
+        'throughput_per_second': round(calls / elapsed, 2) if elapsed else None,
+        'mb_per_second': round(total_bytes / elapsed / 1e6, 3) if elapsed else None,
+        'latency_ms': {
+            'p50': percentile(latencies, 50),
+            'p90': percentile(latencies, 90),
+            'p99': percentile(latencies, 99),
+            'max': max(latencies) if latencies else None,
+        },
+        'peak_memory_bytes': peak,
+    }
+
+
+async def run(fixtures, repeat):
+    simulate, label, webserver = import_pipeline()
+    flipside = StubFlipside()
+
+    prepared = []
+    for fixture in fixtures:
+        trimmed = await simulate.extract_useful_fields(copy.deepcopy(fixture['data']))
+        prepared.append((fixture, trimmed))
+
+    def call_trace_of(fixture):
+        return fixture['data'].get('transaction', {}).get('transaction_info', {}).get('call_trace') or {}
+
+    benchmarks = [
+        ('extract_useful_fields', simulate.extract_useful_fields,
+         [(fixture, lambda fixture=fixture: fixture['data']) for fixture, _ in prepared]),
+        ('clean_calltrace', simulate.clean_calltrace,
+         [(fixture, lambda fixture=fixture: [call_trace_of(fixture)]) for fixture, _ in prepared]),
+        ('truncate_json', lambda message: webserver.truncate_json(message, 'calls', 1),
+         [(fixture, lambda trimmed=trimmed: {'system': {'transaction_details': copy.deepcopy(trimmed)}}) for fixture, trimmed in prepared]),
+        ('fetch_address_labels', lambda trimmed: label.fetch_address_labels(trimmed, flipside, 'ethereum'),
+         [(fixture, lambda trimmed=trimmed: trimmed) for fixture, trimmed in prepared]),
+    ]
+
+    results = []
+    for name, fn, inputs in benchmarks:
+        results.append(await measure(name, fn, inputs, repeat))
+    return results
+
+
+def compare(results, baseline):
+    baseline = {result['function']: result for result in baseline['results']}
+    comparison = {}
+    for result in results:
+        base = baseline.get(result['function'])
+        if not base or not base['throughput_per_second'] or base['latency_ms']['p50'] is None:
+            continue
+        comparison[result['function']] = {
+            'throughput_change': round(result['throughput_per_second'] / base['throughput_per_second'] - 1, 4),
+            'p50_change': round(result['latency_ms']['p50'] / base['latency_ms']['p50'] - 1, 4) if base['latency_ms']['p50'] else None,
+            'peak_memory_change': round(result['peak_memory_bytes'] / base['peak_memory_bytes'] - 1, 4) if base['peak_memory_bytes'] else None,
+        }
+    return comparison
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline benchmark of the simulation processing pipeline')
+    parser.add_argument('-t', '--tiers', type=str, nargs='+', default=TIERS, choices=TIERS,
+                        help='Fixture tiers to run (default: all)')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='Number of passes over the corpus per function (default: 5)')
+    parser.add_argument('-o', '--output', type=str, default=None,
+                        help='Write the results as JSON to this file (default: stdout)')
+    parser.add_argument('-b', '--baseline', type=str, default=None,
+                        help='Compare against results previously written with --output')
+    args = parser.parse_args()
+
+    fixtures = load_fixtures(args.tiers)
+    if not fixtures:
+        sys.exit(f'No fixtures found in {FIXTURES_DIR}, record some with benchmarks/record.py')
+
+    report = {
+        'fixtures': {tier: sum(1 for fixture in fixtures if fixture['tier'] == tier) for tier in args.tiers},
+        'repeat': args.repeat,
+    }
+    # The pipeline prints progress messages, keep them out of the JSON report
+    with contextlib.redirect_stdout(sys.stderr):
+        report['results'] = asyncio.run(run(fixtures, args.repeat))
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            report['comparison'] = compare(report['results'], json.load(file))
+
+    output = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output)
+    else:
+        print(output)
@@ -2,15 +2,23 @@ import os
 import aiohttp
 import asyncio
 import requests
+import re
 import json
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from google.api_core.exceptions import NotFound
 from google.cloud import bigquery, storage
-from groq import Groq
 from web3 import Web3, AsyncWeb3
 from flipside import Flipside
 from label import fetch_address_labels
+from simulation_format import load_simulation
+from providers import llm_router
+from usage import record_usage, contract_of
+from explanations import get_explanation
+from fast_path import FAST_PATH, FAST_PATH_RULES_PATH, FastPathStats, load_rules, classify
 import time
+from datetime import datetime, timezone
 
 load_dotenv()
 
@@ -43,65 +51,93 @@ async def get_tx_details(tx_hash, web3):
         print("Error at get_tx_details: ", e)
 
 # Querying the Zero MEV api to check if the transaction at specified index is a MEV transaction
-async def mev_status(tx_index, tx_block):
+async def mev_status(tx_index, tx_block, session=None):
     try:
         url = f'https://data.zeromev.org/v1/mevBlock?block_number={tx_block}&count=1'
         mev_types = ['arb', 'frontrun', 'backrun', 'sandwich', 'liquid']
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                response = await response.json()
-                response = [item for item in response if item["tx_index"] == tx_index and item["mev_type"] in mev_types]
-
-                if response:
-                    response_printable = json.dumps(response, indent=4)
-                    tx_mev_status = "MEV status: This transaction is a MEV transaction: " + "\n" + response_printable
-                    print("Is MEV.")
-                else:
-                    tx_mev_status = "MEV status: This transaction is NOT a MEV transaction"
-
-                return tx_mev_status
+        if session is None:
+            async with aiohttp.ClientSession() as session:
+                return await mev_status(tx_index, tx_block, session)
+        async with session.get(url) as response:
+            response = await response.json()
+            response = [item for item in response if item["tx_index"] == tx_index and item["mev_type"] in mev_types]
+
+            if response:
+                response_printable = json.dumps(response, indent=4)
+                tx_mev_status = "MEV status: This transaction is a MEV transaction: " + "\n" + response_printable
+                print("Is MEV.")
+            else:
+                tx_mev_status = "MEV status: This transaction is NOT a MEV transaction"
+
+            return tx_mev_status
     except Exception as e:
         print("Error at mev_status: ", e)
         return "/"
 
-async def augment_summary (tx_summary, tx_tenderly_object, transaction_hash, web3, flipside, network):
+# Runs one enrichment or fetch step, returning None when it fails or takes longer than timeout
+async def with_timeout(name, step, timeout):
     try:
-        # Augmenting for Blob transactions
-        tx_details = await get_tx_details(transaction_hash, web3)
-        if tx_details['type'] == 3:
-            blob_status = "Transaction type: " + str(tx_details['type']) + ". This transaction is a Blob transaction."
-        else:
-            blob_status = "Transaction type: " + str(tx_details['type']) + ". This transaction is NOT a Blob transaction."
+        return await asyncio.wait_for(step, timeout)
+    except asyncio.TimeoutError:
+        print(f"{name} timed out after {timeout}s, omitting it")
+    except Exception as e:
+        print(f"Error at {name}: ", e)
+    return None
 
+async def no_labels():
+    return ""
 
-        # Augmenting for Contract Creation transactions
-        tx_receipt = await get_tx_receipt(transaction_hash, web3)
-        if tx_receipt['to'] == None:
-            contract_creations_status = "This transaction is Contract Creation transaction"
+# The enrichment steps run concurrently, each with its own timeout, and a signal that fails
+# or times out is left out of the summary instead of delaying it
+async def augment_summary (tx_summary, tx_tenderly_object, transaction_hash, web3, flipside, network, session=None):
+    try:
+        # MEV status needs the transaction's block and index, so it waits for the details
+        async def details_and_mev():
+            tx_details = await with_timeout('get_tx_details', get_tx_details(transaction_hash, web3), RPC_TIMEOUT)
+            if not tx_details or network != 'ethereum':
+                return tx_details, ""
+            tx_mev_status = await with_timeout('mev_status', mev_status(tx_details['transactionIndex'], tx_details['blockNumber'], session), MEV_TIMEOUT)
+            return tx_details, tx_mev_status or ""
+
+        # The Flipside client blocks, so it runs on the labels pool
+        if network != "mantle": # Flipside doesn't support mantle labels
+            fetch_labels = asyncio.get_running_loop().run_in_executor(labels_executor, fetch_address_labels, tx_tenderly_object, flipside, network)
+            labels_step = with_timeout('fetch_address_labels', fetch_labels, LABELS_TIMEOUT)
         else:
-            contract_creations_status = "This transaction is NOT a Contract Creation transaction."
+            labels_step = no_labels()
 
-        # Augmenting for MEV
-        if network == 'ethereum':
-            tx_index = tx_details['transactionIndex']
-            tx_block = tx_details['blockNumber']
-            tx_mev_status = await mev_status(tx_index, tx_block)
-        else:
-            tx_mev_status = ""
+        (tx_details, tx_mev_status), tx_receipt, contract_labels_json = await asyncio.gather(
+            details_and_mev(),
+            with_timeout('get_tx_receipt', get_tx_receipt(transaction_hash, web3), RPC_TIMEOUT),
+            labels_step,
+        )
 
         # Augmenting for contract names
-        if network != "mantle": # Flipside doesn't support mantle labels
-            contract_labels_json = fetch_address_labels(tx_tenderly_object, flipside, network)
-        else:
-            contract_labels_json = ""
-        tx_summary_tagged = tx_summary + str(contract_labels_json)
+        lines = [tx_summary + str(contract_labels_json or "")]
+
+        # Augmenting for Blob transactions
+        if tx_details:
+            if tx_details['type'] == 3:
+                lines.append("Transaction type: " + str(tx_details['type']) + ". This transaction is a Blob transaction.")
+            else:
+                lines.append("Transaction type: " + str(tx_details['type']) + ". This transaction is NOT a Blob transaction.")
+
+        # Augmenting for Contract Creation transactions
+        if tx_receipt:
+            if tx_receipt['to'] == None:
+                lines.append("This transaction is Contract Creation transaction")
+            else:
+                lines.append("This transaction is NOT a Contract Creation transaction.")
+
+        # Augmenting for MEV
+        if tx_mev_status:
+            lines.append(tx_mev_status)
 
         # Augmenting for functions called
         #tx_summary_augmented = add_functions(tx_summary_tagged, tx_tenderly_object)
 
         # Applying to summary
-        tx_summary_augmented = tx_summary_tagged + "\n" + blob_status + "\n" + contract_creations_status + "\n" + tx_mev_status
-        return tx_summary_augmented
+        return "\n".join(lines)
     
     except Exception as e:
         print("Error in augment_summary: ", e)
@@ -109,12 +145,35 @@ async def augment_summary (tx_summary, tx_tenderly_object, transaction_hash, web
 
         return tx_summary
 
+CONFIG_DIR = 'categorization_config'
+LABELS_FILE_PATH = f'{CONFIG_DIR}/ultrasound_labels.json'
+PROBABILITY_CONFIG_PATH = f'{CONFIG_DIR}/probability_config.json'
+OUTPUT_FORMAT_PATH = f'{CONFIG_DIR}/res_format.json'
+PROMPT_TEMPLATE_PATH = f'{CONFIG_DIR}/system_prompt_template.txt'
+MODEL = 'llama3-70b-8192'
+# Model calls per transaction, later ones ask the model to correct invalid output
+MAX_ATTEMPTS = 2
+# Timeouts in seconds of the enrichment steps and of the bucket reads
+RPC_TIMEOUT = float(os.getenv('CATEGORIZE_RPC_TIMEOUT', '5'))
+MEV_TIMEOUT = float(os.getenv('CATEGORIZE_MEV_TIMEOUT', '3'))
+LABELS_TIMEOUT = float(os.getenv('CATEGORIZE_LABELS_TIMEOUT', '10'))
+FETCH_TIMEOUT = float(os.getenv('CATEGORIZE_FETCH_TIMEOUT', '15'))
+# Flipside queries have no client-side timeout and keep running after LABELS_TIMEOUT, so they
+# get their own bounded pool instead of holding threads of the default executor that every
+# asyncio.to_thread of the webserver shares
+LABELS_THREADS = int(os.getenv('CATEGORIZE_LABELS_THREADS', '8'))
+labels_executor = ThreadPoolExecutor(max_workers=LABELS_THREADS, thread_name_prefix='categorize-labels')
+# Seconds between checks of the config files for changes
+CONFIG_RELOAD_INTERVAL = float(os.getenv('CATEGORIZATION_CONFIG_RELOAD_INTERVAL', '5'))
+# Stands in for the transaction summary, the last field of the template, when pre-rendering the prompt
+SUMMARY_SENTINEL = '\x00tx_summary\x00'
+
 # Formatting the system prompt template with config files
-def prompt_structured_3 (label_list, probability_config, tx_summary, res_format):
+def prompt_structured_3 (label_list, probability_config, tx_summary, res_format, system_prompt_template=None):
     try:
-        system_prompt_file = 'categorization_config/system_prompt_template.txt'
-        with open(system_prompt_file, 'r') as file:
-            system_prompt_template = file.read()
+        if system_prompt_template is None:
+            with open(PROMPT_TEMPLATE_PATH, 'r') as file:
+                system_prompt_template = file.read()
 
         prompt = system_prompt_template.format(label_list,probability_config,res_format,tx_summary)
             
@@ -122,128 +181,264 @@ def prompt_structured_3 (label_list, probability_config, tx_summary, res_format)
     except Exception as e:
         print("Exception at prompt_structured_3: ", e)
 
-# Running the model
-async def run_model (client, model, prompt):
+# Running the model in JSON mode, prompt is the prompt text or the messages of a follow-up
+async def run_model (client, model, prompt, stats=None):
     print("Initiating model")
     try:
-        chat_completion = client.chat.completions.create(
-            model= model, 
-            messages=[{"role": "user", "content": prompt}]
-        )
-        print("Chat completion: \n", chat_completion)
-        return chat_completion
+        output = await client.complete({
+            "model": model,
+            "max_tokens": 1024,
+            "messages": prompt if isinstance(prompt, list) else [{"role": "user", "content": prompt}],
+            "response_format": {"type": "json_object"},
+        }, {} if stats is None else stats)
+        print("Model output: \n", output)
+        return output
     except Exception as e:
         print("Error at run_model: ", e)
 
-async def classify_tx (transaction, simulation, explanation, network, rpc_endpoint):
 
-    # Load environment variables
-    GROQ_API_KEY = os.environ.get("GROQ_API_KEY")
-    LABELS_FILE_PATH = 'categorization_config/ultrasound_labels.json'
-    PROBABILITY_CONFIG_PATH = 'categorization_config/probability_config.json'
-    OUTPUT_FORMAT_PATH = 'categorization_config/res_format.json'
-    MODEL = 'llama3-70b-8192'
-    #ETH_RPC_ENDPOINT = os.environ.get("ETH_RPC_ENDPOINT")
-
-    flipside_api_key = os.getenv('FLIPSIDE_API_KEY')
-    flipside_endpoint_url = os.getenv('FLIPSIDE_ENDPOINT_URL')
-    flipside = Flipside(flipside_api_key, flipside_endpoint_url)
-
-    # Config clients
-    groq_client = Groq(api_key=GROQ_API_KEY,)
-    #web3 = Web3(Web3.HTTPProvider(ETH_RPC_ENDPOINT))
-    web3 = AsyncWeb3(AsyncWeb3.AsyncHTTPProvider(rpc_endpoint))
-
-    # Load the labels config file
-    with open(LABELS_FILE_PATH, "r") as json_file:
+def parse_probability(value):
+    if isinstance(value, str):
+        try:
+            value = float(value)
+        except ValueError:
+            pass
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not 0 <= value <= 1:
+        raise ValueError(f'probability {value!r} is not a number between 0 and 1')
+    return value
+
+# Parses model output into categories and validates them against res_format and the allowed
+# labels. JSON mode output normally parses as is, the lenient repairs (surrounding text,
+# single quotes, trailing commas, label case, unknown labels) cover fallback models without it.
+def parse_categories(output, res_format, allowed_labels):
+    if not output:
+        raise ValueError('the output is empty')
+    start, end = output.find('{'), output.rfind('}')
+    if start == -1 or end == -1:
+        raise ValueError('the output has no JSON object')
+    text = output[start:end + 1]
+    try:
+        categories = json.loads(text)
+    except ValueError:
+        try:
+            categories = json.loads(re.sub(r',\s*([}\]])', r'\1', text.replace("'", '"')))
+        except ValueError as e:
+            raise ValueError(f'the output is not valid JSON ({e})')
+
+    for key, template in res_format.items():
+        if not isinstance(categories.get(key), type(template)):
+            raise ValueError(f'"{key}" must be a JSON {"array" if isinstance(template, list) else type(template).__name__}')
+    labels, probabilities = categories['labels'], categories['probabilities']
+    if not labels:
+        raise ValueError('"labels" is empty')
+    if len(labels) != len(probabilities):
+        raise ValueError('"labels" and "probabilities" differ in length')
+
+    canonical = {label.lower(): label for label in allowed_labels}
+    valid = [(canonical[label.strip().lower()], parse_probability(probability))
+             for label, probability in zip(labels, probabilities) if isinstance(label, str) and label.strip().lower() in canonical]
+    if not valid:
+        raise ValueError(f'none of the labels {labels} is one of the allowed labels')
+    return {**categories, 'labels': [label for label, _ in valid], 'probabilities': [probability for _, probability in valid]}
+
+def read_if_exists(blob):
+    try:
+        return blob.download_as_text(timeout=FETCH_TIMEOUT)
+    except NotFound:
+        return None
+
+# Created once per process: holds the parsed configs, the prompt rendered up to the
+# transaction summary, and the storage, Flipside, web3 and HTTP clients shared by all
+# requests. Configs are reloaded when one of the files changes on disk.
+class CategorizationService:
+    def __init__(self, model=MODEL, reload_interval=CONFIG_RELOAD_INTERVAL):
+        self.model = model
+        self.reload_interval = reload_interval
+        self.bucket = storage.Client().bucket(os.getenv('GCS_BUCKET_NAME'))
+        self.flipside = Flipside(os.getenv('FLIPSIDE_API_KEY'), os.getenv('FLIPSIDE_ENDPOINT_URL'))
+        self.web3_clients = {}
+        self.session = None
+        self.mtimes = {}
+        self.checked_at = 0.0
+        self.fast_path_stats = FastPathStats()
+        self.load_configs()
+
+    def config_mtimes(self):
+        return {path: os.stat(path).st_mtime for path in (LABELS_FILE_PATH, PROBABILITY_CONFIG_PATH, OUTPUT_FORMAT_PATH, PROMPT_TEMPLATE_PATH, FAST_PATH_RULES_PATH)}
+
+    def load_configs(self):
+        mtimes = self.config_mtimes()
+        with open(LABELS_FILE_PATH, 'r') as json_file:
             label_list = json.load(json_file)
+        with open(PROBABILITY_CONFIG_PATH, 'r') as json_file:
+            probability_config = json.load(json_file)
+        with open(OUTPUT_FORMAT_PATH, 'r') as json_file:
+            res_format = json.load(json_file)
+        with open(PROMPT_TEMPLATE_PATH, 'r') as file:
+            template = file.read()
+
+        allowed_labels = [entry['label'] for entry in label_list]
+        fast_path_rules = load_rules(FAST_PATH_RULES_PATH, allowed_labels) if FAST_PATH else None
+
+        prefix, suffix = prompt_structured_3(label_list, probability_config, SUMMARY_SENTINEL, res_format, template).split(SUMMARY_SENTINEL)
+        self.label_list, self.probability_config, self.res_format, self.template = label_list, probability_config, res_format, template
+        self.allowed_labels, self.fast_path_rules = allowed_labels, fast_path_rules
+        self.prompt_prefix, self.prompt_suffix = prefix, suffix
+        self.mtimes = mtimes
+
+    # Keeps serving the previous configs if the new ones do not parse
+    def reload_if_changed(self):
+        now = time.monotonic()
+        if now - self.checked_at < self.reload_interval:
+            return
+        self.checked_at = now
+        try:
+            if self.config_mtimes() != self.mtimes:
+                self.load_configs()
+                print("Reloaded categorization configs")
+        except Exception as e:
+            print("Error reloading categorization configs: ", e)
+
+    # Categories for a transaction the fast path rules settle, None when it needs the LLM
+    def fast_path(self, tx_hash, simulation):
+        result = classify(self.fast_path_rules, simulation)
+        rule_name = result[0] if result else None
+        self.fast_path_stats.record(rule_name)
+        print(json.dumps({'action': 'categorize_fast_path', 'tx_hash': tx_hash, 'rule': rule_name}))
+        return result
+
+    def write_categories(self, network, tx_hash, output, usage):
+        self.bucket.blob(f'{network}/transactions/categories/{tx_hash}.json').upload_from_string(output)
+        # Usage is stored next to the categories rather than in them, as the categories blob is returned as is
+        if usage:
+            self.bucket.blob(f'{network}/transactions/categories_usage/{tx_hash}.json').upload_from_string(json.dumps(usage))
+
+    def build_prompt(self, tx_summary):
+        return self.prompt_prefix + tx_summary + self.prompt_suffix
+
+    def web3(self, rpc_endpoint):
+        if rpc_endpoint not in self.web3_clients:
+            self.web3_clients[rpc_endpoint] = AsyncWeb3(AsyncWeb3.AsyncHTTPProvider(rpc_endpoint))
+        return self.web3_clients[rpc_endpoint]
+
+    # Created lazily inside the running event loop
+    def get_session(self):
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession()
+        return self.session
+
+    # Returns the validated categories, or None, with the usage record of the last model call.
+    # Invalid output is sent back to the model with the reason, without redoing the enrichment.
+    async def classify_tx (self, transaction, simulation, explanation, network, rpc_endpoint):
+        self.reload_if_changed()
+        usage = None
+        try:
+            tx_summary_augmented = await augment_summary(explanation, simulation, transaction, self.web3(rpc_endpoint), self.flipside, network, self.get_session())
+            messages = [{"role": "user", "content": self.build_prompt(tx_summary_augmented)}]
+
+            for attempt in range(MAX_ATTEMPTS):
+                stats = {}
+                output = await run_model(llm_router, self.model, messages, stats)
+                if stats:
+                    usage = record_usage('categorize', stats, network=network, tx_hash=transaction, contract=contract_of(simulation),
+                                         prompt_text=self.template, attempt=attempt + 1)
+                try:
+                    return parse_categories(output, self.res_format, self.allowed_labels), usage
+                except ValueError as e:
+                    print(f"-- Problem tx: {transaction}, attempt {attempt + 1}: {e}")
+                    print("----- Problem output: ")
+                    print(output)
+                    if output:
+                        messages = messages[:1] + [
+                            {"role": "assistant", "content": output},
+                            {"role": "user", "content": f"That output is invalid: {e}. Reply with only the corrected JSON object."},
+                        ]
+            return None, usage
+
+        except Exception as e:
+            print("Error at classify_tx: ", e)
+            return None, usage
+
+    async def categorize (self, tx_hash, network, rpc_endpoint):
+        try:
+            print("--- Initiating categorization.")
+            start_time = time.time()
+            bucket = self.bucket
+
+            # Check if the categorization result already exists
+            print("Checking if the transaction has been categorized...")
+            category_blob = bucket.blob(f'{network}/transactions/categories/{tx_hash}.json')
+            # Only a missing blob means not categorized yet, a failed read fails the request
+            # instead of categorizing again and overwriting the stored categories
+            categories = await asyncio.wait_for(asyncio.to_thread(read_if_exists, category_blob), FETCH_TIMEOUT)
+            if categories:
+                print("Transaction ", tx_hash, " has already been categorized. Loading categories from buckets.")
+                print(categories)
+                try:
+                    return json.loads(categories)
+                except ValueError:
+                    # Categories written before JSON mode may use single quotes
+                    return json.loads(categories.replace("'",'"'))
+
+            print("Reading the simulation and explanation data...")
+            simulation_blob = bucket.blob(f'{network}/transactions/simulations/trimmed/{tx_hash}.json')
+            #explanation_blob = bucket.blob(f'{network}/transactions/explanations/{tx_hash}.json')
+            
+            # I am setting the bucket for reading explanation to Ethereum subfolder because all explanations are stored there until the issue is fixed
+            read_simulation = lambda: with_timeout('read simulation', asyncio.to_thread(simulation_blob.download_as_text, timeout=FETCH_TIMEOUT), FETCH_TIMEOUT)
+            read_explanation = lambda: with_timeout('read explanation', asyncio.to_thread(get_explanation, bucket, 'ethereum', tx_hash, fallback='any'), FETCH_TIMEOUT)
+            self.reload_if_changed()
+            if self.fast_path_rules is not None:
+                # The fast path only needs the simulation, the explanation is read when it does not fire
+                simulation_text = await read_simulation()
+                if not simulation_text:
+                    raise ValueError(f'No simulation stored for {tx_hash}')
+                simulation_data = load_simulation(simulation_text)
+                fast_path = self.fast_path(tx_hash, simulation_data)
+                if fast_path:
+                    rule_name, categories = fast_path
+                    output = json.dumps(categories)
+                    usage = {'kind': 'categorize', 'network': network, 'tx_hash': tx_hash, 'fast_path': rule_name, 'calibrated': categories['calibrated'], 'cost_usd': 0.0,
+                             'created_at': datetime.now(timezone.utc).isoformat()}
+                    await asyncio.to_thread(self.write_categories, network, tx_hash, output, usage)
+                    print(f"Categorization elapsed time: {time.time() - start_time} seconds")
+                    print("Categories (fast path): ", output)
+                    return categories
+                explanation = await read_explanation()
+            else:
+                # Read the simulation and explanation blobs concurrently
+                simulation_text, explanation = await asyncio.gather(read_simulation(), read_explanation())
+                if not simulation_text:
+                    raise ValueError(f'No simulation stored for {tx_hash}')
+                simulation_data = load_simulation(simulation_text)
+            if not explanation:
+                raise ValueError(f'No explanation stored for {tx_hash}')
+            explanation_data = json.dumps({key: explanation[key] for key in ('result', 'model', 'updated_at') if key in explanation})
+
+            categories, usage = await self.classify_tx(tx_hash, simulation_data, explanation_data, network, rpc_endpoint)
+            if not categories:
+                raise ValueError("Failed to categorize the transaction after multiple attempts.")
+            
+            output = json.dumps(categories)
 
-    # Load the probability config file
-    with open(PROBABILITY_CONFIG_PATH, "r") as json_file:
-        probability_config = json.load(json_file)
+            # Writing categories in the bucket
+            await asyncio.to_thread(self.write_categories, network, tx_hash, output, usage)
 
-    # Load the result format file
-    with open(OUTPUT_FORMAT_PATH, "r") as json_file:
-        res_format = json.load(json_file)
-    
-    # Specify the model
-    model = MODEL
+            end_time = time.time()
+            elapsed_time = end_time - start_time
 
-    try:
-        tx_summary_augmented = await augment_summary(explanation, simulation, transaction, web3, flipside, network)
-        prompt = prompt_structured_3(label_list, probability_config, tx_summary_augmented, res_format)
-        
-        output = await run_model(groq_client, model, prompt)
-
-        if output.choices:
-            # Checking if the output is alright; re-run the classification is off. 
-            # Necessary due to very rare occurences of model hallucination.
-            if 'labels' not in output.choices[0].message.content:
-                print("-- Problem tx: ", transaction)
-                print("----- Problem output: ")
-                print(output.choices[0].message.content)
+            print(f"Categorization elapsed time: {elapsed_time} seconds")
+            print("Categories: ", output)
+            return json.loads(output)
+        except Exception as e:
+            print("Error at categorize: ", e)
+            return json.loads('{"labels":[],"probabilities":[]}')
 
-        return output
 
-    except Exception as e:
-        print("Error at classify_tx: ", e)
+categorization_service = CategorizationService()
 
-async def categorize (tx_hash, network, rpc_endpoint):
-    try:
-        print("--- Initiating categorization.")
-        start_time = time.time()
-
-        # Read stored simulation and explanation for tx_hash from buckets
-        storage_client = storage.Client()
-        bucket_name = os.getenv("GCS_BUCKET_NAME")
-        bucket = storage_client.bucket(bucket_name)
-
-        # Check if the categorization result already exists
-        print("Checking if the transaction has been categorized...")
-        category_blob = bucket.blob(f'{network}/transactions/categories/{tx_hash}.json')
-        if category_blob.exists():
-            print("Transaction ", tx_hash, " has already been categorized. Loading categories from buckets.")
-            print(category_blob.download_as_text())
-            output = category_blob.download_as_text().replace("'",'"')
-            return json.loads(output)
+async def classify_tx (transaction, simulation, explanation, network, rpc_endpoint):
+    return await categorization_service.classify_tx(transaction, simulation, explanation, network, rpc_endpoint)
 
-        # Read the simulation blob
-        print("Reading the simulation data...")
-        simulation_blob = bucket.blob(f'{network}/transactions/simulations/trimmed/{tx_hash}.json')
-        simulation_data = json.loads(simulation_blob.download_as_text())
-
-        # Read the explanation blob
-        print("Reading the explanation data...")
-        #explanation_blob = bucket.blob(f'{network}/transactions/explanations/{tx_hash}.json')
-        
-        # I am setting the bucket for reading explanation to Ethereum subfolder because all explanations are stored there until the issue is fixed
-        explanation_blob = bucket.blob(f'ethereum/transactions/explanations/{tx_hash}.json')
-        explanation_data = explanation_blob.download_as_text()
-
-        max_retries = 2
-        for attempt in range(max_retries):
-            output = await classify_tx(tx_hash, simulation_data, explanation_data, network, rpc_endpoint)
-            if 'labels' in output.choices[0].message.content:
-                break
-            else:
-                print(f"Attempt {attempt + 1} failed. Retrying...")
-        
-        if 'labels' not in output.choices[0].message.content:
-            raise ValueError("Failed to categorize the transaction after multiple attempts.")
-        
-        output = output.choices[0].message.content.replace("'",'"')
-        print("Printing output... \n", output)
-
-        # Writing categories in the bucket
-        output_blob = bucket.blob(f'{network}/transactions/categories/{tx_hash}.json')
-        output_blob.upload_from_string(output)
-
-        end_time = time.time()
-        elapsed_time = end_time - start_time
-
-        print(f"Categorization elapsed time: {elapsed_time} seconds")
-        print("Categories: ", output)
-        return json.loads(output)
-    except Exception as e:
-        print("Error at categorize: ", e)
-        return json.loads('{"labels":[],"probabilities":[]}')
\ No newline at end of file
+async def categorize (tx_hash, network, rpc_endpoint):
+    return await categorization_service.categorize(tx_hash, network, rpc_endpoint)
@@ -0,0 +1,102 @@
+import os
+import json
+import argparse
+from datetime import datetime
+from dotenv import load_dotenv
+from google.api_core.exceptions import NotFound, PreconditionFailed
+from google.cloud import storage
+
+load_dotenv()
+
+# Append-only chat logs. Each session stores its context (system prompt, simulation and request
+# settings) once at {network}/transactions/chat_logs/{session_id}/context.json, and every turn as
+# one compact record at turns/{seq:06d}.json, so the stored size grows linearly with the turns.
+BUCKET_NAME = os.getenv('GCS_BUCKET_NAME')
+CONTEXT_KEYS = ['system', 'model', 'max_tokens', 'temperature']
+
+# Sessions whose context this process has already written
+written_contexts = set()
+
+
+def session_prefix(network, session_id):
+    return f'{network}/transactions/chat_logs/{session_id}/'
+
+def legacy_blob_name(network, session_id):
+    return f'{network}/transactions/chat_logs/chat_{session_id}.json'
+
+def dumps(value):
+    return json.dumps(value, separators=(',', ':'))
+
+def write_context(bucket, network, session_id, request_params):
+    session = (network, session_id)
+    if session in written_contexts:
+        return
+    context = {key: request_params[key] for key in CONTEXT_KEYS if key in request_params}
+    context['created_at'] = datetime.now().isoformat()
+    try:
+        # Only the first turn of a session creates it
+        bucket.blob(f'{session_prefix(network, session_id)}context.json').upload_from_string(dumps(context), if_generation_match=0)
+    except PreconditionFailed:
+        pass
+    written_contexts.add(session)
+
+# The turn number is the number of user messages the client sent, taken before any are
+# dropped to fit the prompt. A retried turn replaces its record.
+def turn_number(messages):
+    return sum(1 for message in messages if message['role'] == 'user')
+
+def append_turn(bucket, network, session_id, request_params, seq, response, usage=None):
+    write_context(bucket, network, session_id, request_params)
+    messages = request_params['messages']
+    turn = {
+        'seq': seq,
+        'user': messages[-1]['content'] if messages and messages[-1]['role'] == 'user' else None,
+        'assistant': response,
+        'usage': usage,
+        'created_at': datetime.now().isoformat(),
+    }
+    bucket.blob(f'{session_prefix(network, session_id)}turns/{seq:06d}.json').upload_from_string(dumps(turn))
+
+# The running summary of a session's older messages, shared by all webserver instances
+def load_summary(bucket, network, session_id):
+    try:
+        return json.loads(bucket.blob(f'{session_prefix(network, session_id)}summary.json').download_as_string())
+    except NotFound:
+        return None
+
+def save_summary(bucket, network, session_id, summary):
+    bucket.blob(f'{session_prefix(network, session_id)}summary.json').upload_from_string(dumps(summary))
+
+# Rebuilds a session as the request it was last sent with plus the reply: the context, all
+# messages and the usage of every turn. Sessions logged before the append-only layout are read as is.
+def load_chat(bucket, network, session_id):
+    prefix = session_prefix(network, session_id)
+    try:
+        chat = json.loads(bucket.blob(f'{prefix}context.json').download_as_string())
+    except NotFound:
+        legacy = bucket.blob(legacy_blob_name(network, session_id))
+        return json.loads(legacy.download_as_string()) if legacy.exists() else None
+
+    chat['messages'] = []
+    chat['usage'] = []
+    for blob in sorted(bucket.list_blobs(prefix=f'{prefix}turns/'), key=lambda blob: blob.name):
+        turn = json.loads(blob.download_as_string())
+        if turn.get('user') is not None:
+            chat['messages'].append({'role': 'user', 'content': turn['user']})
+        chat['messages'].append({'role': 'assistant', 'content': [{'type': 'text', 'text': turn['assistant']}]})
+        chat['usage'].append(turn.get('usage'))
+    return chat
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Print a stored chat session')
+    parser.add_argument('session_id', type=str, help='Chat session ID')
+    parser.add_argument('-n', '--network', type=str, default='ethereum', choices=['ethereum', 'arbitrum', 'avalanche', 'optimism'],
+                        help='Blockchain network of the session (default: ethereum)')
+    args = parser.parse_args()
+
+    bucket = storage.Client().bucket(BUCKET_NAME)
+    chat = load_chat(bucket, args.network, args.session_id)
+    if chat is None:
+        print(f'No chat log for session {args.session_id}')
+    else:
+        print(json.dumps(chat, indent=4))
@@ -0,0 +1,120 @@
+import json
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+# Only ask GCS for the fields work discovery needs, metadata carries the manifest record
+# of trimmed simulations so they can be filtered without downloading
+LIST_FIELDS = 'items(name,timeCreated,metadata),nextPageToken'
+
+# Object names under a prefix are transaction hashes, so splitting the key space at
+# 0x1..0xf gives 16 ranges that can be listed in parallel and together cover everything
+SHARD_BOUNDARIES = [f'0x{c}' for c in '123456789abcdef']
+
+# How far before the listing start the next --since-last-run listing starts, covering
+# clock skew between this machine and GCS
+CURSOR_SAFETY_MARGIN = timedelta(minutes=10)
+
+
+def shard_offsets(prefix):
+    bounds = [prefix + boundary for boundary in SHARD_BOUNDARIES]
+    return list(zip([None] + bounds, bounds + [None]))
+
+# Both {prefix}{tx_hash}.json and versioned {prefix}{tx_hash}/{version}.json belong to tx_hash
+def tx_hash_from_name(name, prefix):
+    if not name.endswith('.json') or not name.startswith(prefix):
+        return None
+    key = name[len(prefix):].split('/', 1)[0]
+    return key[:-len('.json')] if key.endswith('.json') else key
+
+async def list_shard(bucket, prefix, start_offset, end_offset, on_page):
+    pages = bucket.list_blobs(prefix=prefix, start_offset=start_offset, end_offset=end_offset, fields=LIST_FIELDS).pages
+
+    def fetch_page():
+        page = next(pages, None)
+        return None if page is None else list(page)
+
+    while True:
+        page = await asyncio.to_thread(fetch_page)
+        if page is None:
+            break
+        await on_page(page)
+
+# List a prefix with one paginated listing per key range, calling on_page as pages arrive
+async def list_prefix(bucket, prefix, on_page):
+    await asyncio.gather(*[list_shard(bucket, prefix, start, end, on_page) for start, end in shard_offsets(prefix)])
+
+async def list_tx_hashes(bucket, prefix):
+    tx_hashes = set()
+
+    async def on_page(page):
+        tx_hashes.update(tx_hash for tx_hash in (tx_hash_from_name(blob.name, prefix) for blob in page) if tx_hash)
+
+    await list_prefix(bucket, prefix, on_page)
+    return tx_hashes
+
+
+def cursor_blob(bucket, network, name):
+    return bucket.blob(f'{network}/transactions/cursors/{name}.json')
+
+def load_cursor(bucket, network, name):
+    blob = cursor_blob(bucket, network, name)
+    if not blob.exists():
+        return None
+    return datetime.fromisoformat(json.loads(blob.download_as_string())['created_after'])
+
+def save_cursor(bucket, network, name, created_after):
+    cursor_blob(bucket, network, name).upload_from_string(json.dumps({'created_after': created_after.isoformat()}))
+
+
+# Where the next --since-last-run picks up. Simulations written while the ranges are listed
+# can land in a range that was already listed, so the cursor is the listing start time minus
+# CURSOR_SAFETY_MARGIN rather than the newest creation time seen. It never passes the oldest
+# pending simulation whose explanation failed, so that one is retried by the next run.
+class DiscoveryCursor:
+    def __init__(self, margin=CURSOR_SAFETY_MARGIN):
+        self.started_at = datetime.now(timezone.utc)
+        self.margin = margin
+        self.created = {}
+        self.oldest_failure = None
+
+    def pending(self, tx_hash, time_created):
+        if time_created:
+            self.created[tx_hash] = time_created
+
+    def done(self, tx_hash):
+        self.created.pop(tx_hash, None)
+
+    def failed(self, tx_hash):
+        time_created = self.created.pop(tx_hash, None)
+        if time_created and (self.oldest_failure is None or time_created < self.oldest_failure):
+            self.oldest_failure = time_created
+
+    def value(self):
+        cursor = self.started_at - self.margin
+        if self.oldest_failure is not None:
+            # Listings skip simulations created at or before the cursor
+            cursor = min(cursor, self.oldest_failure - timedelta(microseconds=1))
+        return cursor
+
+
+# Work discovery by set difference: list the explained transactions once, then stream the
+# trimmed simulations and pass on every one without an explanation. With created_after,
+# only simulations created since then are considered. Pending simulations are registered
+# with cursor, whose value is saved once the work has been done.
+async def discover_pending(bucket, network, on_pending, created_after=None, cursor=None):
+    cursor = cursor or DiscoveryCursor()
+    explained = await list_tx_hashes(bucket, f'{network}/transactions/explanations/')
+    simulations_prefix = f'{network}/transactions/simulations/trimmed/'
+
+    async def on_page(page):
+        for blob in page:
+            tx_hash = tx_hash_from_name(blob.name, simulations_prefix)
+            if not tx_hash:
+                continue
+            if tx_hash in explained or (created_after and blob.time_created and blob.time_created <= created_after):
+                continue
+            cursor.pending(tx_hash, blob.time_created)
+            await on_pending(blob)
+
+    await list_prefix(bucket, simulations_prefix, on_page)
+    return cursor
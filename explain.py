@@ -1,18 +1,31 @@
 import os
 import json
 import asyncio
+import time
 import argparse
-from datetime import datetime
+import aiohttp
 from dotenv import load_dotenv
-from anthropic import AsyncAnthropic
-from groq import AsyncGroq
 from google.cloud import storage
+from simulation_format import load_simulation
+from prompt_format import format_prompt, estimate_tokens, PROMPT_INPUT_TOKEN_BUDGET
+from providers import llm_router, provider_for, context_window, estimate_request_tokens, text_of
+from usage import record_usage, contract_of
+from discovery import DiscoveryCursor, discover_pending, load_cursor, save_cursor, tx_hash_from_name
+from manifest import parse_metadata, simulation_metadata, matches
+from explanations import get_explanation, write_explanation
+from chat_log import append_turn, turn_number, load_summary, save_summary
+from batches import BatchClient, MAX_BATCH_BYTES, MAX_BATCH_REQUESTS, custom_id_for, load_batch_states, resolve_pending_batches, submit_batch, collect_batch
 
 load_dotenv()  # Load environment variables from .env file
 
 BUCKET_NAME = os.getenv('GCS_BUCKET_NAME')
 storage_client = storage.Client()
 bucket = storage_client.bucket(BUCKET_NAME)
+CURSOR_NAME = 'explain_discovery'
+
+# Static prompt prefixes (the system prompts and, in chat, the simulation) are marked for
+# prompt caching so repeated requests read them from the cache instead of paying full input cost
+PROMPT_CACHING = os.getenv('PROMPT_CACHING', 'true').lower() not in ('0', 'false', 'no')
 
 async def extract_json(string):
     start_index = string.find('{')
@@ -23,28 +36,164 @@ async def extract_json(string):
     result = string[start_index : end_index + 1]    
     return result
 
-async def read_json_files(network):
-    json_data = []
-    blobs = bucket.list_blobs(prefix=f'{network}/transactions/simulations/trimmed/')
-    for blob in blobs:
-        if blob.name.endswith('.json'):
-            file_path = blob.name
-            results_file_path = file_path.replace(f'{network}/transactions/simulations/trimmed/', f'{network}/transactions/explanations/')
-            if storage.Blob(results_file_path, bucket).exists():
-                continue
-            data = json.loads(blob.download_as_string())
-            if data['m'][0]['f'] in SKIP_FUNCTION_CALLS:
+# The texts are the stable prefix and get cache breakpoints, the tail changes between
+# requests and is sent after them uncached
+def cached_system(*texts, tail=None):
+    texts = [text for text in texts if text]
+    if not PROMPT_CACHING:
+        return '\n\n'.join(texts + [tail] if tail else texts)
+    blocks = [{'type': 'text', 'text': text, 'cache_control': {'type': 'ephemeral'}} for text in texts]
+    if tail:
+        blocks.append({'type': 'text', 'text': tail})
+    return blocks
+
+# Chat requests are fitted into the model's context window before they are sent. Messages
+# older than the last CHAT_KEEP_MESSAGES are folded into a running summary of the session,
+# which is sent as the last system block, after the cached ones. If that is not enough, the
+# simulation loses its deepest calls and then the oldest of the kept messages are dropped.
+CHAT_KEEP_MESSAGES = int(os.getenv('CHAT_KEEP_MESSAGES', '6'))
+CHAT_SUMMARY_MODEL = os.getenv('CHAT_SUMMARY_MODEL', 'claude-3-haiku-20240307')
+CHAT_SUMMARY_MAX_TOKENS = 1000
+CHAT_SUMMARY_CACHE_SIZE = 10000
+CHAT_SUMMARY_PROMPT = ("You summarize conversations between a user and an assistant about a blockchain transaction. "
+                       "Extend the summary so far with the new messages. Keep every question the user asked, the facts, "
+                       "addresses and amounts the assistant gave, and any conclusions. Reply with the summary only.")
+chat_summaries = {}
+
+def summary_block(summary):
+    return f'Summary of the earlier conversation:\n{summary}' if summary else None
+
+# Chat sends the system prompt first and the simulation second, so every session shares the
+# cached system prompt and every turn of a session also reuses the cached simulation
+def chat_system(system, summary=None, budget=None):
+    if not isinstance(system, dict):
+        return cached_system(system, tail=summary_block(summary))
+    context = {key: value for key, value in system.items() if key != 'system_prompt'}
+    return cached_system(system.get('system_prompt'), format_prompt(context, 'chat', budget=budget, indent=4), tail=summary_block(summary))
+
+# Summary of the older messages of a session, extended with the ones it does not cover yet
+async def running_summary(client, network, session_id, older):
+    key = (network, session_id)
+    cached = chat_summaries.get(key) or await asyncio.to_thread(load_summary, bucket, network, session_id)
+    covered, summary = (cached['messages'], cached['summary']) if cached else (0, None)
+    # The client sends the whole history, one that got shorter is a different conversation
+    if covered > len(older):
+        covered, summary = 0, None
+    if covered < len(older):
+        transcript = '\n\n'.join(f"{message['role']}: {text_of(message['content'])}" for message in older[covered:])
+        prompt = (f'Summary so far:\n{summary}\n\n' if summary else '') + f'New messages:\n{transcript}'
+        params = {
+            'model': CHAT_SUMMARY_MODEL,
+            'max_tokens': CHAT_SUMMARY_MAX_TOKENS,
+            'temperature': 0,
+            'system': CHAT_SUMMARY_PROMPT,
+            'messages': [{'role': 'user', 'content': [{'type': 'text', 'text': prompt}]}],
+        }
+        stats = {}
+        summary = await client.complete(params, stats)
+        record_usage('chat_summary', stats, network=network, prompt_text=CHAT_SUMMARY_PROMPT, session_id=session_id)
+        await asyncio.to_thread(save_summary, bucket, network, session_id, {'messages': len(older), 'summary': summary})
+    chat_summaries[key] = {'messages': len(older), 'summary': summary}
+    if len(chat_summaries) > CHAT_SUMMARY_CACHE_SIZE:
+        chat_summaries.pop(next(iter(chat_summaries)))
+    return summary
+
+# The request to send for a chat turn, estimated to fit the model's context window
+async def fit_chat(client, request_params, network, session_id):
+    system = request_params['system']
+    messages = request_params['messages']
+    budget = context_window(request_params['model']) - request_params.get('max_tokens', 0)
+    params = {**request_params, 'system': chat_system(system)}
+    tokens = estimate_request_tokens(params)
+    if tokens <= budget:
+        return params
+
+    # The kept messages have to start with a user message
+    split = max(0, len(messages) - CHAT_KEEP_MESSAGES)
+    while split > 0 and messages[split]['role'] != 'user':
+        split -= 1
+    summary = None
+    if split:
+        try:
+            summary = await running_summary(client, network, session_id, messages[:split])
+        except Exception as e:
+            print(f'Error summarizing chat {session_id}, dropping its older messages: {str(e)}')
+    messages = messages[split:]
+
+    prompt = system.get('system_prompt') if isinstance(system, dict) else system
+    simulation_budget = budget - estimate_request_tokens({'system': cached_system(prompt, tail=summary_block(summary)), 'messages': messages})
+    params = {**request_params, 'messages': messages, 'system': chat_system(system, summary, simulation_budget)}
+    dropped = 0
+    while estimate_request_tokens(params) > budget and len(messages) > 1:
+        drop = 2 if len(messages) > 2 else 1
+        messages = messages[drop:]
+        dropped += drop
+        params['messages'] = messages
+
+    print(json.dumps({
+        'action': 'chat_fit',
+        'session_id': session_id,
+        'budget': budget,
+        'tokens': tokens,
+        'fitted_tokens': estimate_request_tokens(params),
+        'summarized_messages': split,
+        'dropped_messages': dropped,
+    }))
+    return params
+
+# Streams a request through the LLM router, yielding each text delta with the request's input
+# token count. stats is filled with the provider, model, token usage and timings for record_usage.
+# fit(model) returns the request fitted to model, for failovers to a smaller context window.
+async def stream_message(client, request_params, stats=None, hedge=None, fit=None):
+    stats = {} if stats is None else stats
+    async for word in client.stream(request_params, stats, hedge, fit):
+        yield word, stats.get('input_tokens')
+
+def should_skip(metadata):
+    return not matches(metadata, SIMULATION_FILTERS)
+
+def simulation_tx_hash(network, file_path):
+    return tx_hash_from_name(file_path, f'{network}/transactions/simulations/trimmed/')
+
+# Producer: queue every trimmed simulation that has no explanation yet. Simulations with
+# metadata are filtered here, those stored without it after they have been downloaded.
+async def list_pending_files(network, name_queue, created_after=None, cursor=None):
+    cursor = cursor or DiscoveryCursor()
+
+    async def on_pending(blob):
+        metadata = parse_metadata(blob.metadata)
+        if metadata and should_skip(metadata):
+            cursor.done(simulation_tx_hash(network, blob.name))
+            return
+        await name_queue.put(blob.name)
+
+    return await discover_pending(bucket, network, on_pending, created_after, cursor)
+
+# Downloads pending simulations, drops skipped ones and queues the rest for explaining
+async def download_worker(network, name_queue, work_queue, cursor):
+    while True:
+        file_path = await name_queue.get()
+        if file_path is None:
+            break
+        try:
+            raw = await asyncio.to_thread(bucket.blob(file_path).download_as_string)
+            data = load_simulation(raw)
+            if should_skip(simulation_metadata(data, len(raw))):
+                cursor.done(simulation_tx_hash(network, file_path))
                 continue
-            json_data.append((file_path, data))
-    return json_data
+            await work_queue.put((file_path, data))
+        except Exception as e:
+            print(f'Error reading {file_path}: {str(e)}')
+            cursor.failed(simulation_tx_hash(network, file_path))
 
-async def get_cached_explanation(tx_hash, network):
-    blob = bucket.blob(f'{network}/transactions/explanations/{tx_hash}.json')
-    if blob.exists():
-        return json.loads(blob.download_as_string())
-    return None
+# The stored explanation for this prompt and model, or the newest compatible one
+async def get_cached_explanation(tx_hash, network, system_prompt=None, model=None):
+    return await asyncio.to_thread(get_explanation, bucket, network, tx_hash, system_prompt, model)
 
-async def explain_transaction(client, payload, network='ethereum', system_prompt=None, model="claude-3-haiku-20240307", max_tokens=2000, temperature=0, store_result=True):
+# The simulation is cut to what fits the model's context window next to the system prompt
+# and the answer, so explain requests also fit fallback models with a small window
+def build_explain_params(payload, system_prompt=None, model="claude-3-haiku-20240307", max_tokens=2000, temperature=0):
+    budget = min(PROMPT_INPUT_TOKEN_BUDGET, context_window(model) - max_tokens - estimate_tokens(system_prompt or ''))
     request_params = {
         'model': model,
         'max_tokens': max_tokens,
@@ -55,7 +204,7 @@ async def explain_transaction(client, payload, network='ethereum', system_prompt
                 "content": [
                     {
                         "type": "text",
-                        "text": json.dumps(payload)
+                        "text": format_prompt(payload, 'explain', budget=max(budget, 1))
                     }
                 ]
             }
@@ -63,23 +212,37 @@ async def explain_transaction(client, payload, network='ethereum', system_prompt
     }
 
     if system_prompt:
-        request_params['system'] = system_prompt
+        request_params['system'] = cached_system(system_prompt)
+    return request_params
+
+# stats is filled like in stream_message, plus stored once the explanation has been written
+async def explain_transaction(client, payload, network='ethereum', system_prompt=None, model="claude-3-haiku-20240307", max_tokens=2000, temperature=0, store_result=True, hedge=None, stats=None):
+    request_params = build_explain_params(payload, system_prompt, model, max_tokens, temperature)
+
+    # Failovers and hedges to a model with a smaller context window cut the simulation again
+    async def fit(fallback_model):
+        return build_explain_params(payload, system_prompt, fallback_model, max_tokens, temperature)
 
     explanation = ""
+    stats = {} if stats is None else stats
     try:
-        async with client.messages.stream(**request_params) as stream:
-            async for word in stream.text_stream:
-                yield word
-                explanation += word
+        async for word, _ in stream_message(client, request_params, stats, hedge, fit):
+            yield word
+            explanation += word
     except Exception as e:
         print(f"Error streaming explanation: {str(e)}")
-    
+
+    tx_hash = payload.get('hash')
+    usage = None
+    if explanation:
+        usage = record_usage('explain', stats, network=network, tx_hash=tx_hash, contract=contract_of(payload), prompt_text=system_prompt)
+
     if store_result:
         print("Writing explanation to buckets...")
-        tx_hash = payload.get('hash')
         if explanation and tx_hash:
             try:
-                await write_explanation_to_bucket(network, tx_hash, explanation, model)
+                await write_explanation_to_bucket(network, tx_hash, explanation, stats.get('model', model), usage, system_prompt)
+                stats['stored'] = True
             except Exception as e:
                 print(f'Error uploading explanation for {tx_hash}: {str(e)}')
 
@@ -120,6 +283,11 @@ async def remove_entries(json_object, num_entries_to_remove):
     except Exception as e:
         print("Error at remove_entries: ", e)
 
+def chat_tx_hash(system):
+    if not isinstance(system, dict):
+        return None
+    return system.get('transaction_details', {}).get('hash') or system.get('hash')
+
 async def chat(client, request_params, network, session_id):
 
     # Adding message constraint
@@ -134,30 +302,30 @@ async def chat(client, request_params, network, session_id):
                     Is there anything else about this transaction you would like to know?"
                 """
     request_params['messages'] = add_constraint(request_params['messages'], constraint)
+    system = request_params['system']
+    seq = turn_number(request_params['messages'])
+    stats = {}
+
+    # Failovers and hedges to a model with a smaller context window fit the request again
+    fit = lambda model: fit_chat(client, {**request_params, 'model': model}, network, session_id)
 
     try:
         response = ""
-        async with client.messages.stream(**request_params) as stream:
-            async for item in stream:
-                usage = item.message.usage if hasattr(item, 'message') and hasattr(item.message, 'usage') else None
-                usage = usage.input_tokens
-                async for word in stream.text_stream:
-                    yield word, usage
-                    response += word
+        params = await fit_chat(client, request_params, network, session_id)
+        async for word, usage in stream_message(client, params, stats, fit=fit):
+            yield word, usage
+            response += word
 
     except Exception as e:
         error_message = str(e)
+        # Last resort when the estimate was too low
         if "prompt is too long" in error_message:
             response = ""
-            request_params = await remove_entries(request_params, 8)
-
-            async with client.messages.stream(**request_params) as stream:
-                async for item in stream:
-                    usage = item.message.usage if hasattr(item, 'message') and hasattr(item.message, 'usage') else None
-                    usage = usage.input_tokens
-                    async for word in stream.text_stream:
-                        yield word, usage
-                        response += word
+            params = await remove_entries(params, 8)
+
+            async for word, usage in stream_message(client, params, stats):
+                yield word, usage
+                response += word
             
     except Exception as e:
         print(f"Error streaming response: {str(e)}")
@@ -165,119 +333,216 @@ async def chat(client, request_params, network, session_id):
     # Removing message constraint
     request_params['messages'] = remove_constraint(request_params['messages'], constraint)
 
-    request_params['system'] = json.loads(request_params['system']) # Back to json
-
-    request_params["messages"].append({"role": "assistant", "content": [{"type": "text", "text": json.dumps(response)}]})
-    
     if response:
+        usage = record_usage('chat', stats, network=network, tx_hash=chat_tx_hash(system), contract=contract_of(system),
+                             prompt_text=system.get('system_prompt') if isinstance(system, dict) else system, session_id=session_id)
         print("Writing chat to buckets...")
         try:
-            file_path = f'{network}/transactions/chat_logs/chat_{session_id}.json'
-            blob = bucket.blob(file_path)
-            blob.upload_from_string(json.dumps(request_params, indent = 4))
+            await asyncio.to_thread(append_turn, bucket, network, session_id, request_params, seq, response, usage)
         except Exception as e:
             print(f'Error uploading chat for chat {session_id}: {str(e)}')
             
 async def questions(client, request_params, network, session_id):
 
+    system = request_params['system']
+    stats = {}
+
+    # Failovers and hedges to a model with a smaller context window fit the request again
+    fit = lambda model: fit_chat(client, {**request_params, 'model': model}, network, session_id)
+
     try:
         response = ""
-        async with client.messages.stream(**request_params) as stream:
-            async for item in stream:
-                usage = item.message.usage if hasattr(item, 'message') and hasattr(item.message, 'usage') else None
-                usage = usage.input_tokens
-                async for word in stream.text_stream:
-                    yield word, usage
-                    response += word
+        params = await fit_chat(client, request_params, network, session_id)
+        async for word, usage in stream_message(client, params, stats, fit=fit):
+            yield word, usage
+            response += word
 
     except Exception as e:
         error_message = str(e)
+        # Last resort when the estimate was too low
         if "prompt is too long" in error_message:
             response = ""
-            request_params = await remove_entries(request_params, 8)
-
-            async with client.messages.stream(**request_params) as stream:
-                async for item in stream:
-                    usage = item.message.usage if hasattr(item, 'message') and hasattr(item.message, 'usage') else None
-                    usage = usage.input_tokens
-                    async for word in stream.text_stream:
-                        yield word, usage
-                        response += word
+            params = await remove_entries(params, 8)
+
+            async for word, usage in stream_message(client, params, stats):
+                yield word, usage
+                response += word
             
     except Exception as e:
         print(f"Error streaming response: {str(e)}")
 
+    if response:
+        record_usage('questions', stats, network=network, tx_hash=chat_tx_hash(system), contract=contract_of(system),
+                     prompt_text=system.get('system_prompt') if isinstance(system, dict) else system, session_id=session_id)
+
             
-async def write_explanation_to_bucket(network, tx_hash, explanation, model):
-    file_path = f'{network}/transactions/explanations/{tx_hash}.json'
-    blob = bucket.blob(file_path)
-    updated_at = datetime.now().isoformat()
-    blob.upload_from_string(json.dumps({'result': explanation, 'model': model, 'updated_at': updated_at}))
-
-async def process_json_file(async_client, file_path, data, network, semaphore, delay_time, system_prompt, model):
-    async with semaphore:
-        print(f'Analyzing: {file_path}...')
-        explanation = ""
-        async for item in explain_transaction(async_client, data, network=network, system_prompt=system_prompt, model=model):
-            explanation += item
-        if explanation and explanation != "":
-            tx_hash = data['hash']
-            await write_explanation_to_bucket(network, tx_hash, explanation, model)
-        else:
-            print(f'Error processing {file_path}')
+async def write_explanation_to_bucket(network, tx_hash, explanation, model, usage=None, system_prompt=None):
+    await asyncio.to_thread(write_explanation, bucket, network, tx_hash, explanation, model, system_prompt, usage)
+
+# explain_transaction stores the explanation together with its usage record.
+# Returns whether the explanation was stored.
+async def process_json_file(client, file_path, data, network, delay_time, system_prompt, model):
+    print(f'Analyzing: {file_path}...')
+    explanation = ""
+    stats = {}
+    async for item in explain_transaction(client, data, network=network, system_prompt=system_prompt, model=model, stats=stats):
+        explanation += item
+    if not explanation:
+        print(f'Error processing {file_path}')
+    # Requests are paced by the provider's rate limiter, this is only an optional extra pause
+    if delay_time:
         await asyncio.sleep(delay_time)
+    return bool(stats.get('stored'))
+
+async def explain_worker(client, work_queue, network, delay_time, system_prompt, model, cursor):
+    while True:
+        item = await work_queue.get()
+        if item is None:
+            break
+        file_path, data = item
+        tx_hash = simulation_tx_hash(network, file_path)
+        try:
+            stored = await process_json_file(client, file_path, data, network, delay_time, system_prompt, model)
+        except Exception as e:
+            print(f'Error processing {file_path}: {str(e)}')
+            stored = False
+        if stored:
+            cursor.done(tx_hash)
+        else:
+            cursor.failed(tx_hash)
+
+# Batch mode: groups pending simulations into Message Batches submissions instead of
+# streaming them one by one, and polls every submitted batch until its results are in
+async def batch_submitter(batch_client, session, work_queue, network, system_prompt, model, batch_size, in_flight, pollers, on_result, on_failure, poll_interval):
+    requests = []
+    size = 0
+
+    async def flush():
+        nonlocal requests, size
+        if requests:
+            state = await submit_batch(batch_client, session, bucket, network, model, requests)
+            pollers.append(asyncio.create_task(collect_batch(batch_client, session, bucket, network, state, on_result, poll_interval, on_failure)))
+        requests = []
+        size = 0
 
-async def main(network, delay_time, max_concurrent_connections, skip_function_calls, system_prompt_file, model):
-    global SKIP_FUNCTION_CALLS
-    SKIP_FUNCTION_CALLS = skip_function_calls
+    while True:
+        item = await work_queue.get()
+        if item is None:
+            break
+        file_path, data = item
+        tx_hash = data['hash']
+        if tx_hash in in_flight:
+            continue
+        request = {'custom_id': custom_id_for(tx_hash), 'params': build_explain_params(data, system_prompt, model)}
+        request_size = len(json.dumps(request))
+        if requests and (len(requests) >= batch_size or size + request_size > MAX_BATCH_BYTES):
+            await flush()
+        requests.append((tx_hash, request))
+        size += request_size
+    await flush()
+
+async def run_batches(network, work_queue, system_prompt, model, batch_size, poll_interval, discovery, cursor):
+    async def write_batch_result(tx_hash, explanation, model, stats):
+        usage = record_usage('explain_batch', stats, network=network, tx_hash=tx_hash, prompt_text=system_prompt)
+        await write_explanation_to_bucket(network, tx_hash, explanation, model, usage, system_prompt)
+        cursor.done(tx_hash)
+
+    batch_client = BatchClient(os.getenv('ANTHROPIC_API_KEY'))
+    async with aiohttp.ClientSession() as session:
+        # Resume batches submitted by an earlier run and keep their transactions out of new ones
+        states = await asyncio.to_thread(load_batch_states, bucket, network)
+        states = await resolve_pending_batches(batch_client, session, bucket, network, states)
+        in_flight = {tx_hash for state in states for tx_hash in state['requests'].values()}
+        # Transactions of states still pending are kept out too, a later run resolves them
+        resumed = [state for state in states if not state.get('pending')]
+        pollers = [asyncio.create_task(collect_batch(batch_client, session, bucket, network, state, write_batch_result, poll_interval, cursor.failed)) for state in resumed]
+        if resumed:
+            print(f'Resuming {len(resumed)} unfinished batches')
+
+        submitter = asyncio.create_task(batch_submitter(batch_client, session, work_queue, network, system_prompt, model, batch_size, in_flight, pollers, write_batch_result, cursor.failed, poll_interval))
+        await discovery
+        await work_queue.put(None)
+        await submitter
+        await asyncio.gather(*pollers, return_exceptions=True)
+
+async def main(network, delay_time, max_concurrent_connections, skip_function_calls, system_prompt_file, model, download_workers=8, use_cursor=False, batch=False, batch_size=1000, poll_interval=60, filters=None):
+    global SIMULATION_FILTERS
+    SIMULATION_FILTERS = {**(filters or {}), 'skip_functions': skip_function_calls}
 
     system_prompt = None
     if system_prompt_file:
         with open(system_prompt_file, 'r') as file:
             system_prompt = file.read()
 
-    json_data = await read_json_files(network)
-    
-    api_key = os.getenv('ANTHROPIC_API_KEY')
-    anthropic_client = AsyncAnthropic(api_key=api_key)
-    api_key_groq = os.getenv('GROQ_API_KEY')
-    groq_client = AsyncGroq(api_key=api_key_groq)
-    semaphore = asyncio.Semaphore(max_concurrent_connections)
-    
-    tasks = []
-    models={
-        "llama3-70b-8192":"groq",
-        "llama3-8b-8192":"groq",
-        "mixtral-8x7b-32768":"groq",
-        "gemma-7b-it":"groq",
-        "claude-3-haiku-20240307":"anthropic",
-        "claude-3-opus-20240229":"anthropic",
-        "claude-3-sonnet-20240229":"anthropic",
-    }
-    for file_path, data in json_data:
-        if models[model]=="groq":
-            task = asyncio.create_task(process_json_file(groq_client, file_path, data, network, semaphore, delay_time, system_prompt, model))
-        elif models[model]=="anthropic":
-            task = asyncio.create_task(process_json_file(anthropic_client, file_path, data, network, semaphore, delay_time, system_prompt, model))
-        else:
-            #Assume there is new model that was not added to models list, use Anthropic client by default
-            task = asyncio.create_task(process_json_file(anthropic_client, file_path, data, network, semaphore, delay_time, system_prompt, model))
-        tasks.append(task)
-    
-    await asyncio.gather(*tasks)
+    if batch and provider_for(model) != "anthropic":
+        raise ValueError(f'Batch mode is only available for Anthropic models, not {model}')
+
+    # Listing, downloading and explaining run concurrently, connected by bounded queues
+    # so explanations start as soon as the first simulations arrive and memory stays flat
+    name_queue = asyncio.Queue(maxsize=download_workers * 4)
+    work_queue = asyncio.Queue(maxsize=max_concurrent_connections * 2)
+    cursor = DiscoveryCursor()
+    downloaders = [asyncio.create_task(download_worker(network, name_queue, work_queue, cursor)) for _ in range(download_workers)]
+    created_after = load_cursor(bucket, network, CURSOR_NAME) if use_cursor else None
+
+    if batch:
+        async def discover():
+            await list_pending_files(network, name_queue, created_after, cursor)
+            for _ in downloaders:
+                await name_queue.put(None)
+            await asyncio.gather(*downloaders)
+
+        discovery = asyncio.create_task(discover())
+        await run_batches(network, work_queue, system_prompt, model, batch_size, poll_interval, discovery, cursor)
+        if use_cursor:
+            save_cursor(bucket, network, CURSOR_NAME, cursor.value())
+        return
+
+    explainers = [
+        asyncio.create_task(explain_worker(llm_router, work_queue, network, delay_time, system_prompt, model, cursor))
+        for _ in range(max_concurrent_connections)
+    ]
+
+    await list_pending_files(network, name_queue, created_after, cursor)
+    for _ in downloaders:
+        await name_queue.put(None)
+    await asyncio.gather(*downloaders)
+    for _ in explainers:
+        await work_queue.put(None)
+    await asyncio.gather(*explainers)
+    if use_cursor:
+        save_cursor(bucket, network, CURSOR_NAME, cursor.value())
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Blockchain Transaction Analyzer')
     parser.add_argument('-n', '--network', type=str, default='ethereum', choices=['ethereum', 'arbitrum', 'avalanche', 'optimism'],
                         help='Blockchain network to analyze transactions for (default: ethereum)')
-    parser.add_argument('-d', '--delay', type=float, default=1.2,
-                        help='Delay time between API requests in seconds (default: 1.2)')
-    parser.add_argument('-c', '--concurrency', type=int, default=1,
-                        help='Maximum number of concurrent connections to the API (default: 1)')
+    parser.add_argument('-d', '--delay', type=float, default=0,
+                        help='Extra delay after each explanation in seconds, requests are already paced by the rate limit headers (default: 0)')
+    parser.add_argument('-c', '--concurrency', type=int, default=8,
+                        help='Maximum number of concurrent explanations, the provider rate limiter keeps them under RPM/TPM (default: 8)')
     parser.add_argument('-s', '--skip', type=str, nargs='+', default=None,
                         help='List of function calls to skip (default: None, suggested: transfer approve transferFrom)')
+    parser.add_argument('--functions', type=str, nargs='+', default=None,
+                        help='Only explain transactions calling these top-level functions (default: None)')
+    parser.add_argument('--contracts', type=str, nargs='+', default=None,
+                        help='Only explain transactions sent to these contracts (default: None)')
+    parser.add_argument('--status', type=str, choices=['success', 'failed'], default=None,
+                        help='Only explain successful or failed transactions (default: both)')
+    parser.add_argument('--max-size', type=int, default=None,
+                        help='Skip simulations larger than this many bytes (default: None)')
     parser.add_argument('-p', '--prompt', type=str, default=None,
                         help='Path to the file containing the system prompt (default: None)')
+    parser.add_argument('-w', '--download-workers', type=int, default=8,
+                        help='Number of concurrent simulation downloads feeding the explainers (default: 8)')
+    parser.add_argument('--since-last-run', action='store_true',
+                        help='Only consider simulations created since the last run that used this flag')
+    parser.add_argument('-b', '--batch', action='store_true',
+                        help='Submit explanations through the Message Batches API instead of streaming them')
+    parser.add_argument('--batch-size', type=int, default=1000,
+                        help=f'Maximum requests per batch in batch mode (default: 1000, at most {MAX_BATCH_REQUESTS})')
+    parser.add_argument('--poll-interval', type=float, default=60,
+                        help='Seconds between batch status checks in batch mode (default: 60)')
     parser.add_argument('-m', '--model', type=str, default='claude-3-haiku-20240307',
                         help='Model to use for generating explanations (default: claude-3-haiku-20240307)')
     args = parser.parse_args()
@@ -288,5 +553,12 @@ if __name__ == '__main__':
     skip_function_calls = args.skip
     system_prompt_file = args.prompt
     model = args.model
+    filters = {
+        'functions': args.functions,
+        'contracts': args.contracts,
+        'status': None if args.status is None else args.status == 'success',
+        'max_size': args.max_size,
+    }
 
-    asyncio.run(main(network, delay_time, max_concurrent_connections, skip_function_calls, system_prompt_file, model))
+    asyncio.run(main(network, delay_time, max_concurrent_connections, skip_function_calls, system_prompt_file, model, args.download_workers, args.since_last_run,
+                     args.batch, min(args.batch_size, MAX_BATCH_REQUESTS), args.poll_interval, filters))
@@ -0,0 +1,87 @@
+import os
+import json
+import hashlib
+from datetime import datetime
+from usage import prompt_id
+
+# Explanations are stored per prompt and model version at
+# {network}/transactions/explanations/{tx_hash}/{version}.json, where the version is a hash of
+# the system prompt and the model that produced it. The prompt and model are also blob
+# metadata, so fallbacks are matched from the listing without downloads. Explanations written
+# before versioning live at {tx_hash}.json, their prompt is unknown and they are served as
+# the last fallback.
+#
+# EXPLANATION_FALLBACK decides what a lookup may return when the current version is missing:
+# "prompt" the newest explanation made with the same system prompt by any model, else the
+# unversioned one while no version exists, "any" the newest explanation of any version,
+# "none" only the current version.
+EXPLANATION_FALLBACK = os.getenv('EXPLANATION_FALLBACK', 'prompt')
+
+
+def explanations_prefix(network):
+    return f'{network}/transactions/explanations/'
+
+def explanation_version(system_prompt, model):
+    return hashlib.sha256(f'{model}\n{system_prompt or ""}'.encode()).hexdigest()[:12]
+
+def explanation_blob_name(network, tx_hash, version=None):
+    if version is None:
+        return f'{explanations_prefix(network)}{tx_hash}.json'
+    return f'{explanations_prefix(network)}{tx_hash}/{version}.json'
+
+# The version of an explanation blob name, None for the legacy layout
+def version_from_name(name):
+    parts = name.rsplit('/', 2)
+    if len(parts) < 3 or not parts[2].endswith('.json') or not parts[1].startswith('0x'):
+        return None
+    return parts[2][:-len('.json')]
+
+def write_explanation(bucket, network, tx_hash, explanation, model, system_prompt=None, usage=None):
+    version = explanation_version(system_prompt, model)
+    result = {
+        'result': explanation,
+        'model': model,
+        'prompt_id': prompt_id(system_prompt),
+        'version': version,
+        'updated_at': datetime.now().isoformat(),
+    }
+    if usage:
+        result['usage'] = usage
+    blob = bucket.blob(explanation_blob_name(network, tx_hash, version))
+    blob.metadata = {'prompt_id': result['prompt_id'] or '', 'model': model}
+    blob.upload_from_string(json.dumps(result))
+    return result
+
+def read_blob(blob):
+    return json.loads(blob.download_as_string())
+
+# Versions written before the prompt was stored as metadata are downloaded to read it
+def blob_prompt_id(blob):
+    if blob.metadata and 'prompt_id' in blob.metadata:
+        return blob.metadata['prompt_id'] or None
+    return read_blob(blob).get('prompt_id')
+
+# The explanation of tx_hash for system_prompt and model, or the newest compatible one
+def get_explanation(bucket, network, tx_hash, system_prompt=None, model=None, fallback=None):
+    fallback = fallback or EXPLANATION_FALLBACK
+    if model:
+        blob = bucket.blob(explanation_blob_name(network, tx_hash, explanation_version(system_prompt, model)))
+        if blob.exists():
+            return read_blob(blob)
+        if fallback == 'none':
+            return None
+
+    current_prompt = prompt_id(system_prompt)
+    versions = sorted(bucket.list_blobs(prefix=f'{explanations_prefix(network)}{tx_hash}/'), key=lambda blob: blob.updated, reverse=True)
+    for blob in versions:
+        if fallback == 'any' or not model or blob_prompt_id(blob) == current_prompt:
+            return read_blob(blob)
+
+    # The explanation stored before versioning predates every version, so any version,
+    # even of another prompt, means the legacy one was made with an outdated prompt
+    if versions and fallback != 'any':
+        return None
+    blob = bucket.blob(explanation_blob_name(network, tx_hash))
+    if blob.exists():
+        return read_blob(blob)
+    return None
@@ -0,0 +1,172 @@
+import os
+import json
+import argparse
+from collections import Counter
+from dotenv import load_dotenv
+from google.api_core.exceptions import NotFound
+from google.cloud import storage
+from simulation_format import load_simulation
+
+load_dotenv()
+
+# Rule-based fast path of categorization: transactions whose stored simulation clearly matches
+# a rule in fast_path_rules.json (plain ETH transfers and ERC-20 transfers) get the
+# rule's labels and probabilities without the explanation, the enrichment and the LLM call.
+# Until a rule's probabilities have been set from a calibrate run and its "calibrated" flag
+# turned on, they are placeholders, and its categories say so with "calibrated": false.
+# A rule matches when all of its conditions hold:
+#   status                  the transaction succeeded (true) or reverted (false)
+#   functions               top-level function names, "" for a call without calldata
+#   calls_within_functions  every call in the trace is to one of functions (e.g. proxy delegatecalls)
+#   empty_input             the top-level call has no calldata
+#   nonzero_value           the top-level call sends ETH
+#   max_calls               at most this many calls in the trace
+#   asset_change_standards  every asset change is of one of these token standards
+#   min_asset_changes, max_asset_changes
+FAST_PATH_RULES_PATH = 'categorization_config/fast_path_rules.json'
+FAST_PATH = os.getenv('CATEGORIZE_FAST_PATH', 'true').lower() not in ('0', 'false', 'no')
+BUCKET_NAME = os.getenv('GCS_BUCKET_NAME')
+
+
+def load_rules(path, allowed_labels):
+    with open(path, 'r') as file:
+        rules = json.load(file)['rules']
+    for rule in rules:
+        unknown = [label for label in rule['labels'] if label not in allowed_labels]
+        if unknown:
+            raise ValueError(f'Fast path rule {rule["name"]} uses labels that are not in ultrasound_labels.json: {unknown}')
+        if len(rule['labels']) != len(rule['probabilities']):
+            raise ValueError(f'Fast path rule {rule["name"]} needs one probability per label')
+    return rules
+
+def flatten_calls(calls):
+    for call in calls:
+        if isinstance(call, dict):
+            yield call
+            yield from flatten_calls(call.get('calls') or [])
+
+def to_int(value):
+    if isinstance(value, int):
+        return value
+    try:
+        return int(value, 0) if value else 0
+    except (TypeError, ValueError):
+        return 0
+
+def matches_rule(rule, simulation):
+    calls = list(flatten_calls(simulation.get('call_trace') or []))
+    if not calls:
+        return False
+    top = calls[0]
+    asset_changes = simulation.get('asset_changes') or []
+    functions = rule.get('functions')
+
+    if 'status' in rule and bool(simulation.get('status', True)) != rule['status']:
+        return False
+    if functions is not None and (top.get('function') or '') not in functions:
+        return False
+    if rule.get('calls_within_functions') and any((call.get('function') or '') not in functions for call in calls):
+        return False
+    if rule.get('empty_input') and top.get('input') not in (None, '', '0x'):
+        return False
+    if rule.get('nonzero_value') and not to_int(top.get('value')):
+        return False
+    if 'max_calls' in rule and len(calls) > rule['max_calls']:
+        return False
+    if 'asset_change_standards' in rule and any((change.get('token_info') or {}).get('standard') not in rule['asset_change_standards'] for change in asset_changes):
+        return False
+    if len(asset_changes) < rule.get('min_asset_changes', 0):
+        return False
+    if 'max_asset_changes' in rule and len(asset_changes) > rule['max_asset_changes']:
+        return False
+    return True
+
+# The first matching rule and its categories, or None when the transaction needs the LLM
+def classify(rules, simulation):
+    for rule in rules:
+        if matches_rule(rule, simulation):
+            return rule['name'], {'labels': list(rule['labels']), 'probabilities': list(rule['probabilities']),
+                                  'calibrated': rule.get('calibrated', False)}
+    return None
+
+
+# Counts how often the fast path fires, overall and per rule
+class FastPathStats:
+    def __init__(self):
+        self.counts = Counter()
+
+    def record(self, rule_name):
+        self.counts['checked'] += 1
+        if rule_name:
+            self.counts['fast_path'] += 1
+            self.counts[f'rule:{rule_name}'] += 1
+        else:
+            self.counts['llm'] += 1
+
+    def stats(self):
+        checked = self.counts['checked']
+        return {
+            'checked': checked,
+            'fast_path': self.counts['fast_path'],
+            'llm': self.counts['llm'],
+            'fast_path_rate': self.counts['fast_path'] / checked if checked else 0.0,
+            'rules': {key[len('rule:'):]: count for key, count in self.counts.items() if key.startswith('rule:')},
+        }
+
+
+# Compares the rules with categories the LLM already produced: for each rule, how often the
+# LLM's top label was the rule's top label. The precision is the calibrated probability.
+def calibrate(network, limit):
+    bucket = storage.Client().bucket(BUCKET_NAME)
+    with open('categorization_config/ultrasound_labels.json', 'r') as file:
+        allowed_labels = [entry['label'] for entry in json.load(file)]
+    rules = load_rules(FAST_PATH_RULES_PATH, allowed_labels)
+    matched, agreed = Counter(), Counter()
+    checked = 0
+
+    for blob in bucket.list_blobs(prefix=f'{network}/transactions/categories/', max_results=limit):
+        tx_hash = os.path.basename(blob.name)[:-len('.json')]
+        try:
+            usage = bucket.blob(f'{network}/transactions/categories_usage/{tx_hash}.json')
+            if 'fast_path' in json.loads(usage.download_as_string()):
+                continue
+        except NotFound:
+            pass
+        try:
+            categories = json.loads(blob.download_as_text().replace("'", '"'))
+            simulation = load_simulation(bucket.blob(f'{network}/transactions/simulations/trimmed/{tx_hash}.json').download_as_text())
+        except Exception as e:
+            print(f'Skipping {tx_hash}: {str(e)}')
+            continue
+        checked += 1
+        result = classify(rules, simulation)
+        if not result or not categories.get('labels'):
+            continue
+        rule_name, fast = result
+        matched[rule_name] += 1
+        agreed[rule_name] += categories['labels'][0] == fast['labels'][0]
+
+    report = {'checked': checked, 'rules': {}}
+    for rule in rules:
+        count = matched[rule['name']]
+        report['rules'][rule['name']] = {
+            'matched': count,
+            'agreed': agreed[rule['name']],
+            'precision': round(agreed[rule['name']] / count, 3) if count else None,
+            'configured_probability': rule['probabilities'][0],
+            'calibrated': rule.get('calibrated', False),
+        }
+    print(json.dumps(report, indent=4))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fast path categorization rules')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    calibrate_parser = subparsers.add_parser('calibrate', help='Measure how often each rule agrees with LLM categorizations')
+    calibrate_parser.add_argument('-n', '--network', type=str, default='ethereum', choices=['ethereum', 'arbitrum', 'avalanche', 'optimism'],
+                                  help='Blockchain network of the categorizations (default: ethereum)')
+    calibrate_parser.add_argument('-l', '--limit', type=int, default=1000,
+                                  help='Maximum number of stored categorizations to compare (default: 1000)')
+    args = parser.parse_args()
+
+    if args.command == 'calibrate':
+        calibrate(args.network, args.limit)
@@ -4,6 +4,9 @@ from flipside import Flipside
 import pandas as pd
 import aiohttp
 import asyncio
+from label_index import label_index
+
+refresh_tasks = set()
 
 # Recursively iterate over the json object looking for specified pattern
 def explore_json(obj, items, pattern):
@@ -109,11 +112,18 @@ def fetch_address_labels(sim_data, endpoint, network):
     except Exception as e:
         print("Error at fetch_address_labels: ", e)
 
-# Add Ethereum labels through bigquery
+# Add Ethereum labels from the local label index, or through bigquery when no snapshot exists
 async def add_labels(sim_data, labels_dataset, bigquery_client):
     address_regex = r'^0x[0-9a-fA-F]{40}$'
     try:
         addresses = extract(sim_data, address_regex)
+        if label_index.exists():
+            # Keep a reference so the refresh task isn't garbage collected while running
+            refresh_task = asyncio.create_task(label_index.refresh_if_stale(bigquery_client, labels_dataset))
+            refresh_tasks.add(refresh_task)
+            refresh_task.add_done_callback(refresh_tasks.discard)
+            sim_data["address_labels"] = label_index.lookup(addresses)
+            return sim_data
         addresses_str = addresses_to_string(addresses)
         sql = f"""select *
                   from {labels_dataset}
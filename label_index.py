@@ -0,0 +1,188 @@
+import os
+import json
+import time
+import fcntl
+import sqlite3
+import tempfile
+import asyncio
+import logging
+import argparse
+from contextlib import closing, contextmanager
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LABELS_INDEX_PATH = os.getenv('LABELS_INDEX_PATH', 'labels_index.sqlite')
+LABELS_INDEX_MAX_AGE = int(os.getenv('LABELS_INDEX_MAX_AGE', 24 * 60 * 60))
+LABELS_INDEX_UPDATED_COLUMN = os.getenv('LABELS_INDEX_UPDATED_COLUMN')
+
+# SQLite caps the number of bound parameters per statement
+LOOKUP_BATCH_SIZE = 900
+INSERT_BATCH_SIZE = 10000
+
+
+# Local snapshot of the LABELS_DATASET table, keyed by lowercased address.
+# Rows are stored as JSON so the index doesn't need to know the table schema.
+class LabelIndex:
+    def __init__(self, path=LABELS_INDEX_PATH):
+        self.path = path
+        self.refreshing = False
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def _connect(self, path=None, read_only=True):
+        if read_only:
+            return sqlite3.connect(f'file:{path or self.path}?mode=ro', uri=True)
+        return sqlite3.connect(path or self.path)
+
+    def _get_meta(self, key):
+        with closing(self._connect()) as conn:
+            row = conn.execute('select value from meta where key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def age(self):
+        refreshed_at = self._get_meta('refreshed_at') if self.exists() else None
+        if refreshed_at is None:
+            return float('inf')
+        return time.time() - float(refreshed_at)
+
+    def lookup(self, addresses):
+        addresses = list({address.lower() for address in addresses if address})
+        rows = []
+        with closing(self._connect()) as conn:
+            for i in range(0, len(addresses), LOOKUP_BATCH_SIZE):
+                batch = addresses[i:i + LOOKUP_BATCH_SIZE]
+                placeholders = ', '.join('?' for _ in batch)
+                cursor = conn.execute(f'select row from labels where address in ({placeholders})', batch)
+                rows.extend(json.loads(row[0]) for row in cursor)
+        return rows
+
+    def _insert_rows(self, conn, query_job, updated_column, table='labels'):
+        watermark = None
+        count = 0
+        batch = []
+        for row in query_job.result(page_size=INSERT_BATCH_SIZE):
+            row = dict(row)
+            address = row.get('address')
+            if not address:
+                continue
+            batch.append((address.lower(), json.dumps(row, default=str)))
+            if updated_column and row.get(updated_column) is not None:
+                value = str(row[updated_column])
+                watermark = value if watermark is None or value > watermark else watermark
+            if len(batch) >= INSERT_BATCH_SIZE:
+                conn.executemany(f'insert into {table} (address, row) values (?, ?)', batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            conn.executemany(f'insert into {table} (address, row) values (?, ?)', batch)
+            count += len(batch)
+        return count, watermark
+
+    def _set_meta(self, conn, **values):
+        conn.executemany('insert or replace into meta (key, value) values (?, ?)', [(k, str(v)) for k, v in values.items() if v is not None])
+
+    # Serializes snapshots and refreshes across processes, e.g. the shards of a sharded backfill
+    @contextmanager
+    def _lock(self):
+        with open(f'{self.path}.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    # Rebuild the whole index into a temporary file and swap it in atomically,
+    # so concurrent readers keep seeing the previous snapshot until it's done
+    def snapshot(self, bigquery_client, labels_dataset, updated_column=LABELS_INDEX_UPDATED_COLUMN):
+        with self._lock():
+            return self._snapshot(bigquery_client, labels_dataset, updated_column)
+
+    def _snapshot(self, bigquery_client, labels_dataset, updated_column):
+        start_time = time.time()
+        fd, tmp_path = tempfile.mkstemp(prefix=f'{os.path.basename(self.path)}.', suffix='.tmp', dir=os.path.dirname(os.path.abspath(self.path)))
+        os.close(fd)
+        conn = self._connect(tmp_path, read_only=False)
+        try:
+            conn.execute('create table labels (address text not null, row text not null)')
+            conn.execute('create table meta (key text primary key, value text)')
+            query_job = bigquery_client.query(f'select * from {labels_dataset}')
+            count, watermark = self._insert_rows(conn, query_job, updated_column)
+            conn.execute('create index labels_address on labels (address)')
+            self._set_meta(conn, refreshed_at=start_time, dataset=labels_dataset, watermark=watermark, updated_column=updated_column)
+            conn.commit()
+        except BaseException:
+            conn.close()
+            os.remove(tmp_path)
+            raise
+        conn.close()
+        os.replace(tmp_path, self.path)
+        logging.info(f'Label index snapshot written to {self.path}: {count} rows in {time.time() - start_time:.1f}s')
+        return count
+
+    # Pull only addresses with rows changed since the last refresh. Requires an updated-at column,
+    # rows removed from the dataset are only dropped by a full snapshot. With max_age, the index
+    # is only refreshed if no other process refreshed it while this one waited for the lock.
+    def refresh(self, bigquery_client, labels_dataset, updated_column=LABELS_INDEX_UPDATED_COLUMN, max_age=None):
+        with self._lock():
+            if max_age is not None and self.age() < max_age:
+                return 0
+            watermark = self._get_meta('watermark') if self.exists() else None
+            if not updated_column or watermark is None:
+                return self._snapshot(bigquery_client, labels_dataset, updated_column)
+            return self._refresh(bigquery_client, labels_dataset, updated_column, watermark)
+
+    def _refresh(self, bigquery_client, labels_dataset, updated_column, watermark):
+        start_time = time.time()
+        # All rows of every changed address, since the index replaces an address's rows as a whole
+        query_job = bigquery_client.query(f"select * from {labels_dataset} where address in "
+                                          f"(select address from {labels_dataset} where {updated_column} > '{watermark}')")
+        conn = self._connect(read_only=False)
+        try:
+            conn.execute('create temp table changed (address text not null, row text not null)')
+            count, new_watermark = self._insert_rows(conn, query_job, updated_column, table='changed')
+            conn.execute('delete from labels where address in (select address from changed)')
+            conn.execute('insert into labels (address, row) select address, row from changed')
+            self._set_meta(conn, refreshed_at=start_time, watermark=new_watermark)
+            conn.commit()
+        finally:
+            conn.close()
+        logging.info(f'Label index refreshed: {count} rows of changed addresses in {time.time() - start_time:.1f}s')
+        return count
+
+    # Refresh in a worker thread when the snapshot is older than max_age, without blocking lookups
+    async def refresh_if_stale(self, bigquery_client, labels_dataset, max_age=LABELS_INDEX_MAX_AGE):
+        if self.refreshing or self.age() < max_age:
+            return
+        self.refreshing = True
+        try:
+            await asyncio.to_thread(self.refresh, bigquery_client, labels_dataset, max_age=max_age)
+        except Exception as e:
+            logging.error(f'Error refreshing label index: {str(e)}')
+        finally:
+            self.refreshing = False
+
+
+label_index = LabelIndex()
+
+if __name__ == '__main__':
+    from google.cloud import bigquery
+
+    parser = argparse.ArgumentParser(description='Address label index')
+    parser.add_argument('command', choices=['snapshot', 'refresh'],
+                        help='snapshot rebuilds the index from scratch, refresh only pulls rows changed since the last run')
+    parser.add_argument('--path', type=str, default=LABELS_INDEX_PATH,
+                        help=f'Path of the index file (default: {LABELS_INDEX_PATH})')
+    parser.add_argument('--updated-column', type=str, default=LABELS_INDEX_UPDATED_COLUMN,
+                        help='Column used to find changed rows for incremental refreshes (default: LABELS_INDEX_UPDATED_COLUMN)')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.INFO)
+    index = LabelIndex(args.path)
+    client = bigquery.Client()
+    labels_dataset = os.getenv('LABELS_DATASET')
+    if args.command == 'snapshot':
+        index.snapshot(client, labels_dataset, args.updated_column)
+    else:
+        index.refresh(client, labels_dataset, args.updated_column)
@@ -13,10 +13,10 @@ if __name__ == '__main__':
                         help='Start day for transaction simulation (default: yesterday)')
     parser.add_argument('-e', '--end', type=str, default=None,
                         help='End day for transaction simulation (default: today)')
-    parser.add_argument('-d', '--delay', type=float, default=1.2,
-                        help='Delay time between API requests in seconds (default: 1.2)')
-    parser.add_argument('-c', '--concurrency', type=int, default=1,
-                        help='Maximum number of concurrent connections to the API (default: 1)')
+    parser.add_argument('-d', '--delay', type=float, default=0,
+                        help='Extra delay after each explanation in seconds (default: 0)')
+    parser.add_argument('-c', '--concurrency', type=int, default=8,
+                        help='Maximum number of concurrent explanations (default: 8)')
     parser.add_argument('-f', '--skip-functions', type=str, nargs='+', default=['transfer', 'approve', 'transferFrom'],
                         help='List of function calls to skip (default: transfer approve transferFrom)')
     parser.add_argument('-p', '--prompt', type=str, default=None,
@@ -0,0 +1,168 @@
+import os
+import atexit
+import argparse
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+from google.cloud import storage
+from simulation_format import dump_simulation, load_simulation
+from usage import JsonlSink, load_records
+
+load_dotenv()
+
+# Every trimmed simulation gets a small metadata record: as custom metadata on the blob itself,
+# so listings return it without downloading, and as a line in the network's JSONL manifest
+# under {network}/transactions/manifest/{date}/, so jobs can select work with a query.
+BUCKET_NAME = os.getenv('GCS_BUCKET_NAME')
+METADATA_FIELDS = ['function', 'status', 'contract', 'contract_name', 'size', 'call_count', 'asset_change_count']
+INT_FIELDS = {'size', 'call_count', 'asset_change_count'}
+
+storage_client = storage.Client()
+bucket = storage_client.bucket(BUCKET_NAME)
+manifest_sinks = {}
+
+
+def manifest_prefix(network):
+    return f'{network}/transactions/manifest/'
+
+def trimmed_blob_name(network, tx_hash):
+    return f'{network}/transactions/simulations/trimmed/{tx_hash}.json'
+
+def count_calls(calls):
+    return sum(1 + count_calls(call.get('calls') or []) for call in calls if isinstance(call, dict))
+
+# Metadata of a trimmed simulation in the expanded shape, size is the stored size in bytes
+def simulation_metadata(trimmed, size):
+    calls = trimmed.get('call_trace') or []
+    top = calls[0] if calls and isinstance(calls[0], dict) else {}
+    return {
+        'function': top.get('function') or None,
+        'status': bool(trimmed.get('status', True)),
+        'contract': top.get('to').lower() if top.get('to') else None,
+        'contract_name': top.get('contract_name') or None,
+        'size': size,
+        'call_count': count_calls(calls),
+        'asset_change_count': len(trimmed.get('asset_changes') or []),
+    }
+
+# GCS custom metadata only holds strings
+def blob_metadata(metadata):
+    return {field: str(metadata[field]) for field in METADATA_FIELDS if metadata.get(field) is not None}
+
+def parse_metadata(raw):
+    if not raw or 'size' not in raw:
+        return None
+    metadata = {field: None for field in METADATA_FIELDS}
+    for field, value in raw.items():
+        if field in INT_FIELDS:
+            metadata[field] = int(value)
+        elif field == 'status':
+            metadata[field] = value == 'True'
+        elif field in metadata:
+            metadata[field] = value
+    return metadata
+
+# filters: functions / skip_functions / contracts (lists), status (bool), max_size and max_calls (ints)
+def matches(metadata, filters):
+    if not filters:
+        return True
+    if filters.get('skip_functions') and metadata['function'] in filters['skip_functions']:
+        return False
+    if filters.get('functions') and metadata['function'] not in filters['functions']:
+        return False
+    if filters.get('contracts') and metadata['contract'] not in [contract.lower() for contract in filters['contracts']]:
+        return False
+    if filters.get('status') is not None and metadata['status'] != filters['status']:
+        return False
+    if filters.get('max_size') and metadata['size'] > filters['max_size']:
+        return False
+    if filters.get('max_calls') and metadata['call_count'] > filters['max_calls']:
+        return False
+    return True
+
+
+def manifest_sink(bucket, network):
+    if network not in manifest_sinks:
+        manifest_sinks[network] = JsonlSink(bucket, manifest_prefix(network))
+    return manifest_sinks[network]
+
+def record_manifest(bucket, network, tx_hash, metadata):
+    manifest_sink(bucket, network).add({'tx_hash': tx_hash, **metadata, 'created_at': datetime.now(timezone.utc).isoformat()})
+
+# Pool workers exit without running atexit handlers, so they flush explicitly
+def flush_manifests():
+    for sink in list(manifest_sinks.values()):
+        sink.flush()
+
+atexit.register(flush_manifests)
+
+# Stores a trimmed simulation with its metadata and adds it to the manifest
+def upload_trimmed(bucket, network, tx_hash, trimmed):
+    data = dump_simulation(trimmed)
+    metadata = simulation_metadata(trimmed, len(data.encode()))
+    blob = bucket.blob(trimmed_blob_name(network, tx_hash))
+    blob.metadata = blob_metadata(metadata)
+    blob.upload_from_string(data)
+    record_manifest(bucket, network, tx_hash, metadata)
+    return metadata
+
+
+def load_manifest(network, days):
+    records = load_records(bucket, days, manifest_prefix(network))
+    if records.empty:
+        return records
+    return records.sort_values('created_at').drop_duplicates('tx_hash', keep='last')
+
+def query(network, days, filters):
+    records = load_manifest(network, days)
+    if records.empty:
+        return []
+    return [row['tx_hash'] for row in records.to_dict('records') if matches(row, filters)]
+
+# Adds metadata and manifest records for trimmed simulations stored before the manifest existed
+def backfill(network):
+    patched = 0
+    for blob in bucket.list_blobs(prefix=f'{network}/transactions/simulations/trimmed/', fields='items(name,metadata),nextPageToken'):
+        if not blob.name.endswith('.json') or parse_metadata(blob.metadata):
+            continue
+        tx_hash = os.path.basename(blob.name)[:-len('.json')]
+        try:
+            data = blob.download_as_string()
+            metadata = simulation_metadata(load_simulation(data), len(data))
+            blob.metadata = blob_metadata(metadata)
+            blob.patch()
+            record_manifest(bucket, network, tx_hash, metadata)
+            patched += 1
+        except Exception as e:
+            print(f'Error adding metadata to {blob.name}: {str(e)}')
+    flush_manifests()
+    print(f'Added metadata to {patched} simulations')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Manifest of stored trimmed simulations')
+    parser.add_argument('-n', '--network', type=str, default='ethereum', choices=['ethereum', 'arbitrum', 'avalanche', 'optimism'],
+                        help='Blockchain network of the simulations (default: ethereum)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    query_parser = subparsers.add_parser('query', help='Print the transaction hashes of simulations matching the filters')
+    query_parser.add_argument('-d', '--days', type=int, default=7, help='Number of days of manifest records to include (default: 7)')
+    query_parser.add_argument('--functions', type=str, nargs='+', default=None, help='Only these top-level functions')
+    query_parser.add_argument('-s', '--skip', type=str, nargs='+', default=None, help='Leave out these top-level functions')
+    query_parser.add_argument('--contracts', type=str, nargs='+', default=None, help='Only transactions to these contracts')
+    query_parser.add_argument('--status', type=str, choices=['success', 'failed'], default=None, help='Only successful or failed transactions')
+    query_parser.add_argument('--max-size', type=int, default=None, help='Only simulations of at most this many bytes')
+    query_parser.add_argument('--max-calls', type=int, default=None, help='Only simulations with at most this many calls')
+    subparsers.add_parser('backfill', help='Add metadata to trimmed simulations stored without it')
+    args = parser.parse_args()
+
+    if args.command == 'query':
+        filters = {
+            'functions': args.functions,
+            'skip_functions': args.skip,
+            'contracts': args.contracts,
+            'status': None if args.status is None else args.status == 'success',
+            'max_size': args.max_size,
+            'max_calls': args.max_calls,
+        }
+        for tx_hash in query(args.network, args.days, filters):
+            print(tx_hash)
+    elif args.command == 'backfill':
+        backfill(args.network)
@@ -0,0 +1,100 @@
+import json
+import time
+import uuid
+import argparse
+from aiohttp import web
+
+# Local stand-in for the Anthropic Message Batches API. Batches end a fixed number of
+# seconds after submission and every request succeeds with a canned explanation, unless
+# its custom_id is listed in --fail. Run explain.py against it with
+# ANTHROPIC_BASE_URL=http://127.0.0.1:<port> python explain.py --batch
+
+batches = {}
+
+
+def batch_view(request, batch):
+    ended = time.time() >= batch['ends_at']
+    counts = {'processing': 0 if ended else len(batch['requests']), 'succeeded': 0, 'errored': 0, 'canceled': 0, 'expired': 0}
+    if ended:
+        for item in batch['requests']:
+            counts['errored' if item['custom_id'] in request.app['fail'] else 'succeeded'] += 1
+    return {
+        'id': batch['id'],
+        'type': 'message_batch',
+        'processing_status': 'ended' if ended else 'in_progress',
+        'request_counts': counts,
+        'created_at': batch['created_at'],
+        'results_url': f'{request.scheme}://{request.host}/v1/messages/batches/{batch["id"]}/results' if ended else None,
+    }
+
+def result_line(request, item):
+    if item['custom_id'] in request.app['fail']:
+        return {'custom_id': item['custom_id'], 'result': {'type': 'errored', 'error': {'type': 'invalid_request_error', 'message': 'mock failure'}}}
+    message = {
+        'id': f'msg_{uuid.uuid4().hex}',
+        'type': 'message',
+        'role': 'assistant',
+        'model': item['params'].get('model'),
+        'content': [{'type': 'text', 'text': f'Mock explanation for 0x{item["custom_id"]}.'}],
+        'stop_reason': 'end_turn',
+        'usage': {'input_tokens': len(json.dumps(item['params'])) // 4, 'output_tokens': 8},
+    }
+    return {'custom_id': item['custom_id'], 'result': {'type': 'succeeded', 'message': message}}
+
+
+async def create_batch(request):
+    payload = await request.json()
+    requests = payload.get('requests') or []
+    custom_ids = [item.get('custom_id') for item in requests]
+    if not requests or len(set(custom_ids)) != len(custom_ids):
+        return web.json_response({'type': 'error', 'error': {'type': 'invalid_request_error', 'message': 'requests must be non-empty with unique custom_id values'}}, status=400)
+    batch_id = f'msgbatch_{uuid.uuid4().hex[:24]}'
+    batches[batch_id] = {
+        'id': batch_id,
+        'requests': requests,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'ends_at': time.time() + request.app['delay'],
+    }
+    return web.json_response(batch_view(request, batches[batch_id]))
+
+async def list_batches(request):
+    limit = int(request.query.get('limit', 20))
+    ordered = sorted(batches.values(), key=lambda batch: batch['created_at'], reverse=True)
+    after_id = request.query.get('after_id')
+    if after_id:
+        ids = [batch['id'] for batch in ordered]
+        ordered = ordered[ids.index(after_id) + 1:] if after_id in ids else []
+    page = [batch_view(request, batch) for batch in ordered[:limit]]
+    return web.json_response({'data': page, 'has_more': len(ordered) > limit, 'first_id': page[0]['id'] if page else None,
+                              'last_id': page[-1]['id'] if page else None})
+
+async def get_batch(request):
+    batch = batches.get(request.match_info['batch_id'])
+    if not batch:
+        return web.json_response({'type': 'error', 'error': {'type': 'not_found_error', 'message': 'batch not found'}}, status=404)
+    return web.json_response(batch_view(request, batch))
+
+async def get_results(request):
+    batch = batches.get(request.match_info['batch_id'])
+    if not batch or time.time() < batch['ends_at']:
+        return web.json_response({'type': 'error', 'error': {'type': 'not_found_error', 'message': 'results not available'}}, status=404)
+    body = '\n'.join(json.dumps(result_line(request, item)) for item in batch['requests']) + '\n'
+    return web.Response(text=body, content_type='application/x-jsonl')
+
+def create_app(delay=2.0, fail=()):
+    app = web.Application(client_max_size=256 * 1024 * 1024)
+    app['delay'] = delay
+    app['fail'] = set(fail)
+    app.router.add_post('/v1/messages/batches', create_batch)
+    app.router.add_get('/v1/messages/batches', list_batches)
+    app.router.add_get('/v1/messages/batches/{batch_id}', get_batch)
+    app.router.add_get('/v1/messages/batches/{batch_id}/results', get_results)
+    return app
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Mock Anthropic Message Batches API')
+    parser.add_argument('--port', type=int, default=8089, help='Port to listen on (default: 8089)')
+    parser.add_argument('--delay', type=float, default=2.0, help='Seconds until a submitted batch ends (default: 2)')
+    parser.add_argument('--fail', type=str, nargs='*', default=[], help='custom_id values whose requests should error')
+    args = parser.parse_args()
+    web.run_app(create_app(args.delay, args.fail), port=args.port)
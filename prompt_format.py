@@ -0,0 +1,96 @@
+import os
+import re
+import json
+import math
+
+# Serializer for the simulations sent to the LLM. Empty fields are dropped, long raw hex
+# (calldata, return data, bytes params) is abbreviated to its selector and tail, and the JSON
+# has no whitespace. If the result still exceeds the input token budget, nested calls are
+# cut from the deepest level up until it fits.
+PROMPT_INPUT_TOKEN_BUDGET = int(os.getenv('PROMPT_INPUT_TOKEN_BUDGET', '150000'))
+# JSON full of addresses and hex tokenizes poorly, so the estimate errs on the high side
+PROMPT_CHARS_PER_TOKEN = float(os.getenv('PROMPT_CHARS_PER_TOKEN', '3'))
+# A selector plus one 32-byte word, anything longer gets abbreviated
+HEX_MAX_LENGTH = 74
+
+HEX_PATTERN = re.compile(r'^0x[0-9a-fA-F]*$')
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text) / PROMPT_CHARS_PER_TOKEN)
+
+def abbreviate_hex(value):
+    if len(value) <= HEX_MAX_LENGTH or not HEX_PATTERN.match(value):
+        return value
+    return f'{value[:10]}...{value[-8:]} ({(len(value) - 2) // 2} bytes)'
+
+def is_empty(value):
+    return value is None or (isinstance(value, (str, list, dict)) and not value)
+
+def compact(value):
+    if isinstance(value, dict):
+        compacted = {}
+        for key, item in value.items():
+            item = compact(item)
+            if not is_empty(item):
+                compacted[key] = item
+        return compacted
+    if isinstance(value, list):
+        return [compact(item) for item in value]
+    if isinstance(value, str):
+        return abbreviate_hex(value)
+    return value
+
+def call_depth(value):
+    if isinstance(value, dict):
+        return max([1 + call_depth(value['calls']) if key == 'calls' else call_depth(item) for key, item in value.items()] or [0])
+    if isinstance(value, list):
+        return max([call_depth(item) for item in value] or [0])
+    return 0
+
+def count_calls(calls):
+    return sum(1 + count_calls(call.get('calls', [])) for call in calls if isinstance(call, dict))
+
+# Replace calls nested deeper than max_depth with the number of calls left out
+def limit_depth(value, max_depth):
+    if isinstance(value, dict):
+        limited = {}
+        for key, item in value.items():
+            if key == 'calls' and isinstance(item, list):
+                if max_depth <= 0:
+                    limited['omitted_calls'] = count_calls(item)
+                else:
+                    limited[key] = limit_depth(item, max_depth - 1)
+            else:
+                limited[key] = limit_depth(item, max_depth)
+        return limited
+    if isinstance(value, list):
+        return [limit_depth(item, max_depth) for item in value]
+    return value
+
+def serialize(value):
+    return json.dumps(value, separators=(',', ':'))
+
+# Serialize value for a prompt within budget tokens and print a report comparing it with
+# the plain json.dumps(value, indent=indent) it replaces
+def format_prompt(value, kind='explain', budget=None, indent=None):
+    budget = budget or PROMPT_INPUT_TOKEN_BUDGET
+    compacted = compact(value)
+    text = serialize(compacted)
+    depth = call_depth(compacted)
+    while estimate_tokens(text) > budget and depth > 0:
+        depth -= 1
+        text = serialize(limit_depth(compacted, depth))
+
+    raw_tokens = estimate_tokens(json.dumps(value, indent=indent))
+    tokens = estimate_tokens(text)
+    print(json.dumps({
+        'action': 'prompt_format',
+        'kind': kind,
+        'raw_tokens': raw_tokens,
+        'tokens': tokens,
+        'tokens_saved': raw_tokens - tokens,
+        'call_depth': depth,
+        'over_budget': tokens > budget,
+    }))
+    return text
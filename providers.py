@@ -0,0 +1,540 @@
+import os
+import json
+import time
+import random
+import inspect
+import asyncio
+import logging
+from collections import deque
+from anthropic import AsyncAnthropic
+from groq import AsyncGroq
+from ratelimit import RateLimiter
+from prompt_format import estimate_tokens
+
+# Status codes that signal a provider is overloaded or temporarily broken (529 is Anthropic's overloaded)
+RETRYABLE_STATUSES = {408, 409, 429, 500, 502, 503, 504, 529}
+
+MODEL_PROVIDERS = {
+    "llama3-70b-8192": "groq",
+    "llama3-8b-8192": "groq",
+    "mixtral-8x7b-32768": "groq",
+    "gemma-7b-it": "groq",
+    "claude-3-haiku-20240307": "anthropic",
+    "claude-3-opus-20240229": "anthropic",
+    "claude-3-sonnet-20240229": "anthropic",
+    "mock": "mock",
+}
+
+# Context windows in tokens, used to fit chat requests before they are sent
+MODEL_CONTEXT_WINDOWS = {
+    "llama3-70b-8192": 8192,
+    "llama3-8b-8192": 8192,
+    "mixtral-8x7b-32768": 32768,
+    "gemma-7b-it": 8192,
+    "claude-3-haiku-20240307": 200000,
+    "claude-3-opus-20240229": 200000,
+    "claude-3-sonnet-20240229": 200000,
+    "mock": 200000,
+}
+
+# Models tried in order when the provider of the requested model is degraded or fails.
+# Override with LLM_FALLBACK_MODELS, a JSON object of model -> list of models.
+DEFAULT_FALLBACK_MODELS = {
+    "claude-3-haiku-20240307": ["llama3-70b-8192"],
+    "claude-3-sonnet-20240229": ["claude-3-haiku-20240307", "llama3-70b-8192"],
+    "claude-3-opus-20240229": ["claude-3-sonnet-20240229", "llama3-70b-8192"],
+    "llama3-70b-8192": ["claude-3-haiku-20240307"],
+    "llama3-8b-8192": ["llama3-70b-8192", "claude-3-haiku-20240307"],
+    "mixtral-8x7b-32768": ["llama3-70b-8192", "claude-3-haiku-20240307"],
+    "gemma-7b-it": ["llama3-70b-8192", "claude-3-haiku-20240307"],
+}
+
+def load_fallback_models(value):
+    if not value:
+        return DEFAULT_FALLBACK_MODELS
+    try:
+        fallback_models = json.loads(value)
+    except json.JSONDecodeError as e:
+        logging.error(f'Invalid LLM_FALLBACK_MODELS, using the default fallback models: {str(e)}')
+        return DEFAULT_FALLBACK_MODELS
+    if not isinstance(fallback_models, dict):
+        logging.error('LLM_FALLBACK_MODELS must be a JSON object of model -> list of models, using the default fallback models')
+        return DEFAULT_FALLBACK_MODELS
+    return fallback_models
+
+FALLBACK_MODELS = load_fallback_models(os.getenv('LLM_FALLBACK_MODELS'))
+
+PROMPT_CACHING_HEADERS = {'anthropic-beta': 'prompt-caching-2024-07-31'}
+
+# Hedging: when the first token of a request is later than the HEDGE_PERCENTILE of recent
+# times to first token for its model, the same request is sent to the first fallback model
+# and whichever streams first is used. Opt-in globally with LLM_HEDGING or per request.
+HEDGING = os.getenv('LLM_HEDGING', 'false').lower() in ('1', 'true', 'yes')
+HEDGE_PERCENTILE = float(os.getenv('LLM_HEDGE_PERCENTILE', '95'))
+# Used until a model has HEDGE_MIN_SAMPLES recorded times to first token
+HEDGE_DEFAULT_DELAY = float(os.getenv('LLM_HEDGE_DEFAULT_DELAY', '2.0'))
+HEDGE_MIN_DELAY = 0.25
+HEDGE_MIN_SAMPLES = 20
+TTFT_WINDOW = 500
+
+
+# Assume there is new model that was not added to the list, use Anthropic by default
+def provider_for(model):
+    return MODEL_PROVIDERS.get(model, "anthropic")
+
+def context_window(model):
+    return MODEL_CONTEXT_WINDOWS.get(model, 200000 if provider_for(model) == "anthropic" else 8192)
+
+def text_of(content):
+    if isinstance(content, str):
+        return content
+    return '\n\n'.join(block.get('text', '') for block in content or [] if block.get('type', 'text') == 'text')
+
+def estimate_request_tokens(params):
+    return estimate_tokens(json.dumps(params.get('system') or '')) + estimate_tokens(json.dumps(params.get('messages') or []))
+
+# Optional positive integer setting, None when unset or invalid
+def optional_int(name):
+    value = os.getenv(name)
+    if not value:
+        return None
+    try:
+        return int(value) or None
+    except ValueError:
+        logging.error(f'Invalid {name} {value!r}, expected an integer')
+        return None
+
+def error_headers(error):
+    return getattr(getattr(error, 'response', None), 'headers', None) or {}
+
+def is_retryable(error):
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    if getattr(error, 'status_code', None) in RETRYABLE_STATUSES:
+        return True
+    return type(error).__name__ in ('APIConnectionError', 'APITimeoutError', 'InternalServerError', 'RateLimitError')
+
+
+class ProviderError(Exception):
+    pass
+
+
+# Iterates an async generator inside a task of its own and hands its items over through a
+# queue. The Anthropic and httpx streams hold cancel scopes that must exit in the task that
+# entered them, so a provider stream is entered, iterated and closed in one task, however
+# the consumer waits for it. Cancelling the task discards the stream. The queue holds the
+# items, then None at the end or the error that ended the stream.
+class StreamTask:
+    def __init__(self, stream):
+        self.queue = asyncio.Queue()
+        self.task = asyncio.ensure_future(self._run(stream))
+
+    async def _run(self, stream):
+        try:
+            async for item in stream:
+                self.queue.put_nowait(item)
+            self.queue.put_nowait(None)
+        except Exception as e:
+            self.queue.put_nowait(e)
+        finally:
+            await stream.aclose()
+
+    async def chunks(self):
+        while True:
+            item = await self.queue.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    async def discard(self):
+        if not self.task.done():
+            self.task.cancel()
+        try:
+            await self.task
+        except BaseException:
+            pass
+
+
+# Base for LLM providers. Every provider streams text for Anthropic-style request params
+# ({model, max_tokens, temperature, system, messages}) and owns its concurrency limit,
+# timeout and retry policy. Requests are only retried until the first token has been
+# streamed. Consecutive failures mark the provider degraded for a cooldown period, during
+# which the router prefers other providers.
+class Provider:
+    name = None
+
+    def __init__(self, max_concurrency=8, timeout=60.0, max_retries=2, base_backoff=0.5, max_backoff=8.0,
+                 failure_threshold=3, cooldown=30.0, rpm=None, tpm=None):
+        self.rate_limiter = RateLimiter(self.name, rpm, tpm)
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.consecutive_failures = 0
+        self.degraded_until = 0.0
+        self.counts = {'requests': 0, 'successes': 0, 'retries': 0, 'failures': 0}
+        self._semaphore = None
+
+    @classmethod
+    def from_env(cls, **defaults):
+        prefix = f'LLM_{cls.name.upper()}_'
+        return cls(
+            max_concurrency=int(os.getenv(prefix + 'MAX_CONCURRENCY', defaults.get('max_concurrency', 8))),
+            timeout=float(os.getenv(prefix + 'TIMEOUT', defaults.get('timeout', 60.0))),
+            max_retries=int(os.getenv(prefix + 'MAX_RETRIES', defaults.get('max_retries', 2))),
+            # Starting limits until the first rate limit headers arrive. Groq does not report
+            # its requests per minute, so its limit stays the configured one.
+            rpm=optional_int(prefix + 'RPM') or defaults.get('rpm'),
+            tpm=optional_int(prefix + 'TPM'),
+        )
+
+    def _get_semaphore(self):
+        # Created lazily so providers can be instantiated outside of a running loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def enabled(self):
+        return True
+
+    def healthy(self):
+        return time.monotonic() >= self.degraded_until
+
+    def _on_success(self):
+        self.counts['successes'] += 1
+        self.consecutive_failures = 0
+
+    def _on_failure(self):
+        self.counts['failures'] += 1
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= self.failure_threshold:
+            self.degraded_until = time.monotonic() + self.cooldown
+            logging.warning(f'LLM provider {self.name} degraded for {self.cooldown}s after {self.consecutive_failures} failures')
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** attempt))
+
+    # Provider specific streaming, yielding text deltas and filling stats with token usage
+    async def _stream(self, params, stats):
+        raise NotImplementedError
+        yield
+
+    async def stream(self, params, stats):
+        self.counts['requests'] += 1
+        async with self._get_semaphore():
+            attempt = 0
+            while True:
+                reservation = await self.rate_limiter.acquire(estimate_request_tokens(params))
+                start = time.monotonic()
+                streamed = False
+                chunks = StreamTask(self._stream(params, stats))
+                try:
+                    while True:
+                        # The timeout bounds the time to the first token and every gap after it
+                        text = await asyncio.wait_for(chunks.queue.get(), self.timeout)
+                        if text is None:
+                            break
+                        if isinstance(text, Exception):
+                            raise text
+                        if not streamed:
+                            streamed = True
+                            stats['ttft_ms'] = round((time.monotonic() - start) * 1000)
+                        yield text
+                    stats['duration_ms'] = round((time.monotonic() - start) * 1000)
+                    self.rate_limiter.settle(reservation, (stats.get('input_tokens') or 0) + (stats.get('cache_creation_input_tokens') or 0)
+                                             + (stats.get('output_tokens') or 0))
+                    self._on_success()
+                    return
+                except Exception as e:
+                    if getattr(e, 'status_code', None) == 429:
+                        self.rate_limiter.throttled(error_headers(e).get('retry-after'))
+                    self.rate_limiter.update(error_headers(e))
+                    if streamed or attempt >= self.max_retries or not is_retryable(e):
+                        self._on_failure()
+                        raise
+                    self.counts['retries'] += 1
+                    attempt += 1
+                    stats['retries'] = attempt
+                    delay = self._backoff(attempt)
+                    logging.info(f'LLM provider {self.name} error ({type(e).__name__}: {e}), retry {attempt} in {delay:.2f}s')
+                    await asyncio.sleep(delay)
+                finally:
+                    await chunks.discard()
+
+    def stats(self):
+        return {**self.counts, 'degraded': not self.healthy(), 'max_concurrency': self.max_concurrency,
+                'rate_limit': self.rate_limiter.stats()}
+
+
+class AnthropicProvider(Provider):
+    name = 'anthropic'
+
+    def __init__(self, api_key=None, **kwargs):
+        super().__init__(**kwargs)
+        self.api_key = api_key or os.getenv('ANTHROPIC_API_KEY')
+        self.client = AsyncAnthropic(api_key=self.api_key, max_retries=0) if self.api_key else None
+
+    def enabled(self):
+        return self.client is not None
+
+    async def _stream(self, params, stats):
+        # Cache breakpoints in the system blocks need the prompt caching beta
+        extra_headers = PROMPT_CACHING_HEADERS if isinstance(params.get('system'), list) else {}
+        # The Messages API has no JSON mode, requests that ask for one rely on their prompt
+        params = {key: value for key, value in params.items() if key != 'response_format'}
+        async with self.client.messages.stream(**params, extra_headers=extra_headers) as stream:
+            self.rate_limiter.update(getattr(getattr(stream, 'response', None), 'headers', None))
+            async for event in stream:
+                if event.type == 'message_start':
+                    usage = event.message.usage
+                    stats['input_tokens'] = getattr(usage, 'input_tokens', None)
+                    stats['cache_creation_input_tokens'] = getattr(usage, 'cache_creation_input_tokens', None) or 0
+                    stats['cache_read_input_tokens'] = getattr(usage, 'cache_read_input_tokens', None) or 0
+                elif event.type == 'content_block_delta' and getattr(event.delta, 'text', None):
+                    yield event.delta.text
+                elif event.type == 'message_delta' and getattr(event, 'usage', None):
+                    stats['output_tokens'] = event.usage.output_tokens
+
+
+class GroqProvider(Provider):
+    name = 'groq'
+
+    def __init__(self, api_key=None, **kwargs):
+        super().__init__(**kwargs)
+        self.api_key = api_key or os.getenv('GROQ_API_KEY')
+        self.client = AsyncGroq(api_key=self.api_key, max_retries=0) if self.api_key else None
+
+    def enabled(self):
+        return self.client is not None
+
+    # Groq takes OpenAI-style messages with plain string content and the system prompt as a message
+    def to_messages(self, params):
+        messages = []
+        if params.get('system'):
+            messages.append({'role': 'system', 'content': text_of(params['system'])})
+        for message in params.get('messages', []):
+            messages.append({'role': message['role'], 'content': text_of(message['content'])})
+        return messages
+
+    async def _stream(self, params, stats):
+        request = {
+            'model': params['model'],
+            'messages': self.to_messages(params),
+            'max_tokens': params.get('max_tokens'),
+            'temperature': params.get('temperature'),
+            'stream': True,
+        }
+        # JSON mode does not stream, the completion is yielded as one chunk
+        if params.get('response_format'):
+            request['response_format'] = params['response_format']
+            request['stream'] = False
+        # The raw response exposes the rate limit headers, parse() gives the usual chunk stream
+        raw = await self.client.chat.completions.with_raw_response.create(**request)
+        self.rate_limiter.update(raw.headers)
+        response = raw.parse()
+        if inspect.isawaitable(response):
+            response = await response
+        if not request['stream']:
+            if response.usage:
+                stats['input_tokens'] = response.usage.prompt_tokens
+                stats['output_tokens'] = response.usage.completion_tokens
+            if response.choices and response.choices[0].message.content:
+                yield response.choices[0].message.content
+            return
+        async for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+            usage = getattr(getattr(chunk, 'x_groq', None), 'usage', None)
+            if usage:
+                stats['input_tokens'] = usage.prompt_tokens
+                stats['output_tokens'] = usage.completion_tokens
+
+
+# Local provider for tests and benchmarks: streams a fixed reply word by word
+class MockProvider(Provider):
+    name = 'mock'
+
+    def __init__(self, reply=None, delay=None, **kwargs):
+        super().__init__(**kwargs)
+        self.reply = reply or os.getenv('MOCK_LLM_REPLY', 'This is a mock explanation of the transaction.')
+        self.delay = float(delay if delay is not None else os.getenv('MOCK_LLM_DELAY', '0.01'))
+
+    async def _stream(self, params, stats):
+        stats['input_tokens'] = len(json.dumps(params.get('messages', []))) // 4
+        words = self.reply.split(' ')
+        for i, word in enumerate(words):
+            await asyncio.sleep(self.delay)
+            yield word if i == len(words) - 1 else word + ' '
+        stats['output_tokens'] = len(words)
+
+
+# One model's stream of a hedged request, raced against the other branch
+class Branch(StreamTask):
+    def __init__(self, model, stream, stats):
+        super().__init__(stream)
+        self.model = model
+        self.stats = stats
+        self.start = time.monotonic()
+
+
+# Routes requests to the provider of the requested model and fails over along
+# FALLBACK_MODELS when that provider is degraded, disabled or fails before streaming.
+class LLMRouter:
+    def __init__(self, providers, fallback_models=None):
+        self.providers = {provider.name: provider for provider in providers}
+        self.fallback_models = fallback_models if fallback_models is not None else FALLBACK_MODELS
+        self.ttft = {}
+        self.counts = {'requests': 0, 'failovers': 0, 'hedge_eligible': 0, 'hedged': 0, 'hedge_wins': 0}
+
+    def candidates(self, model):
+        models = [model] + [fallback for fallback in self.fallback_models.get(model, []) if fallback != model]
+        usable = [m for m in models if self.providers.get(provider_for(m)) and self.providers[provider_for(m)].enabled()]
+        healthy = [m for m in usable if self.providers[provider_for(m)].healthy()]
+        # When every provider is degraded, still try them rather than failing outright
+        return healthy or usable
+
+    def record_ttft(self, model, seconds):
+        self.ttft.setdefault(model, deque(maxlen=TTFT_WINDOW)).append(seconds)
+
+    def hedge_delay(self, model):
+        samples = self.ttft.get(model)
+        if not samples or len(samples) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        ordered = sorted(samples)
+        return max(HEDGE_MIN_DELAY, ordered[min(len(ordered) - 1, int(len(ordered) * HEDGE_PERCENTILE / 100))])
+
+    # The request for model. Requests fitted to the context window of the requested model are
+    # fitted again by fit(model) for a fallback model with a smaller one.
+    async def _params_for(self, model, params, fit):
+        if fit and model != params['model'] and estimate_request_tokens(params) > context_window(model) - (params.get('max_tokens') or 0):
+            logging.info(f'Fitting the request for {params["model"]} into the context window of {model}')
+            return await fit(model)
+        return {**params, 'model': model}
+
+    def _open(self, model, params):
+        stats = {}
+        return Branch(model, self.providers[provider_for(model)].stream(params, stats), stats)
+
+    # Races the primary model against the secondary once the primary is late with its first
+    # token. Returns the winning branch with its first chunk, the loser is cancelled. The
+    # models that were sent the request are added to tried.
+    async def _hedge(self, primary, secondary, params, fit=None, tried=None):
+        tried = [] if tried is None else tried
+        branches = {}
+
+        async def open_branch(model):
+            tried.append(model)
+            branch = self._open(model, await self._params_for(model, params, fit))
+            branches[asyncio.ensure_future(branch.queue.get())] = branch
+
+        await open_branch(primary)
+        done, _ = await asyncio.wait(set(branches), timeout=self.hedge_delay(primary))
+        if not done:
+            self.counts['hedged'] += 1
+            await open_branch(secondary)
+
+        pending = set(branches)
+        winner = None
+        last_error = None
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for waiter in done:
+                if isinstance(waiter.result(), Exception):
+                    last_error = waiter.result()
+                    await branches[waiter].discard()
+                elif winner is None:
+                    winner = waiter
+
+        for waiter in pending:
+            waiter.cancel()
+            branch = branches[waiter]
+            if branch.model == primary:
+                # The primary took at least this long, which keeps slow samples in the percentile
+                self.record_ttft(primary, time.monotonic() - branch.start)
+            await branch.discard()
+        for waiter in done:
+            if waiter is not winner and not isinstance(waiter.result(), Exception):
+                await branches[waiter].discard()
+
+        if winner is None:
+            raise last_error
+        branch = branches[winner]
+        self.record_ttft(branch.model, time.monotonic() - branch.start)
+        if branch.model != primary:
+            self.counts['hedge_wins'] += 1
+        return branch, winner.result(), len(branches) > 1
+
+    async def stream(self, params, stats, hedge=None, fit=None):
+        self.counts['requests'] += 1
+        candidates = self.candidates(params['model'])
+        if not candidates:
+            raise ProviderError(f'No LLM provider configured for {params["model"]}')
+        last_error = None
+
+        if (HEDGING if hedge is None else hedge) and len(candidates) > 1:
+            self.counts['hedge_eligible'] += 1
+            tried = []
+            try:
+                branch, first, hedged = await self._hedge(candidates[0], candidates[1], params, fit, tried)
+            except Exception as e:
+                last_error = e
+                # A primary that fails before the hedge delay leaves the secondary untried
+                candidates = [model for model in candidates if model not in tried]
+            else:
+                model = branch.model
+                stats.update({'provider': provider_for(model), 'model': model, 'hedged': hedged})
+                if hedged:
+                    stats['hedge_winner'] = 'primary' if model == candidates[0] else 'secondary'
+                stats.update(branch.stats)
+                try:
+                    if first is not None:
+                        yield first
+                        async for text in branch.chunks():
+                            yield text
+                finally:
+                    await branch.discard()
+                    stats.update(branch.stats)
+                return
+
+        for model in candidates:
+            provider = self.providers[provider_for(model)]
+            stats.update({'provider': provider.name, 'model': model})
+            if model != params['model']:
+                self.counts['failovers'] += 1
+                stats['failover_from'] = params['model']
+                logging.warning(f'Failing over from {params["model"]} to {model}')
+            streamed = False
+            try:
+                async for text in provider.stream(await self._params_for(model, params, fit), stats):
+                    if not streamed:
+                        streamed = True
+                        self.record_ttft(model, stats.get('ttft_ms', 0) / 1000)
+                    yield text
+                return
+            except Exception as e:
+                if streamed:
+                    raise
+                last_error = e
+        raise last_error
+
+    async def complete(self, params, stats, hedge=None, fit=None):
+        return ''.join([text async for text in self.stream(params, stats, hedge, fit)])
+
+    def stats(self):
+        counts = dict(self.counts)
+        counts['hedge_rate'] = counts['hedged'] / counts['hedge_eligible'] if counts['hedge_eligible'] else 0.0
+        counts['hedge_win_rate'] = counts['hedge_wins'] / counts['hedged'] if counts['hedged'] else 0.0
+        counts['hedge_delay'] = {model: round(self.hedge_delay(model), 3) for model in self.ttft}
+        return {**counts, 'providers': {name: provider.stats() for name, provider in self.providers.items()}}
+
+
+llm_router = LLMRouter([
+    AnthropicProvider.from_env(max_concurrency=16, timeout=60.0),
+    GroqProvider.from_env(max_concurrency=8, timeout=30.0, rpm=30),
+    MockProvider.from_env(max_concurrency=64, timeout=10.0),
+])
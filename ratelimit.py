@@ -0,0 +1,162 @@
+import re
+import time
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime, timezone
+
+# Rate limit headers, checked in order. Anthropic reports reset times as RFC 3339
+# timestamps, Groq (OpenAI style) as durations like "1m26.4s" or "120ms". Groq's request
+# headers count requests per day, not per minute, so they only cap the day and its requests
+# per minute come from the configured limit and the retry-after of 429 responses.
+REQUEST_HEADERS = [
+    ('anthropic-ratelimit-requests-limit', 'anthropic-ratelimit-requests-remaining', 'anthropic-ratelimit-requests-reset'),
+]
+DAILY_REQUEST_HEADERS = [
+    ('x-ratelimit-limit-requests', 'x-ratelimit-remaining-requests', 'x-ratelimit-reset-requests'),
+]
+TOKEN_HEADERS = [
+    ('anthropic-ratelimit-tokens-limit', 'anthropic-ratelimit-tokens-remaining', 'anthropic-ratelimit-tokens-reset'),
+    ('anthropic-ratelimit-input-tokens-limit', 'anthropic-ratelimit-input-tokens-remaining', 'anthropic-ratelimit-input-tokens-reset'),
+    ('x-ratelimit-limit-tokens', 'x-ratelimit-remaining-tokens', 'x-ratelimit-reset-tokens'),
+]
+DURATION_PATTERN = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+DURATION_UNITS = {'h': 3600, 'm': 60, 's': 1, 'ms': 0.001}
+
+
+# Seconds from now until a reset header value
+def parse_reset(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, (datetime.fromisoformat(value.replace('Z', '+00:00')) - datetime.now(timezone.utc)).total_seconds())
+    except ValueError:
+        pass
+    parts = DURATION_PATTERN.findall(value)
+    if not parts:
+        return None
+    return sum(float(number) * DURATION_UNITS[unit] for number, unit in parts)
+
+def parse_int(value):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+class Quota:
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.remaining = None
+        self.observed_at = 0.0
+        self.reset_at = 0.0
+
+    def update(self, headers, names):
+        for limit_name, remaining_name, reset_name in names:
+            if remaining_name not in headers:
+                continue
+            self.limit = parse_int(headers.get(limit_name)) or self.limit
+            self.remaining = parse_int(headers.get(remaining_name))
+            self.observed_at = time.monotonic()
+            reset = parse_reset(headers.get(reset_name))
+            self.reset_at = self.observed_at + reset if reset is not None else 0.0
+            return
+
+
+# Schedules requests to a provider to stay just under its requests-per-minute and
+# tokens-per-minute limits. Limits and remaining quota come from the rate limit headers
+# of every response. Between responses, a one minute sliding window of the requests and
+# (estimated, then actual) tokens we sent keeps the rate under headroom * limit. A daily
+# request quota only makes requests wait for its reset once it is used up.
+class RateLimiter:
+    def __init__(self, name, rpm=None, tpm=None, headroom=0.9, window=60.0):
+        self.name = name
+        self.requests = Quota(rpm)
+        self.tokens = Quota(tpm)
+        self.daily_requests = Quota()
+        self.headroom = headroom
+        self.window = window
+        self.sent = deque()
+        self.blocked_until = 0.0
+        self.counts = {'acquired': 0, 'waits': 0, 'waited_seconds': 0.0, 'throttled': 0}
+        self._lock = None
+
+    def _get_lock(self):
+        # Created lazily so the limiter can be instantiated outside of a running loop
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    def update(self, headers):
+        if not headers:
+            return
+        self.requests.update(headers, REQUEST_HEADERS)
+        self.tokens.update(headers, TOKEN_HEADERS)
+        self.daily_requests.update(headers, DAILY_REQUEST_HEADERS)
+
+    def throttled(self, retry_after=None):
+        self.counts['throttled'] += 1
+        delay = parse_reset(retry_after) if retry_after else None
+        self.blocked_until = max(self.blocked_until, time.monotonic() + (delay if delay is not None else 1.0))
+
+    def _prune(self, now):
+        while self.sent and now - self.sent[0][0] > self.window:
+            self.sent.popleft()
+
+    def _wait_time(self, now, estimated_tokens):
+        waits = [self.blocked_until - now]
+
+        if self.requests.limit and self.sent and len(self.sent) + 1 > self.requests.limit * self.headroom:
+            waits.append(self.sent[0][0] + self.window - now)
+
+        if self.tokens.limit:
+            budget = self.tokens.limit * self.headroom
+            used = sum(entry[1] for entry in self.sent)
+            if used and used + estimated_tokens > budget:
+                for sent_at, tokens in self.sent:
+                    used -= tokens
+                    if used + estimated_tokens <= budget:
+                        waits.append(sent_at + self.window - now)
+                        break
+
+        # The server's view wins over our window: wait for the reset when what is left after
+        # the requests sent since the headers were read cannot cover this one
+        for quota, cost in ((self.requests, 1), (self.daily_requests, 1), (self.tokens, estimated_tokens)):
+            if quota.remaining is None or now >= quota.reset_at:
+                continue
+            spent = sum(entry[1] if quota is self.tokens else 1 for entry in self.sent if entry[0] > quota.observed_at)
+            if quota.remaining - spent < cost:
+                waits.append(quota.reset_at - now)
+
+        return max(waits)
+
+    # Waits until a request of about estimated_tokens fits under the limits and reserves it
+    async def acquire(self, estimated_tokens):
+        async with self._get_lock():
+            waited = 0.0
+            while True:
+                now = time.monotonic()
+                self._prune(now)
+                wait = self._wait_time(now, estimated_tokens)
+                if wait <= 0:
+                    break
+                waited += wait
+                await asyncio.sleep(wait)
+            entry = [time.monotonic(), estimated_tokens]
+            self.sent.append(entry)
+            self.counts['acquired'] += 1
+            if waited:
+                self.counts['waits'] += 1
+                self.counts['waited_seconds'] += waited
+                logging.info(f'Rate limiter {self.name} waited {waited:.2f}s')
+            return entry
+
+    # Replace the estimate of a reserved request with the tokens it actually used
+    def settle(self, entry, actual_tokens):
+        if actual_tokens:
+            entry[1] = actual_tokens
+
+    def stats(self):
+        return {**self.counts, 'rpm': self.requests.limit, 'tpm': self.tokens.limit,
+                'requests_remaining': self.requests.remaining, 'tokens_remaining': self.tokens.remaining,
+                'daily_requests_remaining': self.daily_requests.remaining}
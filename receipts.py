@@ -0,0 +1,153 @@
+import asyncio
+import decimal
+import logging
+from collections import OrderedDict
+import aiohttp
+import pandas as pd
+from eth_abi import decode
+from trace_backend import NodeRpc, TRANSFER_TOPIC
+
+TRANSFER_SINGLE_TOPIC = '0xc3d58168c5ae7397731d063d5bbf3d657854427343f4c083240f7aacaa2d0f62'
+TRANSFER_BATCH_TOPIC = '0x4a39dc06d4c0dbc64b70af90fd698a233a518aa5d07e595d983b8c0526c8f7fb'
+
+LOG_COLUMNS = ['tx_hash', 'token_address', 'topic0', 'topic1', 'topic2', 'topic3', 'topic_count', 'data']
+TRANSFER_COLUMNS = ['tx_hash', 'token_address', 'standard', 'from', 'to', 'raw_amount', 'token_id']
+
+
+def hex_to_int(value):
+    value = (value or '0x')[2:]
+    return int(value, 16) if value else 0
+
+# Flatten the logs of every receipt in a block into one frame
+def logs_frame(receipts):
+    rows = []
+    for receipt in receipts:
+        tx_hash = receipt['transactionHash'].lower()
+        for log in receipt.get('logs', []):
+            topics = [topic.lower() for topic in log.get('topics', [])]
+            rows.append((tx_hash, log['address'].lower(), *(topics + [None] * 4)[:4], len(topics), log.get('data', '0x')))
+    return pd.DataFrame(rows, columns=LOG_COLUMNS)
+
+def topic_address(topics):
+    return '0x' + topics.str[26:]
+
+# Decode all ERC-20/721/1155 transfer events of a block in one pass over the logs frame
+def decode_transfers(logs):
+    frames = []
+
+    transfers = logs[logs['topic0'] == TRANSFER_TOPIC]
+    erc20 = transfers[transfers['topic_count'] == 3]
+    frames.append(pd.DataFrame({
+        'tx_hash': erc20['tx_hash'],
+        'token_address': erc20['token_address'],
+        'standard': 'ERC20',
+        'from': topic_address(erc20['topic1']),
+        'to': topic_address(erc20['topic2']),
+        'raw_amount': erc20['data'].str[:66].map(hex_to_int),
+        'token_id': None,
+    }, columns=TRANSFER_COLUMNS))
+
+    erc721 = transfers[transfers['topic_count'] == 4]
+    frames.append(pd.DataFrame({
+        'tx_hash': erc721['tx_hash'],
+        'token_address': erc721['token_address'],
+        'standard': 'ERC721',
+        'from': topic_address(erc721['topic1']),
+        'to': topic_address(erc721['topic2']),
+        'raw_amount': 1,
+        'token_id': erc721['topic3'].map(hex_to_int),
+    }, columns=TRANSFER_COLUMNS))
+
+    single = logs[logs['topic0'] == TRANSFER_SINGLE_TOPIC]
+    frames.append(pd.DataFrame({
+        'tx_hash': single['tx_hash'],
+        'token_address': single['token_address'],
+        'standard': 'ERC1155',
+        'from': topic_address(single['topic2']),
+        'to': topic_address(single['topic3']),
+        'raw_amount': ('0x' + single['data'].str[66:130]).map(hex_to_int),
+        'token_id': ('0x' + single['data'].str[2:66]).map(hex_to_int),
+    }, columns=TRANSFER_COLUMNS))
+
+    # Batch transfers carry dynamic arrays, these are rare enough to decode row by row
+    batch_rows = []
+    for row in logs[logs['topic0'] == TRANSFER_BATCH_TOPIC].itertuples():
+        try:
+            token_ids, amounts = decode(['uint256[]', 'uint256[]'], bytes.fromhex(row.data[2:]))
+        except Exception:
+            logging.info(f'Could not decode TransferBatch in {row.tx_hash}')
+            continue
+        for token_id, amount in zip(token_ids, amounts):
+            batch_rows.append((row.tx_hash, row.token_address, 'ERC1155', '0x' + row.topic2[26:], '0x' + row.topic3[26:], amount, token_id))
+    frames.append(pd.DataFrame(batch_rows, columns=TRANSFER_COLUMNS))
+
+    return pd.concat(frames, ignore_index=True)
+
+def format_amount(transfer, token_info):
+    if transfer['standard'] == 'ERC20':
+        decimals = token_info.get('decimals') if token_info else None
+        if decimals is None:
+            return str(int(transfer['raw_amount']))
+        return str(decimal.Decimal(int(transfer['raw_amount'])) / decimal.Decimal(10**int(decimals)))
+    return str(int(transfer['raw_amount']))
+
+
+# Receipt stage for backfills: fetches eth_getBlockReceipts once per block and fills
+# in missing asset change amounts for every selected transaction of that block
+class BlockReceiptStage:
+    def __init__(self, rpc_endpoint, max_blocks=64):
+        self.rpc = NodeRpc(rpc_endpoint)
+        self.max_blocks = max_blocks
+        self.blocks = OrderedDict()
+
+    async def _load_block(self, block_number):
+        async with aiohttp.ClientSession() as session:
+            receipts = await self.rpc.rpc(session, 'eth_getBlockReceipts', [hex(block_number)])
+        transfers = decode_transfers(logs_frame(receipts or []))
+        return {tx_hash: group.to_dict('records') for tx_hash, group in transfers.groupby('tx_hash')}
+
+    # Concurrent callers for the same block share a single request
+    async def get_transfers(self, block_number):
+        if block_number not in self.blocks:
+            self.blocks[block_number] = asyncio.ensure_future(self._load_block(block_number))
+            while len(self.blocks) > self.max_blocks:
+                self.blocks.popitem(last=False)
+        future = self.blocks[block_number]
+        try:
+            return await future
+        except Exception:
+            # Failed requests aren't cached, so the next transaction of the block retries
+            if self.blocks.get(block_number) is future:
+                del self.blocks[block_number]
+            raise
+
+    async def fill_asset_changes(self, trimmed, tx_hash, block_number):
+        missing = [change for change in trimmed.get('asset_changes', []) if change.get('amount') in (None, '')]
+        if not missing:
+            return trimmed
+        try:
+            transfers = (await self.get_transfers(block_number)).get(tx_hash.lower(), [])
+            used = set()
+            async with aiohttp.ClientSession() as session:
+                for asset_change in missing:
+                    token_info = asset_change.setdefault('token_info', {})
+                    token_address = (token_info.get('contract_address') or '').lower()
+                    for i, transfer in enumerate(transfers):
+                        if i in used or transfer['token_address'] != token_address:
+                            continue
+                        if transfer['from'] != (asset_change.get('from') or '').lower() or transfer['to'] != (asset_change.get('to') or '').lower():
+                            continue
+                        used.add(i)
+                        token = await self.rpc.get_token_info(session, token_address) if transfer['standard'] == 'ERC20' else {}
+                        asset_change['amount'] = format_amount(transfer, token)
+                        if token:
+                            token_info['symbol'] = token['symbol']
+                            token_info['name'] = token['name']
+                            token_info['decimals'] = token['decimals']
+                            token_info['type'] = 'Fungible'
+                        if pd.notna(transfer['token_id']):
+                            asset_change['token_id'] = str(int(transfer['token_id']))
+                        break
+        except Exception as e:
+            logging.error(f'Error applying block receipts for {tx_hash}: {str(e)}')
+        return trimmed
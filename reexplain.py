@@ -0,0 +1,107 @@
+import os
+import asyncio
+import argparse
+from collections import Counter
+from dotenv import load_dotenv
+from google.cloud import storage
+from simulation_format import load_simulation
+from providers import llm_router
+from discovery import list_prefix, tx_hash_from_name
+from explanations import explanations_prefix, explanation_version, version_from_name
+from explain import explain_transaction
+from usage import load_records, REQUESTS_PREFIX, USAGE_PREFIX
+
+load_dotenv()
+
+# Targeted re-explain: regenerates only the explanations that were produced by another
+# system prompt or model than the current one, most requested transactions first
+BUCKET_NAME = os.getenv('GCS_BUCKET_NAME')
+storage_client = storage.Client()
+bucket = storage_client.bucket(BUCKET_NAME)
+
+
+# Stored explanation versions per transaction, None stands for the legacy unversioned file
+async def list_explanation_versions(network):
+    versions = {}
+    prefix = explanations_prefix(network)
+
+    async def on_page(page):
+        for blob in page:
+            tx_hash = tx_hash_from_name(blob.name, prefix)
+            if tx_hash:
+                versions.setdefault(tx_hash, set()).add(version_from_name(blob.name))
+
+    await list_prefix(bucket, prefix, on_page)
+    return versions
+
+# Explain requests plus chat and question turns per transaction over the last days
+def popularity(network, days):
+    counts = Counter()
+    for prefix, kinds in ((REQUESTS_PREFIX, None), (USAGE_PREFIX, ('chat', 'questions'))):
+        records = load_records(bucket, days, prefix)
+        if records.empty:
+            continue
+        records = records[records['network'] == network]
+        if kinds:
+            records = records[records['kind'].isin(kinds)]
+        counts.update(records['tx_hash'].dropna())
+    return counts
+
+async def outdated_explanations(network, system_prompt, model, days, min_requests, limit):
+    current = explanation_version(system_prompt, model)
+    versions, counts = await asyncio.gather(list_explanation_versions(network), asyncio.to_thread(popularity, network, days))
+    outdated = [tx_hash for tx_hash, stored in versions.items() if current not in stored and counts[tx_hash] >= min_requests]
+    outdated.sort(key=lambda tx_hash: counts[tx_hash], reverse=True)
+    return [(tx_hash, counts[tx_hash]) for tx_hash in outdated[:limit]]
+
+async def reexplain_transaction(network, tx_hash, system_prompt, model, semaphore):
+    async with semaphore:
+        try:
+            blob = bucket.blob(f'{network}/transactions/simulations/trimmed/{tx_hash}.json')
+            data = load_simulation(await asyncio.to_thread(blob.download_as_string))
+            explanation = ''
+            async for word in explain_transaction(llm_router, data, network=network, system_prompt=system_prompt, model=model):
+                explanation += word
+            return bool(explanation)
+        except Exception as e:
+            print(f'Error re-explaining {tx_hash}: {str(e)}')
+            return False
+
+async def main(network, system_prompt_file, model, days, min_requests, limit, concurrency, dry_run):
+    system_prompt = None
+    if system_prompt_file:
+        with open(system_prompt_file, 'r') as file:
+            system_prompt = file.read()
+
+    outdated = await outdated_explanations(network, system_prompt, model, days, min_requests, limit)
+    print(f'{len(outdated)} outdated explanations for version {explanation_version(system_prompt, model)}')
+    if dry_run:
+        for tx_hash, requests in outdated:
+            print(f'{tx_hash} {requests}')
+        return
+
+    semaphore = asyncio.Semaphore(concurrency)
+    results = await asyncio.gather(*[reexplain_transaction(network, tx_hash, system_prompt, model, semaphore) for tx_hash, _ in outdated])
+    print(f'Re-explained {sum(results)}/{len(outdated)} transactions')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Regenerate explanations made with an outdated prompt or model')
+    parser.add_argument('-n', '--network', type=str, default='ethereum', choices=['ethereum', 'arbitrum', 'avalanche', 'optimism'],
+                        help='Blockchain network to re-explain transactions for (default: ethereum)')
+    parser.add_argument('-p', '--prompt', type=str, default='system_prompt.txt',
+                        help='Path to the file containing the current system prompt (default: system_prompt.txt)')
+    parser.add_argument('-m', '--model', type=str, default=os.getenv('DEFAULT_MODEL') or 'claude-3-haiku-20240307',
+                        help='Current model for explanations (default: DEFAULT_MODEL or claude-3-haiku-20240307)')
+    parser.add_argument('-d', '--days', type=int, default=30,
+                        help='Days of request history used to rank transactions by popularity (default: 30)')
+    parser.add_argument('--min-requests', type=int, default=0,
+                        help='Only re-explain transactions requested at least this many times (default: 0)')
+    parser.add_argument('-l', '--limit', type=int, default=1000,
+                        help='Maximum number of transactions to re-explain (default: 1000)')
+    parser.add_argument('-c', '--concurrency', type=int, default=8,
+                        help='Maximum number of concurrent explanations (default: 8)')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Only print the outdated transactions and their request counts')
+    args = parser.parse_args()
+
+    asyncio.run(main(args.network, args.prompt, args.model, args.days, args.min_requests, args.limit, args.concurrency, args.dry_run))
@@ -4,14 +4,23 @@ import asyncio
 import aiohttp
 import argparse
 import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from google.cloud import bigquery, storage
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 from web3 import AsyncWeb3
-import decimal
 from label import add_labels
+from tenderly import TenderlyClient, tenderly_client
+from trace_backend import get_trace_backend
+from simulation_format import load_simulation
+from manifest import upload_trimmed, flush_manifests
+from receipts import BlockReceiptStage
 
-w3 = AsyncWeb3(AsyncWeb3.AsyncHTTPProvider('https://cloudflare-eth.com'))
+def new_web3():
+    return AsyncWeb3(AsyncWeb3.AsyncHTTPProvider('https://cloudflare-eth.com'))
+
+w3 = new_web3()
 load_dotenv()
 
 logging.getLogger().setLevel(logging.INFO)
@@ -21,41 +30,51 @@ bigquery_client = bigquery.Client()
 storage_client = storage.Client()
 bucket = storage_client.bucket(bucket_name)
 
+# Set by main when the block receipt stage is enabled for a backfill
+BLOCK_RECEIPTS = None
+
 NETWORK_CONFIGS = {
     'ethereum': {
         'table': 'bigquery-public-data.crypto_ethereum.transactions',
         'blocks_table': 'bigquery-public-data.crypto_ethereum.blocks',
         'network_id': '1',
+        'rpc_endpoint': os.getenv('ETH_RPC_ENDPOINT'),
     },
     'arbitrum': {
         'table': 'bigquery-public-data.goog_blockchain_arbitrum_one_us.transactions',
         'blocks_table': 'bigquery-public-data.goog_blockchain_arbitrum_one_us.blocks',
         'network_id': '42161',
+        'rpc_endpoint': os.getenv('ARB_RPC_ENDPOINT'),
     },
     'avalanche': {
         'table': 'bigquery-public-data.goog_blockchain_avalanche_contract_chain_us.transactions',
         'blocks_table': 'bigquery-public-data.goog_blockchain_avalanche_contract_chain_us.blocks',
         'network_id': '43114',
+        'rpc_endpoint': os.getenv('AVAX_RPC_ENDPOINT'),
     },
     'optimism': {
         'table': 'bigquery-public-data.goog_blockchain_optimism_mainnet_us.transactions',
         'blocks_table': 'bigquery-public-data.goog_blockchain_optimism_mainnet_us.blocks',
         'network_id': '10',
+        'rpc_endpoint': os.getenv('OP_RPC_ENDPOINT'),
     },
     'base': {
         'table': 'none',
         'blocks_table': 'none',
         'network_id': '8453',
+        'rpc_endpoint': os.getenv('BASE_RPC_ENDPOINT'),
     },
     'blast': {
         'table': 'none',
         'blocks_table': 'none',
         'network_id': '81467',
+        'rpc_endpoint': os.getenv('BLAST_RPC_ENDPOINT'),
     },
     'mantle': {
         'table': 'none',
         'blocks_table': 'none',
         'network_id': '5000',
+        'rpc_endpoint': os.getenv('MANTLE_RPC_ENDPOINT'),
     },
 }
 
@@ -274,83 +293,17 @@ async def extract_useful_fields(sim_data):
             result['asset_changes'].append(asset_change_summary)
     return result
 
-async def apply_logs(sim_data):
-    result=sim_data
-    logging.info("Applying logs for edge cases")
-    try:
-        transfers=[]
-        tokens={}
-        tx_hash=sim_data["hash"]
-        receipt= await w3.eth.get_transaction_receipt(tx_hash)
-        logs=receipt["logs"]
-        for log in logs:
-            topic0=log["topics"][0].hex()
-            if topic0=="0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef":
-                transfer_from="0x"+w3.to_hex(log["topics"][1])[26:]
-                transfer_to="0x"+w3.to_hex(log["topics"][2])[26:]
-                transfer_amount=w3.to_int(log["data"])
-                token_address=log["address"]
-                if token_address not in tokens:
-                    token_address_contract=w3.to_checksum_address(token_address)
-                    abi='[{"constant": true,"inputs": [],"name": "name","outputs": [{"name": "","type": "string"}],"payable": false,"stateMutability": "view","type": "function"},{"constant": false,"inputs": [{"name": "_spender","type": "address"},{"name": "_value","type": "uint256"}],"name": "approve","outputs": [{"name": "","type": "bool"}],"payable": false,"stateMutability": "nonpayable","type": "function"},{"constant": true,"inputs": [],"name": "totalSupply","outputs": [{"name": "","type": "uint256"}],"payable": false,"stateMutability": "view","type": "function"},{"constant": false,"inputs": [{"name": "_from","type": "address"},{"name": "_to","type": "address"},{"name": "_value","type": "uint256"}],"name": "transferFrom","outputs": [{"name": "","type": "bool"}],"payable": false,"stateMutability": "nonpayable","type": "function"},{"constant": true,"inputs": [],"name": "decimals","outputs": [{"name": "","type": "uint8"}],"payable": false,"stateMutability": "view","type": "function"},{"constant": true,"inputs": [{"name": "_owner","type": "address"}],"name": "balanceOf","outputs": [{"name": "balance","type": "uint256"}],"payable": false,"stateMutability": "view","type": "function"},{"constant": true,"inputs": [],"name": "symbol","outputs": [{"name": "","type": "string"}],"payable": false,"stateMutability": "view","type": "function"},{"constant": false,"inputs": [{"name": "_to","type": "address"},{"name": "_value","type": "uint256"}],"name": "transfer","outputs": [{"name": "","type": "bool"}],"payable": false,"stateMutability": "nonpayable","type": "function"},{"constant": true,"inputs": [{"name": "_owner","type": "address"},{"name": "_spender","type": "address"}],"name": "allowance","outputs": [{"name": "","type": "uint256"}],"payable": false,"stateMutability": "view","type": "function"},{"payable": true,"stateMutability": "payable","type": "fallback"},{"anonymous": false,"inputs": [{"indexed": true,"name": "owner","type": "address"},{"indexed": true,"name": "spender","type": "address"},{"indexed": false,"name": "value","type": "uint256"}],"name": "Approval","type": "event"},{"anonymous": false,"inputs": [{"indexed": true,"name": "from","type": "address"},{"indexed": true,"name": "to","type": "address"},{"indexed": false,"name": "value","type": "uint256"}],"name": "Transfer","type": "event"}]'
-                    contract = w3.eth.contract(address=token_address_contract, abi=abi)
-                    token_decimals= await contract.functions.decimals().call()
-                    token_name= await contract.functions.name().call()
-                    token_symbol= await contract.functions.symbol().call()
-                    token_obj={
-                        "name": token_name,
-                        "symbol" : token_symbol,
-                        "decimals" : int(token_decimals)
-                    }
-                    tokens[token_address]=token_obj
-                transfer_obj={
-                    "token_address": token_address,
-                    "from" : transfer_from,
-                    "to" : transfer_to,
-                    "amount" : decimal.Decimal(transfer_amount)/decimal.Decimal(10**tokens[token_address]["decimals"]),
-                    "token_name" : tokens[token_address]["name"],
-                    "token_symbol" : tokens[token_address]["symbol"],
-                    "token_decimals" : tokens[token_address]["decimals"]
-                }
-                transfers.append(transfer_obj)
-
-        for asset_change in result["asset_changes"]:
-            if asset_change["amount"] is None:
-                token_address=asset_change["token_info"]["contract_address"]
-                transfer_from=asset_change["from"]
-                transfer_to=asset_change["to"]
-                for transfer in transfers:
-                    if (transfer["from"]==transfer_from and transfer["to"]==transfer_to and transfer["token_address"].lower()==token_address.lower()):
-                        asset_change["amount"]=str(transfer["amount"])
-                        asset_change["token_info"]["symbol"]=transfer["token_symbol"]
-                        asset_change["token_info"]["name"]=transfer["token_name"]
-                        asset_change["token_info"]["decimals"]=transfer["token_decimals"]    
-                        asset_change["token_info"]["type"]="Fungible"
-    except :
-        logging.error ("Error in web3 call - logs: " + str(tx_hash) )
-    return result
-
 async def get_cached_simulation(tx_hash, network):
     blob = bucket.blob(f'{network}/transactions/simulations/trimmed/{tx_hash}.json')
     if blob.exists():
-        return json.loads(blob.download_as_string())
+        return load_simulation(blob.download_as_string())
     return None
 
 async def fetch_tenderly_simulation(tx_details, tenderly_account_slug, tenderly_project_slug, tenderly_access_key, session):
-    async with session.post(
-        f'https://api.tenderly.co/api/v1/account/{tenderly_account_slug}/project/{tenderly_project_slug}/simulate',
-        json=tx_details,
-        headers={'X-Access-Key': tenderly_access_key}
-    ) as response:
-        return await response.json()
-
-async def simulate_transaction(tx_hash, block_number, from_address, to_address, gas, value, input_data, tx_index, network):
-    tenderly_account_slug = os.getenv('TENDERLY_ACCOUNT_SLUG')
-    tenderly_project_slug = os.getenv('TENDERLY_PROJECT_SLUG')
-    tenderly_access_key = os.getenv('TENDERLY_ACCESS_KEY')
-    labels_dataset = os.getenv('LABELS_DATASET')
+    return await tenderly_client.simulate(session, tx_details, tenderly_account_slug, tenderly_project_slug, tenderly_access_key)
 
-    tx_details = {
+def build_tx_details(block_number, from_address, to_address, gas, value, input_data, tx_index, network):
+    return {
         'network_id': NETWORK_CONFIGS[network]['network_id'],
         'block_number': block_number,
         'from': from_address,
@@ -363,38 +316,156 @@ async def simulate_transaction(tx_hash, block_number, from_address, to_address,
         'generate_access_list': True,
     }
 
+# Store the full simulation, then trim, label and store the trimmed one
+async def process_simulation(sim_data, tx_hash, network, block_number=None):
+    labels_dataset = os.getenv('LABELS_DATASET')
+    sim_data['transaction']['hash'] = tx_hash
+    if 'transaction_info' in sim_data['transaction']:
+        sim_data['transaction']['transaction_info']['transaction_id'] = tx_hash
+        if 'call_trace' in sim_data['transaction']['transaction_info']:
+            sim_data['transaction']['transaction_info']['call_trace']['hash'] = tx_hash
+    try:
+        blob = bucket.blob(f'{network}/transactions/simulations/full/{tx_hash}.json')
+        blob.upload_from_string(json.dumps(sim_data))
+        logging.info(f'{tx_hash} full simulation written successfully to bucket')
+    except Exception as e:
+        logging.error(f'Error uploading full simulation for {tx_hash}: {str(e)}')
+    trimmed = await extract_useful_fields(sim_data)
+    if BLOCK_RECEIPTS and block_number is not None:
+        trimmed = await BLOCK_RECEIPTS.fill_asset_changes(trimmed, tx_hash, block_number)
+
+    # Fast labeling available only for Ethereum at the moment
+    if network == "ethereum":
+        trimmed = await add_labels(trimmed, labels_dataset, bigquery_client)
+
+    try:
+        upload_trimmed(bucket, network, tx_hash, trimmed)
+        logging.info(f'{tx_hash} trimmed simulation written successfully to bucket')
+    except Exception as e:
+        logging.error(f'Error uploading trimmed simulation for {tx_hash}: {str(e)}')
+    return trimmed
+
+async def simulate_transaction(tx_hash, block_number, from_address, to_address, gas, value, input_data, tx_index, network):
+    tenderly_account_slug = os.getenv('TENDERLY_ACCOUNT_SLUG')
+    tenderly_project_slug = os.getenv('TENDERLY_PROJECT_SLUG')
+    tenderly_access_key = os.getenv('TENDERLY_ACCESS_KEY')
+
+    tx_details = build_tx_details(block_number, from_address, to_address, gas, value, input_data, tx_index, network)
+
     async with aiohttp.ClientSession() as session:
+        # Historical transactions can be traced on our own node, Tenderly stays the fallback
+        trace_backend = get_trace_backend(network)
+        if trace_backend:
+            try:
+                logging.info(f'Tracing transaction on node: {tx_hash}')
+                sim_data = await trace_backend.simulate(session, tx_hash, network)
+                if sim_data:
+                    return await process_simulation(sim_data, tx_hash, network, block_number)
+            except Exception as e:
+                logging.warning(f'Node trace failed for {tx_hash}, falling back to Tenderly: {str(e)}')
+
         logging.info(f'Simulating transaction: {tx_hash}')
         sim_data = await fetch_tenderly_simulation(tx_details, tenderly_account_slug, tenderly_project_slug, tenderly_access_key, session)
         if sim_data and 'transaction' in sim_data:
-            sim_data['transaction']['hash'] = tx_hash
-            if 'transaction_info' in sim_data['transaction']:
-                sim_data['transaction']['transaction_info']['transaction_id'] = tx_hash
-                if 'call_trace' in sim_data['transaction']['transaction_info']:
-                    sim_data['transaction']['transaction_info']['call_trace']['hash'] = tx_hash
-            try:
-                blob = bucket.blob(f'{network}/transactions/simulations/full/{tx_hash}.json')
-                blob.upload_from_string(json.dumps(sim_data))
-                logging.info(f'{tx_hash} full simulation written successfully to bucket')
-            except Exception as e:
-                logging.error(f'Error uploading full simulation for {tx_hash}: {str(e)}')
-            trimmed = await extract_useful_fields(sim_data)
-            # trimmed_logs_applied = await apply_logs(trimmed_decimals)
+            return await process_simulation(sim_data, tx_hash, network, block_number)
+    return None
 
-            # Fast labeling available only for Ethereum at the moment
-            if network == "ethereum":
-                trimmed = await add_labels(trimmed, labels_dataset, bigquery_client)
+async def simulate_row(tx, network):
+    return await simulate_transaction(
+        tx['hash'],
+        tx['block_number'],
+        tx['from_address'],
+        tx['to_address'],
+        tx['gas'],
+        str(tx['value']),
+        tx['input'],
+        tx['transaction_index'],
+        network
+    )
+
+# Simulate the selected transactions of one block as a single Tenderly bundle, so the
+# block prefix is replayed once. Falls back to per-transaction simulation for anything
+# the bundle couldn't produce.
+async def simulate_block_bundle(transactions, network):
+    tenderly_account_slug = os.getenv('TENDERLY_ACCOUNT_SLUG')
+    tenderly_project_slug = os.getenv('TENDERLY_PROJECT_SLUG')
+    tenderly_access_key = os.getenv('TENDERLY_ACCESS_KEY')
 
-            try:
-                blob = bucket.blob(f'{network}/transactions/simulations/trimmed/{tx_hash}.json')
-                blob.upload_from_string(json.dumps(trimmed))
-                logging.info(f'{tx_hash} trimmed simulation written successfully to bucket')
-            except Exception as e:
-                logging.error(f'Error uploading trimmed simulation for {tx_hash}: {str(e)}')
-            return trimmed
-    return None
-async def main(start_day, end_day, network):
+    transactions = sorted(transactions, key=lambda tx: tx['transaction_index'])
+    simulations = [
+        build_tx_details(tx['block_number'], tx['from_address'], tx['to_address'], tx['gas'], str(tx['value']), tx['input'], tx['transaction_index'], network)
+        for tx in transactions
+    ]
+    sim_results = None
+    async with aiohttp.ClientSession() as session:
+        logging.info(f"Simulating bundle of {len(transactions)} transactions in block {transactions[0]['block_number']}")
+        try:
+            response = await tenderly_client.simulate_bundle(session, simulations, tenderly_account_slug, tenderly_project_slug, tenderly_access_key)
+            sim_results = response.get('simulation_results') if isinstance(response, dict) else None
+        except Exception as e:
+            logging.error(f"Bundle simulation failed for block {transactions[0]['block_number']}: {str(e)}")
+
+    if not isinstance(sim_results, list) or len(sim_results) != len(transactions):
+        logging.warning(f"Falling back to per-transaction simulation for block {transactions[0]['block_number']}")
+        sim_results = [None] * len(transactions)
+
+    results = await asyncio.gather(*[
+        process_simulation(sim_data, tx['hash'], network, tx['block_number']) if sim_data and 'transaction' in sim_data else simulate_row(tx, network)
+        for tx, sim_data in zip(transactions, sim_results)
+    ], return_exceptions=True)
+    # A failed transaction doesn't fail the rest of its block
+    for i, (tx, result) in enumerate(zip(transactions, results)):
+        if isinstance(result, Exception):
+            logging.error(f"Error simulating {tx['hash']}: {str(result)}")
+            results[i] = None
+    return results
+
+async def simulate_bounded(tx, network, semaphore):
+    async with semaphore:
+        try:
+            return await simulate_row(tx, network)
+        except Exception as e:
+            logging.error(f"Error simulating {tx['hash']}: {str(e)}")
+            return None
+
+async def simulate_bundle_bounded(transactions, network, semaphore):
+    async with semaphore:
+        try:
+            return await simulate_block_bundle(transactions, network)
+        except Exception as e:
+            logging.error(f"Error simulating block {transactions[0]['block_number']}: {str(e)}")
+            return [None] * len(transactions)
+
+def parse_shard(shard):
+    shard_index, shard_count = (int(part) for part in shard.split('/'))
+    if shard_count < 1 or not 0 <= shard_index < shard_count:
+        raise ValueError(f'Invalid shard {shard}, expected i/N with 0 <= i < N')
+    return shard_index, shard_count
+
+# Split [start, end] into shard_count contiguous, non-overlapping slices and return the one owned by shard_index
+def shard_block_range(start, end, shard_index, shard_count):
+    total = end - start + 1
+    shard_start = start + total * shard_index // shard_count
+    shard_end = start + total * (shard_index + 1) // shard_count - 1
+    return shard_start, shard_end
+
+def progress_blob_name(network, start_day, end_day, shard_index, shard_count):
+    return f'{network}/backfill/{start_day}_{end_day}/shard_{shard_index}_of_{shard_count}.json'
+
+async def main(start_day, end_day, network, max_pending=64, shard=(0, 1), start_block=None, end_block=None, bundle=False, block_receipts=False, chunk_size=1000):
+    global BLOCK_RECEIPTS, tenderly_client, w3
+    # The Tenderly and web3 clients are bound to the event loop they are first used in, and a
+    # pool worker can run several shards, each in its own asyncio.run, so every run gets new ones
+    tenderly_client = TenderlyClient()
+    w3 = new_web3()
+    if block_receipts:
+        if not NETWORK_CONFIGS[network]['rpc_endpoint']:
+            raise ValueError(f'Block receipts need an RPC endpoint for {network}')
+        BLOCK_RECEIPTS = BlockReceiptStage(NETWORK_CONFIGS[network]['rpc_endpoint'])
+    shard_index, shard_count = shard
+    semaphore = asyncio.Semaphore(max_pending)
     block_ranges = await get_block_ranges_for_date_range(start_day, end_day, network)
+    progress = {'shard': f'{shard_index}/{shard_count}', 'blocks': 0, 'transactions': 0, 'simulated': 0, 'failed': 0}
 
     current_day = datetime.strptime(start_day, '%Y-%m-%d')
     end_date = datetime.strptime(end_day, '%Y-%m-%d')
@@ -402,29 +473,81 @@ async def main(start_day, end_day, network):
     while current_day <= end_date:
         day = current_day.strftime('%Y-%m-%d')
         next_day = (current_day + timedelta(days=1)).strftime('%Y-%m-%d')
-
-        day_block_range = block_ranges[day]
-        block_number = day_block_range['start']
-        while block_number <= day_block_range['end']:
-            logging.info(f"{day}: Querying transactions for block range {block_number} - {block_number + 1000}")
-            transactions = await query_transactions(day, next_day, block_number, block_number + 1000, network)
-            for tx in transactions:
-                await simulate_transaction(
-                    tx['hash'],
-                    tx['block_number'],
-                    tx['from_address'],
-                    tx['to_address'],
-                    tx['gas'],
-                    str(tx['value']),
-                    tx['input'],
-                    tx['transaction_index'],
-                    network
-                )
-                await sleep(0.2)
-            await sleep(1)
-            block_number += 1000
-
         current_day += timedelta(days=1)
+        if day not in block_ranges:
+            continue
+
+        day_start = max(block_ranges[day]['start'], start_block) if start_block is not None else block_ranges[day]['start']
+        day_end = min(block_ranges[day]['end'], end_block) if end_block is not None else block_ranges[day]['end']
+        if day_start > day_end:
+            continue
+        block_number, shard_end = shard_block_range(day_start, day_end, shard_index, shard_count)
+        while block_number <= shard_end:
+            chunk_end = min(block_number + chunk_size - 1, shard_end)
+            logging.info(f"{day} [shard {shard_index}/{shard_count}]: Querying transactions for block range {block_number} - {chunk_end}")
+            transactions = await query_transactions(day, next_day, block_number, chunk_end, network)
+            # Tenderly concurrency is governed by the shared client, this only bounds the work held in memory
+            if bundle:
+                blocks = {}
+                for tx in transactions:
+                    blocks.setdefault(tx['block_number'], []).append(tx)
+                block_results = await asyncio.gather(*[simulate_bundle_bounded(block_txs, network, semaphore) for block_txs in blocks.values()])
+                results = [result for block_result in block_results for result in block_result]
+            else:
+                results = await asyncio.gather(*[simulate_bounded(tx, network, semaphore) for tx in transactions])
+            progress['blocks'] += chunk_end - block_number + 1
+            progress['transactions'] += len(results)
+            progress['simulated'] += sum(1 for result in results if result)
+            progress['failed'] += sum(1 for result in results if not result)
+            logging.info(f"{day} [shard {shard_index}/{shard_count}]: Tenderly stats {json.dumps(tenderly_client.stats())}")
+            block_number = chunk_end + 1
+
+    progress['tenderly'] = tenderly_client.stats()
+    await asyncio.to_thread(flush_manifests)
+    try:
+        blob = bucket.blob(progress_blob_name(network, start_day, end_day, shard_index, shard_count))
+        blob.upload_from_string(json.dumps(progress))
+    except Exception as e:
+        logging.error(f'Error uploading progress for shard {shard_index}/{shard_count}: {str(e)}')
+    return progress
+
+# Entry point for pool workers, each worker runs its shard in a fresh event loop
+def run_shard(start_day, end_day, network, max_pending, shard, start_block, end_block, bundle, block_receipts):
+    return asyncio.run(main(start_day, end_day, network, max_pending, shard, start_block, end_block, bundle, block_receipts))
+
+def aggregate_progress(progress_list):
+    totals = {'shards': len(progress_list), 'blocks': 0, 'transactions': 0, 'simulated': 0, 'failed': 0}
+    for progress in progress_list:
+        for key in ('blocks', 'transactions', 'simulated', 'failed'):
+            totals[key] += progress.get(key, 0)
+    return totals
+
+# Collect progress written by shards that ran as separate invocations, possibly on other machines
+def collect_progress(network, start_day, end_day, shard_count):
+    progress_list = []
+    for shard_index in range(shard_count):
+        blob = bucket.blob(progress_blob_name(network, start_day, end_day, shard_index, shard_count))
+        if blob.exists():
+            progress_list.append(json.loads(blob.download_as_string()))
+        else:
+            logging.warning(f'No progress found for shard {shard_index}/{shard_count}')
+    return progress_list
+
+def run_sharded(start_day, end_day, network, max_pending, processes, start_block=None, end_block=None, bundle=False, block_receipts=False):
+    # Spawn rather than fork so each worker creates its own GCP and HTTP clients
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context) as executor:
+        futures = [
+            executor.submit(run_shard, start_day, end_day, network, max_pending, (shard_index, processes), start_block, end_block, bundle, block_receipts)
+            for shard_index in range(processes)
+        ]
+        progress_list = []
+        for future in futures:
+            try:
+                progress_list.append(future.result())
+            except Exception as e:
+                logging.error(f'Shard failed: {str(e)}')
+    return progress_list
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Blockchain Transaction Simulator')
@@ -434,10 +557,35 @@ if __name__ == '__main__':
                         help='End day for transaction simulation (default: today)')
     parser.add_argument('-n', '--network', type=str, default='ethereum', choices=['ethereum', 'arbitrum', 'avalanche', 'optimism'],
                         help='Blockchain network to simulate transactions for (default: ethereum)')
+    parser.add_argument('-c', '--max-pending', type=int, default=64,
+                        help='Maximum number of transactions in progress at once (default: 64)')
+    parser.add_argument('--start-block', type=int, default=None,
+                        help='Only simulate blocks at or above this number (default: None)')
+    parser.add_argument('--end-block', type=int, default=None,
+                        help='Only simulate blocks at or below this number (default: None)')
+    parser.add_argument('--shard', type=str, default='0/1',
+                        help='Run only shard i of N, e.g. 2/8, for backfills split across machines (default: 0/1)')
+    parser.add_argument('-P', '--processes', type=int, default=1,
+                        help='Split the backfill into this many shards and run each in a local process (default: 1)')
+    parser.add_argument('-b', '--bundle', action='store_true',
+                        help='Simulate the selected transactions of each block as one Tenderly bundle')
+    parser.add_argument('-r', '--block-receipts', action='store_true',
+                        help='Fetch receipts once per block to fill in missing asset change amounts (requires the network RPC endpoint)')
+    parser.add_argument('--aggregate', type=int, default=None, metavar='N',
+                        help='Only print the combined progress of N shards that already ran for this date range')
     args = parser.parse_args()
 
     start_day = args.start
     end_day = args.end
     network = args.network
 
-    asyncio.run(main(start_day, end_day, network))
\ No newline at end of file
+    if args.block_receipts and not NETWORK_CONFIGS[network]['rpc_endpoint']:
+        parser.error(f'--block-receipts needs an RPC endpoint for {network}')
+
+    if args.aggregate:
+        progress_list = collect_progress(network, start_day, end_day, args.aggregate)
+    elif args.processes > 1:
+        progress_list = run_sharded(start_day, end_day, network, args.max_pending, args.processes, args.start_block, args.end_block, args.bundle, args.block_receipts)
+    else:
+        progress_list = [asyncio.run(main(start_day, end_day, network, args.max_pending, parse_shard(args.shard), args.start_block, args.end_block, args.bundle, args.block_receipts))]
+    logging.info(f'Backfill progress: {json.dumps(aggregate_progress(progress_list))}')
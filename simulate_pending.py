@@ -11,6 +11,8 @@ from web3 import AsyncWeb3
 import decimal
 from flipside import Flipside
 from label import add_labels
+from tenderly import tenderly_client
+from manifest import upload_trimmed
 
 w3 = AsyncWeb3(AsyncWeb3.AsyncHTTPProvider('https://cloudflare-eth.com'))
 load_dotenv()
@@ -231,12 +233,7 @@ async def extract_useful_fields(sim_data):
 
 
 async def fetch_tenderly_simulation(tx_details, tenderly_account_slug, tenderly_project_slug, tenderly_access_key, session):
-    async with session.post(
-        f'https://api.tenderly.co/api/v1/account/{tenderly_account_slug}/project/{tenderly_project_slug}/simulate',
-        json=tx_details,
-        headers={'X-Access-Key': tenderly_access_key}
-    ) as response:
-        return await response.json()
+    return await tenderly_client.simulate(session, tx_details, tenderly_account_slug, tenderly_project_slug, tenderly_access_key)
 
 async def simulate_pending_transaction_tenderly(tx_hash, block_number, from_address, to_address, gas, value, input_data, tx_index, network, store_result=True):
     tenderly_account_slug = os.getenv('TENDERLY_ACCOUNT_SLUG')
@@ -286,8 +283,7 @@ async def simulate_pending_transaction_tenderly(tx_hash, block_number, from_addr
             if store_result:
                 print("Storing the trimmed simulation to bucket...")
                 try:
-                    blob = bucket.blob(f'{network}/transactions/simulations/trimmed/{tx_hash}.json')
-                    blob.upload_from_string(json.dumps(trimmed))
+                    upload_trimmed(bucket, network, tx_hash, trimmed)
                     logging.info(f'{tx_hash} trimmed simulation written successfully to bucket')
                 except Exception as e:
                     logging.error(f'Error uploading trimmed simulation for {tx_hash}: {str(e)}')
@@ -0,0 +1,201 @@
+import os
+import json
+
+# Version 2 of the trimmed simulation format: the key letters of condense_calls and
+# condense_asset_changes, plus a string table so repeated addresses, contract names,
+# function names and type strings are stored once and referenced by index.
+FORMAT_VERSION = 2
+TRIMMED_FORMAT = os.getenv('TRIMMED_FORMAT', 'v2')
+
+TOP_LEVEL_KEYS = {
+    'hash': 'h',
+    'status': 'k',
+    'error': 'w',
+    'call_trace': 'm',
+    'asset_changes': 'n',
+    'address_labels': 'l',
+}
+CALL_KEYS = {
+    'contract_name': 'c',
+    'function': 'f',
+    'from': 'a',
+    'from_balance': 'b',
+    'to': 'z',
+    'input': 'x',
+    'output': 'y',
+    'value': 'e',
+    'decimals': 'k',
+    'error': 'w',
+    'caller': 'u',
+    'caller_balance': 'v',
+    'decoded_input': 'r',
+    'decoded_output': 'o',
+    'calls': 's',
+}
+PARAM_KEYS = {
+    'name': 'n',
+    'type': 't',
+    'value': 'v',
+}
+ASSET_CHANGE_KEYS = {
+    'type': 'p',
+    'from': 'a',
+    'to': 'z',
+    'amount': 'q',
+    'dollar_value': 'd',
+}
+# token_info is flattened into the asset change, as in condense_asset_changes
+TOKEN_INFO_KEYS = {
+    'standard': 'g',
+    'type': 'h',
+    'symbol': 'i',
+    'name': 'j',
+    'decimals': 'k',
+    'contract_address': 'l',
+}
+
+# Fields whose strings go through the string table
+INTERNED_CALL_KEYS = {'c', 'f', 'a', 'z', 'u'}
+INTERNED_PARAM_KEYS = {'n', 't', 'v'}
+INTERNED_ASSET_CHANGE_KEYS = {'p', 'a', 'z', 'g', 'h', 'i', 'j', 'l'}
+
+
+class StringTable:
+    def __init__(self, strings=None):
+        self.strings = strings if strings is not None else []
+        self.index = {string: i for i, string in enumerate(self.strings)}
+
+    # Strings become table indexes, lists are packed element-wise and anything else is wrapped
+    def pack(self, value):
+        if isinstance(value, str):
+            if value not in self.index:
+                self.index[value] = len(self.strings)
+                self.strings.append(value)
+            return self.index[value]
+        if isinstance(value, list):
+            return [self.pack(item) for item in value]
+        return {'v': value}
+
+    def unpack(self, value):
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, int):
+            return self.strings[value]
+        if isinstance(value, list):
+            return [self.unpack(item) for item in value]
+        return value['v']
+
+
+def _encode_object(obj, keys, interned, table, nested=None):
+    packed = {}
+    extra = {}
+    for key, value in obj.items():
+        short_key = keys.get(key)
+        if short_key is None:
+            extra[key] = value
+        elif nested and short_key in nested:
+            packed[short_key] = nested[short_key](value, table)
+        elif short_key in interned:
+            packed[short_key] = table.pack(value)
+        else:
+            packed[short_key] = value
+    if extra:
+        packed['_'] = extra
+    return packed
+
+def _decode_object(packed, keys, interned, table, nested=None):
+    long_keys = {short_key: key for key, short_key in keys.items()}
+    obj = {}
+    for short_key, value in packed.items():
+        if short_key == '_':
+            obj.update(value)
+        elif nested and short_key in nested:
+            obj[long_keys[short_key]] = nested[short_key](value, table)
+        elif short_key in interned:
+            obj[long_keys[short_key]] = table.unpack(value)
+        else:
+            obj[long_keys[short_key]] = value
+    return obj
+
+def _encode_params(params, table):
+    return [_encode_object(param, PARAM_KEYS, INTERNED_PARAM_KEYS, table) for param in params]
+
+def _decode_params(params, table):
+    return [_decode_object(param, PARAM_KEYS, INTERNED_PARAM_KEYS, table) for param in params]
+
+def _encode_calls(calls, table):
+    return [_encode_object(call, CALL_KEYS, INTERNED_CALL_KEYS, table, CALL_ENCODERS) for call in calls]
+
+def _decode_calls(calls, table):
+    return [_decode_object(call, CALL_KEYS, INTERNED_CALL_KEYS, table, CALL_DECODERS) for call in calls]
+
+CALL_ENCODERS = {'r': _encode_params, 'o': _encode_params, 's': _encode_calls}
+CALL_DECODERS = {'r': _decode_params, 'o': _decode_params, 's': _decode_calls}
+
+def _encode_asset_changes(asset_changes, table):
+    encoded = []
+    for asset_change in asset_changes:
+        asset_change = dict(asset_change)
+        token_info = asset_change.pop('token_info', None)
+        packed = _encode_object(asset_change, ASSET_CHANGE_KEYS, INTERNED_ASSET_CHANGE_KEYS, table)
+        if isinstance(token_info, dict) and all(key in TOKEN_INFO_KEYS for key in token_info) and token_info:
+            packed.update(_encode_object(token_info, TOKEN_INFO_KEYS, INTERNED_ASSET_CHANGE_KEYS, table))
+        elif token_info is not None:
+            packed['t'] = token_info
+        encoded.append(packed)
+    return encoded
+
+def _decode_asset_changes(asset_changes, table):
+    token_keys = set(TOKEN_INFO_KEYS.values())
+    decoded = []
+    for packed in asset_changes:
+        token_info = {key: value for key, value in packed.items() if key in token_keys}
+        asset_change = _decode_object({key: value for key, value in packed.items() if key not in token_keys and key != 't'},
+                                      ASSET_CHANGE_KEYS, INTERNED_ASSET_CHANGE_KEYS, table)
+        if token_info:
+            asset_change['token_info'] = _decode_object(token_info, TOKEN_INFO_KEYS, INTERNED_ASSET_CHANGE_KEYS, table)
+        elif 't' in packed:
+            asset_change['token_info'] = packed['t']
+        decoded.append(asset_change)
+    return decoded
+
+# Label rows are stored column-wise when they share the same columns
+def _encode_labels(rows, table):
+    columns = list(rows[0].keys()) if rows else []
+    if not rows or any(list(row.keys()) != columns for row in rows):
+        return {'_': rows}
+    return {'c': columns, 'r': [[table.pack(value) for value in row.values()] for row in rows]}
+
+def _decode_labels(packed, table):
+    if '_' in packed:
+        return packed['_']
+    return [dict(zip(packed['c'], (table.unpack(value) for value in row))) for row in packed['r']]
+
+TOP_LEVEL_ENCODERS = {'m': _encode_calls, 'n': _encode_asset_changes, 'l': _encode_labels}
+TOP_LEVEL_DECODERS = {'m': _decode_calls, 'n': _decode_asset_changes, 'l': _decode_labels}
+
+
+def is_compact(data):
+    return isinstance(data, dict) and data.get('v') == FORMAT_VERSION and 'T' in data
+
+def encode_simulation(trimmed):
+    table = StringTable()
+    body = _encode_object(trimmed, TOP_LEVEL_KEYS, set(), table, TOP_LEVEL_ENCODERS)
+    return {'v': FORMAT_VERSION, 'T': table.strings, **body}
+
+def decode_simulation(data):
+    if not is_compact(data):
+        return data
+    table = StringTable(data['T'])
+    body = {key: value for key, value in data.items() if key not in ('v', 'T')}
+    return _decode_object(body, TOP_LEVEL_KEYS, set(), table, TOP_LEVEL_DECODERS)
+
+# Serialize a trimmed simulation for storage in the configured format
+def dump_simulation(trimmed):
+    if TRIMMED_FORMAT == 'v2':
+        return json.dumps(encode_simulation(trimmed), separators=(',', ':'))
+    return json.dumps(trimmed)
+
+# Parse a stored trimmed simulation of either version into the expanded shape
+def load_simulation(raw):
+    return decode_simulation(json.loads(raw))
@@ -0,0 +1,178 @@
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+import aiohttp
+
+TENDERLY_API_URL = 'https://api.tenderly.co/api/v1/account/{account}/project/{project}'
+
+# Status codes that signal Tenderly is overloaded and we should back off
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+# Shared Tenderly client with AIMD concurrency control.
+# The concurrency limit grows by roughly one slot per window of successful
+# requests and is halved on 429/5xx responses. Rate limit headers pause all
+# requests until the quota resets, and retries draw from a budget that is
+# refilled by successful requests so a degraded API can't be flooded with retries.
+class TenderlyClient:
+    def __init__(self, initial_concurrency=4, min_concurrency=1, max_concurrency=32,
+                 max_retries=4, base_backoff=0.5, max_backoff=30.0,
+                 retry_budget_ratio=0.2, min_retry_budget=10, rate_window=60.0):
+        self.limit = float(initial_concurrency)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.retry_budget_ratio = retry_budget_ratio
+        self.min_retry_budget = min_retry_budget
+        self.retry_budget = float(min_retry_budget)
+        self.rate_window = rate_window
+
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.completed = deque()
+        self.counts = {
+            'requests': 0,
+            'successes': 0,
+            'retries': 0,
+            'throttled': 0,
+            'server_errors': 0,
+            'network_errors': 0,
+            'failures': 0,
+        }
+        self._condition = None
+
+    def _get_condition(self):
+        # Created lazily so the client can be instantiated outside of a running loop
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def _acquire(self):
+        condition = self._get_condition()
+        async with condition:
+            while self.in_flight >= max(self.min_concurrency, int(self.limit)):
+                await condition.wait()
+            self.in_flight += 1
+        pause = self.paused_until - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+
+    async def _release(self):
+        condition = self._get_condition()
+        async with condition:
+            self.in_flight -= 1
+            condition.notify_all()
+
+    def _on_success(self):
+        self.counts['successes'] += 1
+        self.limit = min(self.max_concurrency, self.limit + 1 / max(self.limit, 1))
+        self.retry_budget = min(self.retry_budget + self.retry_budget_ratio, self.min_retry_budget * 10)
+        now = time.monotonic()
+        self.completed.append(now)
+        while self.completed and now - self.completed[0] > self.rate_window:
+            self.completed.popleft()
+
+    def _on_overload(self):
+        # Only decrease once per round trip so a burst of concurrent 429s doesn't collapse the limit
+        now = time.monotonic()
+        if now - self.last_decrease < 1.0:
+            return
+        self.last_decrease = now
+        self.limit = max(self.min_concurrency, self.limit / 2)
+        logging.warning(f'Tenderly overloaded, reducing concurrency to {int(self.limit)}')
+
+    def _read_rate_limit_headers(self, headers):
+        retry_after = headers.get('Retry-After')
+        remaining = headers.get('X-RateLimit-Remaining')
+        reset = headers.get('X-RateLimit-Reset')
+        pause = 0.0
+        try:
+            if retry_after is not None:
+                pause = float(retry_after)
+            elif remaining is not None and int(remaining) <= 0 and reset is not None:
+                reset = float(reset)
+                # Reset may be sent either as seconds until reset or as a unix timestamp
+                pause = reset - time.time() if reset > 1e9 else reset
+        except ValueError:
+            return
+        if pause > 0:
+            self.paused_until = max(self.paused_until, time.monotonic() + min(pause, self.max_backoff))
+
+    def _backoff(self, attempt):
+        delay = min(self.max_backoff, self.base_backoff * 2 ** attempt)
+        return random.uniform(0, delay)
+
+    def _can_retry(self, attempt):
+        if attempt >= self.max_retries or self.retry_budget < 1:
+            return False
+        self.retry_budget -= 1
+        self.counts['retries'] += 1
+        return True
+
+    async def post(self, session, url, payload, access_key):
+        attempt = 0
+        while True:
+            self.counts['requests'] += 1
+            await self._acquire()
+            try:
+                async with session.post(url, json=payload, headers={'X-Access-Key': access_key}) as response:
+                    self._read_rate_limit_headers(response.headers)
+                    if response.status not in RETRYABLE_STATUSES:
+                        body = await response.json(content_type=None)
+                        if response.status < 400:
+                            self._on_success()
+                        return body
+                    if response.status == 429:
+                        self.counts['throttled'] += 1
+                    else:
+                        self.counts['server_errors'] += 1
+                    self._on_overload()
+                    error = f'HTTP {response.status}'
+                    body = await response.json(content_type=None) if response.content_type == 'application/json' else None
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.counts['network_errors'] += 1
+                error = str(e) or type(e).__name__
+                body = None
+            finally:
+                await self._release()
+
+            if not self._can_retry(attempt):
+                self.counts['failures'] += 1
+                logging.error(f'Tenderly request failed after {attempt + 1} attempts: {error}')
+                if body is not None:
+                    return body
+                raise RuntimeError(f'Tenderly request failed: {error}')
+            await asyncio.sleep(self._backoff(attempt))
+            attempt += 1
+
+    async def simulate(self, session, tx_details, account_slug, project_slug, access_key):
+        url = TENDERLY_API_URL.format(account=account_slug, project=project_slug) + '/simulate'
+        return await self.post(session, url, tx_details, access_key)
+
+    async def simulate_bundle(self, session, simulations, account_slug, project_slug, access_key):
+        url = TENDERLY_API_URL.format(account=account_slug, project=project_slug) + '/simulate-bundle'
+        return await self.post(session, url, {'simulations': simulations}, access_key)
+
+    def rate(self):
+        now = time.monotonic()
+        while self.completed and now - self.completed[0] > self.rate_window:
+            self.completed.popleft()
+        return len(self.completed) / self.rate_window
+
+    def stats(self):
+        return {
+            'concurrency_limit': int(self.limit),
+            'in_flight': self.in_flight,
+            'rate_per_second': round(self.rate(), 3),
+            'retry_budget': round(self.retry_budget, 2),
+            **self.counts,
+        }
+
+
+# Process-wide client shared by simulate.py, simulate_pending.py and the webserver
+tenderly_client = TenderlyClient()
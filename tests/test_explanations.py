@@ -0,0 +1,64 @@
+import json
+import itertools
+
+import explanations
+
+clock = itertools.count()
+
+
+class FakeBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.metadata = None
+        self.updated = None
+
+    def exists(self):
+        return self.name in self.bucket.store
+
+    def download_as_string(self):
+        return self.bucket.store[self.name][0]
+
+    def upload_from_string(self, data, content_type=None):
+        self.bucket.store[self.name] = (data, self.metadata, next(clock))
+
+
+class FakeBucket:
+    def __init__(self):
+        self.store = {}
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+    def list_blobs(self, prefix):
+        blobs = []
+        for name, (_, metadata, updated) in self.store.items():
+            if name.startswith(prefix):
+                blob = FakeBlob(self, name)
+                blob.metadata = metadata
+                blob.updated = updated
+                blobs.append(blob)
+        return blobs
+
+
+def bucket_with_legacy():
+    bucket = FakeBucket()
+    bucket.blob(explanations.explanation_blob_name('ethereum', '0xa')).upload_from_string(json.dumps({'result': 'legacy'}))
+    return bucket
+
+
+def test_legacy_served_while_no_version_exists():
+    bucket = bucket_with_legacy()
+    assert explanations.get_explanation(bucket, 'ethereum', '0xa', 'prompt', 'model', fallback='prompt')['result'] == 'legacy'
+
+
+def test_legacy_not_served_once_a_newer_prompt_version_exists():
+    bucket = bucket_with_legacy()
+    explanations.write_explanation(bucket, 'ethereum', '0xa', 'newer', 'model', 'newer prompt')
+    assert explanations.get_explanation(bucket, 'ethereum', '0xa', 'older prompt', 'model', fallback='prompt') is None
+
+
+def test_any_serves_newest_version():
+    bucket = bucket_with_legacy()
+    explanations.write_explanation(bucket, 'ethereum', '0xa', 'newer', 'model', 'newer prompt')
+    assert explanations.get_explanation(bucket, 'ethereum', '0xa', 'older prompt', 'model', fallback='any')['result'] == 'newer'
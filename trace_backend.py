@@ -0,0 +1,277 @@
+import os
+import json
+import asyncio
+import logging
+import argparse
+import decimal
+import aiohttp
+from eth_abi import decode
+from eth_utils import keccak
+from eth_utils.abi import collapse_if_tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+ABI_DIR = os.getenv('ABI_DIR', 'abis')
+
+TRANSFER_TOPIC = '0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef'
+
+NATIVE_TOKENS = {
+    'ethereum': ('ETH', 'Ether'),
+    'arbitrum': ('ETH', 'Ether'),
+    'optimism': ('ETH', 'Ether'),
+    'base': ('ETH', 'Ether'),
+    'blast': ('ETH', 'Ether'),
+    'avalanche': ('AVAX', 'Avalanche'),
+    'mantle': ('MNT', 'Mantle'),
+}
+
+# Fallback ABI used to decode calls to contracts without a local ABI file
+COMMON_ABI = [
+    {'type': 'function', 'name': 'transfer', 'inputs': [{'name': '_to', 'type': 'address'}, {'name': '_value', 'type': 'uint256'}], 'outputs': [{'name': '', 'type': 'bool'}]},
+    {'type': 'function', 'name': 'transferFrom', 'inputs': [{'name': '_from', 'type': 'address'}, {'name': '_to', 'type': 'address'}, {'name': '_value', 'type': 'uint256'}], 'outputs': [{'name': '', 'type': 'bool'}]},
+    {'type': 'function', 'name': 'approve', 'inputs': [{'name': '_spender', 'type': 'address'}, {'name': '_value', 'type': 'uint256'}], 'outputs': [{'name': '', 'type': 'bool'}]},
+    {'type': 'function', 'name': 'balanceOf', 'inputs': [{'name': '_owner', 'type': 'address'}], 'outputs': [{'name': 'balance', 'type': 'uint256'}]},
+    {'type': 'function', 'name': 'allowance', 'inputs': [{'name': '_owner', 'type': 'address'}, {'name': '_spender', 'type': 'address'}], 'outputs': [{'name': '', 'type': 'uint256'}]},
+    {'type': 'function', 'name': 'decimals', 'inputs': [], 'outputs': [{'name': '', 'type': 'uint8'}]},
+    {'type': 'function', 'name': 'symbol', 'inputs': [], 'outputs': [{'name': '', 'type': 'string'}]},
+    {'type': 'function', 'name': 'name', 'inputs': [], 'outputs': [{'name': '', 'type': 'string'}]},
+    {'type': 'function', 'name': 'totalSupply', 'inputs': [], 'outputs': [{'name': '', 'type': 'uint256'}]},
+    {'type': 'function', 'name': 'deposit', 'inputs': [], 'outputs': []},
+    {'type': 'function', 'name': 'withdraw', 'inputs': [{'name': 'wad', 'type': 'uint256'}], 'outputs': []},
+    {'type': 'function', 'name': 'safeTransferFrom', 'inputs': [{'name': 'from', 'type': 'address'}, {'name': 'to', 'type': 'address'}, {'name': 'tokenId', 'type': 'uint256'}], 'outputs': []},
+    {'type': 'function', 'name': 'setApprovalForAll', 'inputs': [{'name': 'operator', 'type': 'address'}, {'name': 'approved', 'type': 'bool'}], 'outputs': []},
+]
+
+
+def build_selector_map(abi):
+    selectors = {}
+    for item in abi:
+        if item.get('type', 'function') != 'function' or 'name' not in item:
+            continue
+        input_types = [collapse_if_tuple(param) for param in item.get('inputs', [])]
+        signature = f"{item['name']}({','.join(input_types)})"
+        selectors['0x' + keccak(text=signature)[:4].hex()] = item
+    return selectors
+
+
+# Local ABI registry. Files in ABI_DIR are named by contract address and hold either
+# a plain ABI list or an object with "contractName" and "abi" keys.
+class AbiRegistry:
+    def __init__(self, abi_dir=ABI_DIR):
+        self.abi_dir = abi_dir
+        self.contracts = {}
+        self.common = build_selector_map(COMMON_ABI)
+
+    def get_contract(self, address):
+        address = (address or '').lower()
+        if address not in self.contracts:
+            self.contracts[address] = self._load(address)
+        return self.contracts[address]
+
+    def _load(self, address):
+        path = os.path.join(self.abi_dir, f'{address}.json')
+        if not address or not os.path.exists(path):
+            return ('', {})
+        try:
+            with open(path, 'r') as file:
+                data = json.load(file)
+            if isinstance(data, dict):
+                return (data.get('contractName', ''), build_selector_map(data.get('abi', [])))
+            return ('', build_selector_map(data))
+        except Exception as e:
+            logging.error(f'Error loading ABI for {address}: {str(e)}')
+            return ('', {})
+
+    def lookup(self, address, input_data):
+        contract_name, selectors = self.get_contract(address)
+        selector = (input_data or '')[:10].lower()
+        return contract_name, selectors.get(selector) or self.common.get(selector)
+
+
+def to_json_value(value):
+    if isinstance(value, bytes):
+        return '0x' + value.hex()
+    if isinstance(value, (list, tuple)):
+        return [to_json_value(item) for item in value]
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int):
+        return str(value)
+    return value
+
+def decode_params(params, data):
+    types = [collapse_if_tuple(param) for param in params]
+    values = decode(types, bytes.fromhex(data[2:] if data.startswith('0x') else data))
+    return [
+        {'soltype': {'name': param.get('name', ''), 'type': param_type}, 'value': to_json_value(value)}
+        for param, param_type, value in zip(params, types, values)
+    ]
+
+
+# Minimal JSON-RPC client with cached ERC-20 metadata lookups
+class NodeRpc:
+    def __init__(self, rpc_endpoint):
+        self.rpc_endpoint = rpc_endpoint
+        self.tokens = {}
+        self.request_id = 0
+
+    async def rpc(self, session, method, params):
+        self.request_id += 1
+        body = {'jsonrpc': '2.0', 'id': self.request_id, 'method': method, 'params': params}
+        async with session.post(self.rpc_endpoint, json=body) as response:
+            data = await response.json(content_type=None)
+        if 'error' in data:
+            raise RuntimeError(f"{method} failed: {data['error']}")
+        return data.get('result')
+
+    async def eth_call(self, session, to, data):
+        return await self.rpc(session, 'eth_call', [{'to': to, 'data': data}, 'latest'])
+
+    async def get_token_info(self, session, address):
+        address = address.lower()
+        if address in self.tokens:
+            return self.tokens[address]
+        token_info = {'standard': 'ERC20', 'type': 'Fungible', 'symbol': '', 'name': '', 'decimals': None, 'contract_address': address}
+        for field, selector, output_type in (('decimals', '0x313ce567', 'uint8'), ('symbol', '0x95d89b41', 'string'), ('name', '0x06fdde03', 'string')):
+            try:
+                result = await self.eth_call(session, address, selector)
+                token_info[field] = decode([output_type], bytes.fromhex(result[2:]))[0]
+            except Exception:
+                logging.info(f'Token {field} call failed: {address}')
+        self.tokens[address] = token_info
+        return token_info
+
+
+# Builds Tenderly-shaped simulation data from debug_traceTransaction with the callTracer,
+# so the result can go through the same trimming as a Tenderly simulation
+class NodeTraceBackend(NodeRpc):
+    def __init__(self, rpc_endpoint, abi_registry=None):
+        super().__init__(rpc_endpoint)
+        self.abi_registry = abi_registry or AbiRegistry()
+
+    def convert_frame(self, frame):
+        to_address = frame.get('to', '')
+        input_data = frame.get('input', '0x')
+        output_data = frame.get('output', '0x')
+        contract_name, function = self.abi_registry.lookup(to_address, input_data)
+        call = {
+            'contract_name': contract_name,
+            'function_name': function['name'] if function else '',
+            'from': frame.get('from', ''),
+            'to': to_address,
+            'input': input_data,
+            'output': output_data,
+            'value': str(int(frame.get('value') or '0x0', 16)),
+            'call_type': frame.get('type', ''),
+        }
+        if 'error' in frame:
+            call['error'] = frame.get('revertReason') or frame['error']
+        if function:
+            try:
+                call['decoded_input'] = decode_params(function.get('inputs', []), '0x' + input_data[10:])
+                if output_data and output_data != '0x' and 'error' not in frame:
+                    call['decoded_output'] = decode_params(function.get('outputs', []), output_data)
+            except Exception:
+                logging.info(f"Could not decode call to {to_address} with selector {input_data[:10]}")
+        subcalls = frame.get('calls', [])
+        if subcalls:
+            call['calls'] = [self.convert_frame(subcall) for subcall in subcalls]
+        return call
+
+    async def collect_asset_changes(self, session, frame, network, asset_changes):
+        if 'error' in frame:
+            return asset_changes
+        value = int(frame.get('value') or '0x0', 16)
+        if value > 0 and frame.get('type') in ('CALL', 'CREATE', 'CREATE2'):
+            symbol, name = NATIVE_TOKENS.get(network, ('ETH', 'Ether'))
+            asset_changes.append({
+                'type': 'Transfer',
+                'from': frame.get('from', ''),
+                'to': frame.get('to', ''),
+                'amount': str(decimal.Decimal(value) / decimal.Decimal(10**18)),
+                'raw_amount': str(value),
+                'dollar_value': '',
+                'token_info': {'standard': 'NativeCurrency', 'type': 'Native', 'symbol': symbol, 'name': name, 'decimals': 18, 'contract_address': ''},
+            })
+        for log in frame.get('logs', []):
+            topics = log.get('topics', [])
+            if not topics or topics[0] != TRANSFER_TOPIC or len(topics) < 3:
+                continue
+            transfer = {
+                'type': 'Transfer',
+                'from': '0x' + topics[1][26:],
+                'to': '0x' + topics[2][26:],
+                'dollar_value': '',
+            }
+            if len(topics) == 4:
+                transfer['amount'] = '1'
+                transfer['token_id'] = str(int(topics[3], 16))
+                transfer['token_info'] = {'standard': 'ERC721', 'type': 'Non-Fungible', 'symbol': '', 'name': '', 'decimals': 0, 'contract_address': log['address'].lower()}
+            else:
+                raw_amount = int(log.get('data') or '0x0', 16)
+                token_info = dict(await self.get_token_info(session, log['address']))
+                decimals = token_info['decimals']
+                transfer['raw_amount'] = str(raw_amount)
+                transfer['amount'] = str(decimal.Decimal(raw_amount) / decimal.Decimal(10**int(decimals))) if decimals is not None else None
+                transfer['token_info'] = token_info
+            asset_changes.append(transfer)
+        for subcall in frame.get('calls', []):
+            await self.collect_asset_changes(session, subcall, network, asset_changes)
+        return asset_changes
+
+    async def simulate(self, session, tx_hash, network):
+        frame = await self.rpc(session, 'debug_traceTransaction', [tx_hash, {'tracer': 'callTracer', 'tracerConfig': {'withLog': True}}])
+        if not frame:
+            return None
+        status = 'error' not in frame
+        sim_data = {
+            'transaction': {
+                'hash': tx_hash,
+                'status': status,
+                'transaction_info': {
+                    'call_trace': self.convert_frame(frame),
+                    'asset_changes': await self.collect_asset_changes(session, frame, network, []),
+                },
+            },
+            'simulation': {'backend': 'node'},
+        }
+        if not status:
+            sim_data['simulation']['error_message'] = frame.get('revertReason') or frame.get('error', '')
+        return sim_data
+
+
+trace_backends = {}
+
+# Returns the configured node backend for network, or None when Tenderly should be used
+def get_trace_backend(network):
+    if os.getenv('TRACE_BACKEND', 'tenderly') != 'node':
+        return None
+    rpc_endpoint = os.getenv(f'TRACE_RPC_ENDPOINT_{network.upper()}') or os.getenv('TRACE_RPC_ENDPOINT')
+    if not rpc_endpoint:
+        return None
+    if (network, rpc_endpoint) not in trace_backends:
+        trace_backends[(network, rpc_endpoint)] = NodeTraceBackend(rpc_endpoint)
+    return trace_backends[(network, rpc_endpoint)]
+
+async def run(rpc_endpoint, tx_hash, network, trimmed):
+    backend = NodeTraceBackend(rpc_endpoint)
+    async with aiohttp.ClientSession() as session:
+        sim_data = await backend.simulate(session, tx_hash, network)
+    if trimmed:
+        from simulate import extract_useful_fields
+        sim_data = await extract_useful_fields(sim_data)
+    print(json.dumps(sim_data, indent=4))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Trace a transaction against a local or archive node')
+    parser.add_argument('tx_hash', type=str, help='Transaction hash to trace')
+    parser.add_argument('-r', '--rpc', type=str, default='http://127.0.0.1:8545',
+                        help='RPC endpoint with the debug namespace enabled, e.g. anvil (default: http://127.0.0.1:8545)')
+    parser.add_argument('-n', '--network', type=str, default='ethereum',
+                        help='Network the transaction belongs to (default: ethereum)')
+    parser.add_argument('-t', '--trimmed', action='store_true',
+                        help='Print the trimmed simulation instead of the Tenderly-shaped trace')
+    args = parser.parse_args()
+
+    asyncio.run(run(args.rpc, args.tx_hash, args.network, args.trimmed))
@@ -0,0 +1,190 @@
+import os
+import io
+import json
+import uuid
+import atexit
+import hashlib
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+import pandas as pd
+from dotenv import load_dotenv
+from google.cloud import storage
+
+load_dotenv()
+
+# Usage accounting for LLM calls. Every explanation, chat turn and categorization gets a
+# usage record (tokens, time to first token, throughput, total time, retries, cost) that is
+# stored with its result and buffered into JSONL files under usage/{date}/ for reporting.
+BUCKET_NAME = os.getenv('GCS_BUCKET_NAME')
+USAGE_PREFIX = 'usage/'
+# Explanation requests, served from the cache or not, for ranking transactions by popularity
+REQUESTS_PREFIX = 'requests/'
+USAGE_FLUSH_SIZE = int(os.getenv('USAGE_FLUSH_SIZE', '200'))
+USAGE_FLUSH_INTERVAL = float(os.getenv('USAGE_FLUSH_INTERVAL', '60'))
+
+# USD per million tokens: (input, output). Anthropic cache writes cost 1.25x and cache reads 0.1x input.
+MODEL_PRICES = {
+    'claude-3-haiku-20240307': (0.25, 1.25),
+    'claude-3-sonnet-20240229': (3.0, 15.0),
+    'claude-3-opus-20240229': (15.0, 75.0),
+    'llama3-70b-8192': (0.59, 0.79),
+    'llama3-8b-8192': (0.05, 0.08),
+    'mixtral-8x7b-32768': (0.24, 0.24),
+    'gemma-7b-it': (0.07, 0.07),
+    'mock': (0.0, 0.0),
+}
+
+storage_client = storage.Client()
+bucket = storage_client.bucket(BUCKET_NAME)
+
+
+def prompt_id(prompt_text):
+    if not prompt_text:
+        return None
+    return hashlib.sha256(prompt_text.encode()).hexdigest()[:12]
+
+# The contract a transaction was sent to, from a trimmed simulation or a chat context
+def contract_of(simulation):
+    if not isinstance(simulation, dict):
+        return None
+    calls = simulation.get('call_trace') or simulation.get('transaction_details', {}).get('call_trace') or []
+    if not calls or not isinstance(calls[0], dict):
+        return None
+    return calls[0].get('to')
+
+def cost_usd(model, input_tokens, output_tokens, cache_creation_tokens=0, cache_read_tokens=0):
+    input_price, output_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    return round((input_tokens * input_price + cache_creation_tokens * input_price * 1.25
+                  + cache_read_tokens * input_price * 0.1 + output_tokens * output_price) / 1e6, 8)
+
+def build_record(kind, stats, network=None, tx_hash=None, contract=None, prompt_text=None, **extra):
+    input_tokens = stats.get('input_tokens') or 0
+    output_tokens = stats.get('output_tokens') or 0
+    cache_creation_tokens = stats.get('cache_creation_input_tokens') or 0
+    cache_read_tokens = stats.get('cache_read_input_tokens') or 0
+    ttft_ms = stats.get('ttft_ms')
+    duration_ms = stats.get('duration_ms')
+    generation_seconds = ((duration_ms or 0) - (ttft_ms or 0)) / 1000
+    record = {
+        'kind': kind,
+        'network': network,
+        'tx_hash': tx_hash,
+        'contract': contract.lower() if isinstance(contract, str) else contract,
+        'prompt_id': prompt_id(prompt_text),
+        'provider': stats.get('provider'),
+        'model': stats.get('model'),
+        'input_tokens': input_tokens,
+        'output_tokens': output_tokens,
+        'cache_creation_input_tokens': cache_creation_tokens,
+        'cache_read_input_tokens': cache_read_tokens,
+        'ttft_ms': ttft_ms,
+        'duration_ms': duration_ms,
+        'tokens_per_second': round(output_tokens / generation_seconds, 2) if generation_seconds > 0 else None,
+        'retries': stats.get('retries', 0),
+        'failover_from': stats.get('failover_from'),
+        'hedged': stats.get('hedged', False),
+        # Message Batches are billed at half price
+        'cost_usd': cost_usd(stats.get('model'), input_tokens, output_tokens, cache_creation_tokens, cache_read_tokens) * (0.5 if stats.get('batch') else 1),
+        'created_at': datetime.now(timezone.utc).isoformat(),
+    }
+    record.update(extra)
+    return record
+
+
+# Buffers records and writes them as JSONL files under {prefix}{date}/, flushing in the background
+# once flush_size records are buffered or flush_interval seconds have passed
+class JsonlSink:
+    def __init__(self, bucket, prefix, flush_size=USAGE_FLUSH_SIZE, flush_interval=USAGE_FLUSH_INTERVAL):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.records = []
+        self.last_flush = datetime.now(timezone.utc)
+        self.lock = threading.Lock()
+
+    def add(self, record):
+        with self.lock:
+            self.records.append(record)
+            due = len(self.records) >= self.flush_size or \
+                (datetime.now(timezone.utc) - self.last_flush).total_seconds() >= self.flush_interval
+        if due:
+            threading.Thread(target=self.flush, daemon=True).start()
+
+    def flush(self):
+        with self.lock:
+            records, self.records = self.records, []
+            self.last_flush = datetime.now(timezone.utc)
+        if not records:
+            return
+        now = datetime.now(timezone.utc)
+        name = f'{self.prefix}{now:%Y-%m-%d}/{now:%H%M%S}-{uuid.uuid4().hex[:8]}.jsonl'
+        try:
+            self.bucket.blob(name).upload_from_string('\n'.join(json.dumps(record) for record in records) + '\n')
+        except Exception as e:
+            print(f'Error writing records to {self.prefix}: {str(e)}')
+            with self.lock:
+                self.records = records + self.records
+
+
+usage_sink = JsonlSink(bucket, USAGE_PREFIX)
+atexit.register(usage_sink.flush)
+request_sink = JsonlSink(bucket, REQUESTS_PREFIX)
+atexit.register(request_sink.flush)
+
+# Builds the usage record of one LLM call, logs it and queues it for the aggregate report
+def record_usage(kind, stats, **context):
+    record = build_record(kind, stats, **context)
+    print(json.dumps({'action': 'usage', **record}))
+    usage_sink.add(record)
+    return record
+
+def record_request(kind, network, tx_hash, cached):
+    request_sink.add({'kind': kind, 'network': network, 'tx_hash': tx_hash, 'cached': cached,
+                      'created_at': datetime.now(timezone.utc).isoformat()})
+
+
+def load_records(bucket, days, prefix=USAGE_PREFIX):
+    frames = []
+    today = datetime.now(timezone.utc).date()
+    for offset in range(days):
+        day = today - timedelta(days=offset)
+        for blob in bucket.list_blobs(prefix=f'{prefix}{day:%Y-%m-%d}/'):
+            frames.append(pd.read_json(io.StringIO(blob.download_as_text()), lines=True))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+def rank(records, column, top):
+    grouped = records.dropna(subset=[column]).groupby(column).agg(
+        requests=('kind', 'size'),
+        input_tokens=('input_tokens', 'sum'),
+        output_tokens=('output_tokens', 'sum'),
+        cost_usd=('cost_usd', 'sum'),
+        ttft_p50_ms=('ttft_ms', 'median'),
+        duration_p90_ms=('duration_ms', lambda values: values.quantile(0.9)),
+        retries=('retries', 'sum'),
+    )
+    return grouped.sort_values('cost_usd', ascending=False).head(top)
+
+def report(days=7, top=10):
+    records = load_records(bucket, days)
+    if records.empty:
+        print(f'No usage records in the last {days} days')
+        return
+    print(f'{len(records)} LLM calls in the last {days} days, total cost ${records["cost_usd"].sum():.2f}\n')
+    with pd.option_context('display.width', 200, 'display.max_columns', 20):
+        for column in ('network', 'kind', 'model', 'contract', 'prompt_id'):
+            print(f'Heaviest by {column}:')
+            print(rank(records, column, top))
+            print()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='LLM usage accounting')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    report_parser = subparsers.add_parser('report', help='Rank networks, contracts and prompts by LLM cost')
+    report_parser.add_argument('-d', '--days', type=int, default=7, help='Number of days to include (default: 7)')
+    report_parser.add_argument('-t', '--top', type=int, default=10, help='Rows per ranking (default: 10)')
+    args = parser.parse_args()
+
+    if args.command == 'report':
+        report(args.days, args.top)
@@ -11,16 +11,17 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, StreamingResponse
-from anthropic import AsyncAnthropic
 from google.cloud import storage
 from explain import explain_transaction, get_cached_explanation, chat
+from providers import llm_router
+from usage import record_request
 from simulate import simulate_transaction, get_cached_simulation
 from simulate_pending import simulate_pending_transaction_tenderly
 from dotenv import load_dotenv
 from typing import List, Optional, Any
 from pydantic import BaseModel, Field, validator
 from tenacity import retry, stop_after_attempt, wait_exponential
-from categorize import categorize  # Import categorize function
+from categorize import categorize, categorization_service  # Import categorize function
 import time
 
 load_dotenv()
@@ -48,8 +49,6 @@ GOOGLE_SHEET_ID = os.getenv('GOOGLE_SHEET_ID')
 GOOGLE_WORKSHEET_NAME = os.getenv('GOOGLE_WORKSHEET_NAME')
 GCS_BUCKET_NAME = os.getenv('GCS_BUCKET_NAME')
 GCS_BUCKET = STORAGE_CLIENT.bucket(GCS_BUCKET_NAME)
-ANTHROPIC_API_KEY = os.getenv('ANTHROPIC_API_KEY')
-ANTHROPIC_CLIENT = AsyncAnthropic(api_key=ANTHROPIC_API_KEY)
 DEFAULT_MODEL = os.getenv('DEFAULT_MODEL')
 DEFAULT_MAX_TOKENS = 2000
 DEFAULT_TEMPERATURE = 0
@@ -152,6 +151,7 @@ class ExplainTransactionsRequest(BaseModel):
     max_tokens: int = DEFAULT_MAX_TOKENS
     temperature: float = DEFAULT_TEMPERATURE
     force_refresh: bool = False
+    hedge: Optional[bool] = None
     recaptcha_token: str
 
 class FeedbackForm(BaseModel):
@@ -286,12 +286,13 @@ async def simulate_pending_txs(transactions, network, store_result, force_refres
             raise HTTPException(status_code=500, detail=f"Error simulating transaction: {str(e)}")
     return result
 
-async def explain_txs(transactions, network, system_prompt, model, max_tokens, temperature, store_result, force_refresh=False):
+async def explain_txs(transactions, network, system_prompt, model, max_tokens, temperature, store_result, force_refresh=False, hedge=None):
     for transaction in transactions:
         if not force_refresh:
             tx_hash = transaction.get('hash')
             if tx_hash:
-                cached_explanation = await get_cached_explanation(tx_hash, network)
+                cached_explanation = await get_cached_explanation(tx_hash, network, system_prompt, model)
+                record_request('explain', network, tx_hash, bool(cached_explanation and cached_explanation.get('result')))
                 if cached_explanation:
                     explanation = cached_explanation.get('result')
                     if explanation:    
@@ -309,7 +310,7 @@ async def explain_txs(transactions, network, system_prompt, model, max_tokens, t
                         continue
         try:
             async for item in explain_transaction(
-                ANTHROPIC_CLIENT, transaction, network=network, system_prompt=system_prompt, model=model, max_tokens=max_tokens, temperature=temperature, store_result=store_result
+                llm_router, transaction, network=network, system_prompt=system_prompt, model=model, max_tokens=max_tokens, temperature=temperature, store_result=store_result, hedge=hedge
             ):
                 yield item
         except Exception as e:
@@ -351,11 +352,10 @@ async def explain_txs_chat(message, network, session_id, system_prompt, model, m
     message['temperature'] = temperature
     message['system']['system_prompt'] = system_prompt
     message = await truncate_json(message, 'calls', 1)
-    message['system'] = json.dumps(message['system'], indent=4) # Must be a string because Claude demands it
 
     try:
         async for word, usage in chat(
-            ANTHROPIC_CLIENT, message, network, session_id
+            llm_router, message, network, session_id
         ):
             yield word
         print("Usage: ", usage)
@@ -370,11 +370,10 @@ async def gen_questions(message, network, session_id, system_prompt, model, max_
     message['temperature'] = temperature
     message['system']['system_prompt'] = system_prompt
     message = await truncate_json(message, 'calls', 1)
-    message['system'] = json.dumps(message['system'], indent=4) # Must be a string because Claude demands it
 
     try:
         async for word, usage in chat(
-            ANTHROPIC_CLIENT, message, network, session_id
+            llm_router, message, network, session_id
         ):
             yield word
         print("Usage: ", usage)
@@ -457,7 +456,7 @@ async def explain_transactions(request: ExplainTransactionsRequest, _: str = Dep
         # Setting storage status to true
         store_result = True
         return StreamingResponse(
-            explain_txs(request.transactions, request.network, request.system, request.model, request.max_tokens, request.temperature, store_result ,request.force_refresh),
+            explain_txs(request.transactions, request.network, request.system, request.model, request.max_tokens, request.temperature, store_result ,request.force_refresh, request.hedge),
             media_type="text/plain"
         )
     except HTTPException as e:
@@ -465,6 +464,14 @@ async def explain_transactions(request: ExplainTransactionsRequest, _: str = Dep
     except Exception as e:
         raise HTTPException(status_code=400, detail="Invalid request payload")
 
+@app.get("/v1/llm/stats")
+async def get_llm_stats(_: str = Depends(authenticate)):
+    return llm_router.stats()
+
+@app.get("/v1/categorize/stats")
+async def get_categorize_stats(_: str = Depends(authenticate)):
+    return categorization_service.fast_path_stats.stats()
+
 @app.post("/v1/transaction/fetch_and_simulate")
 async def fetch_and_simulate_transaction(request: TransactionRequest, _: str = Depends(authenticate)):
     try: